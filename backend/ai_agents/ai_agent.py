@@ -1,7 +1,7 @@
 from __future__ import annotations
 import logging
-from typing import Any, Generator
-from google.generativeai import GenerativeModel, ChatSession
+from typing import Any, AsyncGenerator, Generator
+from google.generativeai import GenerativeModel, ChatSession, caching
 from google.generativeai.types import content_types, generation_types
 
 
@@ -16,12 +16,14 @@ class AIAgent:
         system_instruction: str = None,
         generation_config: dict[str, Any] = None,
         safety_settings: dict = None,
+        cached_content: caching.CachedContent = None,
     ) -> None:
         self._logger.debug(
             f"Initializing AI Agent with model {ai_model_name}\n{system_instruction}"
         )
         self.ai_model_name = ai_model_name
         self.system_instruction = system_instruction
+        self.cached_content = cached_content
         self.generation_config = generation_config or {
             "max_output_tokens": 8192,
             "temperature": 0,
@@ -39,7 +41,12 @@ class AIAgent:
         self.model = None
 
     def _initialize_model(self):
-        """Initialize the model."""
+        """Initialize the model.
+
+        With cached content, the system instruction is taken from the cache.
+        """
+        if self.cached_content:
+            return GenerativeModel.from_cached_content(self.cached_content)
         return GenerativeModel(
             self.ai_model_name,
             system_instruction=[self.system_instruction]
@@ -105,6 +112,15 @@ class AIAgentChatSession:
         for chunk in self.chat_session.send_message(message, stream=True):
             yield chunk
 
+    async def send_message_streaming_async(
+        self, message: str
+    ) -> AsyncGenerator[generation_types.AsyncGenerateContentResponse]:
+        """Send a message to the chat session and stream response
+        without blocking the event loop."""
+        response = await self.chat_session.send_message_async(message, stream=True)
+        async for chunk in response:
+            yield chunk
+
     def get_history(self) -> list[content_types.StrictContentType]:
         """Returns chat history which can be used to create next sesssion"""
         return self.chat_session.history
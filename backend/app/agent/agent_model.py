@@ -8,6 +8,10 @@ class Agent(BaseModel):
     ai_model_name: Optional[str] = None
     system_prompt: Optional[str] = None
     keywords: Optional[List[str]] = Field(default_factory=list)
+    cache_responses: Optional[bool] = False
+    """Answers to repeated first-turn prompts may be served from cache"""
+    model_fallback: Optional[bool] = False
+    """Equivalent model may be used when ai_model_name is slow or throttled"""
     """ Old version fields"""
     o_model_name: Optional[str] = Field(None, alias="model_name")
 
@@ -0,0 +1,32 @@
+"""Fire-and-forget tasks run after the response is sent."""
+
+import asyncio
+import logging
+from typing import Coroutine
+
+_log = logging.getLogger(__name__)
+_tasks: set[asyncio.Task] = set()
+
+
+def run_in_background(coro: Coroutine) -> asyncio.Task:
+    """Run coroutine as a background task.
+
+    The task is referenced until it is done, so it isn't garbage collected.
+    """
+    task = asyncio.create_task(coro)
+    _tasks.add(task)
+    task.add_done_callback(_on_done)
+    return task
+
+
+def _on_done(task: asyncio.Task) -> None:
+    _tasks.discard(task)
+    if not task.cancelled() and task.exception():
+        _log.error("Background task failed", exc_info=task.exception())
+
+
+async def wait_for_background_tasks(timeout: float = None) -> None:
+    """Wait for running background tasks (e.g. on shutdown)."""
+    if _tasks:
+        _log.debug("Waiting for %d background tasks", len(_tasks))
+        await asyncio.wait(set(_tasks), timeout=timeout)
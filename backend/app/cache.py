@@ -0,0 +1,75 @@
+"""In-process caches shared by requests of one worker."""
+
+import time
+from collections import OrderedDict
+from typing import Callable, Generic, Hashable, Iterator, Optional, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class TTLCache(Generic[K, V]):
+    """Bounded LRU cache with time-to-live of entries.
+
+    Args:
+        max_entries: The least recently used entry is evicted above it.
+        ttl_seconds: Entries older than it are treated as missing.
+        on_evict: Called with the key and the value evicted because
+            of the size limit (not for expired entries).
+    """
+
+    def __init__(
+        self,
+        max_entries: int,
+        ttl_seconds: float,
+        on_evict: Callable[[K, V], None] = None,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.on_evict = on_evict
+        self._entries: OrderedDict[K, tuple[float, V]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: K) -> Optional[V]:
+        """Return cached value or None if it is missing or expired."""
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key: K, value: V) -> None:
+        """Put value into the cache, evicting the least recently used one."""
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            old_key, (_, old_value) = self._entries.popitem(last=False)
+            if self.on_evict:
+                self.on_evict(old_key, old_value)
+
+    def pop(self, key: K) -> Optional[V]:
+        """Remove entry and return its value."""
+        entry = self._entries.pop(key, None)
+        return entry[1] if entry else None
+
+    def items(self) -> Iterator[tuple[K, V]]:
+        """Iterate over not expired entries (from the least recently used)."""
+        now = time.monotonic()
+        for key, (expires, value) in list(self._entries.items()):
+            if expires >= now:
+                yield key, value
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict[str, int]:
+        """Return hit/miss counters and the current size."""
+        return {"hits": self.hits, "misses": self.misses, "size": len(self)}
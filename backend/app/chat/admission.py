@@ -0,0 +1,125 @@
+"""Admission control of concurrent model calls."""
+
+import asyncio
+import contextlib
+import logging
+import time
+from collections import OrderedDict, deque
+from typing import AsyncIterator
+
+from app.metrics import metrics
+
+
+class AdmissionTimeoutError(TimeoutError):
+    def __init__(self, ai_model_name: str, timeout: float):
+        super().__init__(
+            f"Model {ai_model_name} is busy, the request waited {timeout}s in the queue."
+        )
+
+
+class FairLimiter:
+    """Concurrency limit with round-robin queueing between users.
+
+    When the limit is reached, requests wait in per-user queues and free
+    slots are granted to the users in turn, so one user with many requests
+    cannot starve the others.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        self._queues: OrderedDict[str, deque[asyncio.Future]] = OrderedDict()
+
+    def waiting_count(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    async def acquire(self, user: str, timeout: float = None) -> None:
+        """Wait for a free slot.
+
+        Raises:
+            TimeoutError: The slot wasn't granted within timeout.
+        """
+        if self.active < self.limit and not self._queues:
+            self.active += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(user, deque()).append(future)
+        try:
+            await asyncio.wait_for(future, timeout)
+        except BaseException:
+            if future.done() and not future.cancelled():
+                # Granted in the meantime
+                self.release()
+            else:
+                self._remove(user, future)
+            raise
+
+    def release(self) -> None:
+        """Free the slot and grant it to the next user in turn."""
+        self.active -= 1
+        while self.active < self.limit and self._queues:
+            user, queue = next(iter(self._queues.items()))
+            future = queue.popleft()
+            if queue:
+                self._queues.move_to_end(user)
+            else:
+                del self._queues[user]
+            if not future.done():
+                self.active += 1
+                future.set_result(None)
+
+    def _remove(self, user: str, future: asyncio.Future) -> None:
+        queue = self._queues.get(user)
+        if queue and future in queue:
+            queue.remove(future)
+            if not queue:
+                del self._queues[user]
+
+
+class AdmissionController:
+    """Per-model concurrency limits of model calls."""
+
+    _log = logging.getLogger(__name__)
+
+    def __init__(
+        self,
+        model_limits: dict[str, int] = None,
+        default_limit: int = 20,
+        queue_timeout_seconds: float = 30,
+    ):
+        self.model_limits = model_limits or {}
+        self.default_limit = default_limit
+        self.queue_timeout_seconds = queue_timeout_seconds
+        self._limiters: dict[str, FairLimiter] = {}
+
+    def limiter(self, ai_model_name: str) -> FairLimiter:
+        if ai_model_name not in self._limiters:
+            self._limiters[ai_model_name] = FairLimiter(
+                self.model_limits.get(ai_model_name, self.default_limit)
+            )
+        return self._limiters[ai_model_name]
+
+    @contextlib.asynccontextmanager
+    async def admit(self, ai_model_name: str, user: str) -> AsyncIterator[None]:
+        """Hold a slot of the model for the duration of the block.
+
+        Raises:
+            AdmissionTimeoutError: No slot within `queue_timeout_seconds`.
+        """
+        limiter = self.limiter(ai_model_name)
+        start = time.monotonic()
+        try:
+            await limiter.acquire(user, self.queue_timeout_seconds)
+        except TimeoutError:
+            metrics.inc("chat_admission_timeouts_total", model=ai_model_name)
+            raise AdmissionTimeoutError(ai_model_name, self.queue_timeout_seconds)
+        waited = time.monotonic() - start
+        metrics.inc("chat_admission_wait_seconds_total", waited, model=ai_model_name)
+        if waited > 1:
+            self._log.info(
+                "Request of %s waited %.1fs for %s", user, waited, ai_model_name
+            )
+        try:
+            yield
+        finally:
+            limiter.release()
@@ -0,0 +1,41 @@
+"""Archive of cold chat sessions in the file storage."""
+
+import contextlib
+import gzip
+
+from ampf.base import BaseFactory, KeyNotExistsException
+from google.api_core import exceptions
+
+from .chat_model import ChatSession
+
+
+class ChatArchive:
+    """Chat sessions stored as gzip compressed JSON blobs
+    (`users/{user}/chats/{chat_session_id}/session.json.gz`)."""
+
+    BLOB_NAME = "session.json.gz"
+
+    def __init__(self, factory: BaseFactory, compress_level: int = 6):
+        self.factory = factory
+        self.compress_level = compress_level
+
+    def _create_storage(self, user: str, chat_session_id: str):
+        return self.factory.create_blob_storage(f"users/{user}/chats/{chat_session_id}")
+
+    def save(self, chat_session: ChatSession) -> int:
+        """Save the session with its history. Returns the size of the blob."""
+        data = gzip.compress(
+            chat_session.model_dump_json().encode(), self.compress_level
+        )
+        self._create_storage(
+            chat_session.user, chat_session.chat_session_id
+        ).upload_blob(self.BLOB_NAME, data, content_type="application/gzip")
+        return len(data)
+
+    def load(self, user: str, chat_session_id: str) -> ChatSession:
+        data = self._create_storage(user, chat_session_id).download_blob(self.BLOB_NAME)
+        return ChatSession.model_validate_json(gzip.decompress(data))
+
+    def delete(self, user: str, chat_session_id: str) -> None:
+        with contextlib.suppress(exceptions.NotFound, KeyNotExistsException):
+            self._create_storage(user, chat_session_id).delete(self.BLOB_NAME)
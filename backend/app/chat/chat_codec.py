@@ -0,0 +1,39 @@
+"""Fast conversions of chat sessions on hot paths.
+
+Messages are converted between `ChatMessage` and its subclasses by
+validating their field values in one batch (nested models aren't dumped
+and validated again). Responses are serialized to JSON bytes directly by
+pydantic-core, instead of FastAPI's generic encoding (validation,
+conversion to JSON-able objects and `json.dumps`).
+"""
+
+from typing import Any, Iterable
+
+from fastapi import Response
+from pydantic import TypeAdapter
+
+from .chat_model import ChatSession, ChatSessionHeader
+from .message import ChatMessage
+
+MESSAGE_FIELDS = tuple(ChatMessage.model_fields)
+
+_messages_adapter = TypeAdapter(list[ChatMessage])
+_headers_adapter = TypeAdapter(list[ChatSessionHeader])
+
+
+def message_fields(message: ChatMessage) -> dict[str, Any]:
+    """Values of `ChatMessage` fields of the message (or its subclass)."""
+    return {name: getattr(message, name) for name in MESSAGE_FIELDS}
+
+
+def to_messages(messages: Iterable[ChatMessage]) -> list[ChatMessage]:
+    """Convert messages of `ChatMessage` subclasses to `ChatMessage`."""
+    return _messages_adapter.validate_python([message_fields(m) for m in messages])
+
+
+def chat_session_response(chat_session: ChatSession) -> Response:
+    return Response(chat_session.model_dump_json(), media_type="application/json")
+
+
+def headers_response(headers: list[ChatSessionHeader]) -> Response:
+    return Response(_headers_adapter.dump_json(headers), media_type="application/json")
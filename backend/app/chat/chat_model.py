@@ -1,7 +1,7 @@
 from datetime import datetime
 from typing import Optional
 from uuid import uuid4
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, model_validator
 
 from .message import ChatMessage
 
@@ -11,7 +11,32 @@ class ChatSessionHeader(BaseModel):
     user: Optional[str] = Field("")
     created: datetime = Field(default_factory=lambda: datetime.now())
     summary: Optional[str] = Field("")
+    message_count: Optional[int] = Field(0)
+    updated: Optional[datetime] = None
 
 
 class ChatSession(ChatSessionHeader):
     history: list[ChatMessage] = Field(default_factory=list)
+    history_summary: Optional[str] = Field("")
+    summarized_count: Optional[int] = Field(0)
+    archived: Optional[bool] = None
+    """The history is in the archive (see `ChatArchive`)."""
+
+
+class ChatDeleteRequest(BaseModel):
+    """Selection of the user's chat sessions to delete (both criteria
+    have to match if both are given)."""
+
+    ids: Optional[list[str]] = None
+    older_than: Optional[datetime] = None
+
+    @model_validator(mode="after")
+    def check_criteria(self) -> "ChatDeleteRequest":
+        if self.ids is None and self.older_than is None:
+            raise ValueError("Either ids or older_than is required.")
+        return self
+
+
+class ChatDeleteProgress(BaseModel):
+    deleted: int
+    total: int
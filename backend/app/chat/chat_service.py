@@ -1,20 +1,37 @@
+import contextlib
 import logging
-from typing import AsyncIterator
+import asyncio
+import time
+from datetime import datetime
+from typing import AsyncIterator, Iterator, Optional
 from pydantic import BaseModel
 
 from google.api_core import exceptions
-from google.cloud import firestore
-from google.generativeai.types import ContentDict, BlobDict
+from google.generativeai.types import ContentDict
 
 from ai_agents import AIAgent
 from ampf.base import BaseFactory, BaseBlobStorage
 from app.agent.agent_model import Agent
+from app.background_tasks import run_in_background
+from app.cache import TTLCache
 from app.knowledge_base import KnowledgeBaseStorage
 from haintech.ai import AiFactory
 
 from app.config import ServerConfig
+from app.metrics import metrics
 from haintech.ai.base.base_ai_text_embedding_model import BaseAITextEmbeddingModel
-from .chat_model import ChatSessionHeader, ChatSession
+from .chat_model import ChatDeleteProgress, ChatSessionHeader, ChatSession
+from .admission import AdmissionController
+from .chat_session_storage import ChatSessionStorage
+from .context_cache import ContextCache
+from .model_router import ModelRouter
+from .request_coalescer import RequestCoalescer
+from .response_cache import ResponseCache
+from .search_index import ChatSearchIndex, ChatSearchResult
+from .session_write_queue import SessionWriteQueue
+from .file_stager import BaseBlobCopier, ChatFileStager, StorageBlobCopier
+from .history_manager import ChatHistoryManager
+from .title_generator import ChatTitleGenerator
 from .message import ChatMessage, ChatMessageFile
 
 
@@ -31,6 +48,9 @@ class ChatSessionUserError(ValueError):
 class ChatService:
     """Service for chat."""
 
+    DELETE_BATCH_SIZE = 100
+    """Chat sessions deleted at once by `delete_chats`."""
+
     _log = logging.getLogger(__name__)
 
     def __init__(
@@ -41,19 +61,51 @@ class ChatService:
         session_files_storage: BaseBlobStorage,
         config: ServerConfig,
         user_email: str,
+        blob_copier: BaseBlobCopier = None,
+        context_cache: ContextCache = None,
+        response_cache: ResponseCache = None,
+        request_coalescer: RequestCoalescer = None,
+        model_router: ModelRouter = None,
+        admission_controller: AdmissionController = None,
+        session_write_queue: SessionWriteQueue = None,
+        search_index_cache: TTLCache = None,
+        query_embedding_cache: TTLCache = None,
     ):
         self.factory = factory
         self.ai_factory = ai_factory
         self.role = ""
-        self.storage = factory.create_storage(
-            "ChatSessions", ChatSession, key_name="chat_session_id"
+        self.storage = ChatSessionStorage(
+            factory,
+            append_only=config.chat.append_only_history,
+            header_index=config.chat.header_index,
         )
         self.knowledge_base_storage = KnowledgeBaseStorage(
             embedding_model,
             embedding_search_limit=config.knowledge_base.embedding_search_limit,
+            embedding_cache=query_embedding_cache,
         )
         self.session_files_storage = session_files_storage
         self.user_email = user_email
+        self.blob_copier = blob_copier or StorageBlobCopier(factory)
+        self.file_stager = ChatFileStager(self.blob_copier, user_email)
+        self.context_cache = context_cache
+        self.response_cache = response_cache
+        self.request_coalescer = request_coalescer
+        self.model_router = model_router
+        self.admission_controller = admission_controller
+        self.session_write_queue = session_write_queue
+        self.search_index = ChatSearchIndex(factory, search_index_cache)
+        self.metrics_agents = set(config.chat.metrics_agents)
+        self.history_manager = ChatHistoryManager(
+            config.chat.history_token_budget,
+            AIAgent(ai_model_name=config.chat.summary_model),
+        )
+        self.title_generator = ChatTitleGenerator(
+            AIAgent(ai_model_name=config.chat.title_model)
+            if config.chat.title_model
+            else None,
+            max_length=config.chat.title_max_length,
+        )
 
     def get_answer(
         self, ai_model_name: str, history: list[ChatMessage], message: ChatMessage
@@ -75,126 +127,516 @@ class ChatService:
         ai_model_name: str = None,
         chat_session: ChatSession = None,
     ) -> AsyncIterator[StreamedEvent]:
-        """Get an answer from the model."""
-        file_names = {}
-        in_history = []
+        """Get an answer from the model.
+
+        If the stream is cancelled (the client disconnected), the partial
+        answer is saved marked as interrupted.
+        """
         if not chat_session:
             chat_session = ChatSession()
-        if chat_session.history:
-            for m in chat_session.history:
-                in_history.append(m.to_content())
-                for f in m.files:
-                    file_names[f.url] = f.name
         if agent:
             ai_model_name = agent.ai_model_name
+        tags = self.metric_tags(agent, ai_model_name)
+        start = time.monotonic()
         try:
-            context = await self.get_context(message.content, agent)
-            ai_agent = AIAgent(ai_model_name=ai_model_name, system_instruction=context)
-            chat = ai_agent.start_chat(history=in_history)
-            parts = [message.content]
-            chat_files_storage = self.factory.create_blob_storage(
-                f"users/{self.user_email}/chats/{chat_session.chat_session_id}/files"
+            summary, window = self.history_manager.get_window(chat_session)
+            first_turn = self._is_first_turn_prompt(agent, chat_session, files)
+            cacheable = bool(
+                first_turn and self.response_cache and agent.cache_responses
+            )
+            cached_answer = (
+                await self.response_cache.get(agent, ai_model_name, message.content)
+                if cacheable
+                else None
             )
-            # Iterate over the user (session) files
-            for file in files:
-                # Move the file to the chat session directory
-                # file_name = f"users/{self.user_email}/session_files/{file.name}"
-                chat_blob_name = f"users/{self.user_email}/chats/{chat_session.chat_session_id}/files/{file.name}"
-                # file.url = chat_blob_name
-                self._log.debug("Moving file %s to %s", file.name, chat_blob_name)
-                blob_data = self.session_files_storage.download_blob(file.name)
-                chat_files_storage.upload_blob(
-                    file.name, blob_data, content_type=file.mime_type
-                )
-                # Create a part with the file content
-                blob_dict = BlobDict(mime_type=file.mime_type, data=blob_data)
-                parts.append(blob_dict)
-            content = ContentDict(role="user", parts=parts)
             chat_session.history.append(
                 ChatMessage(author="user", content=message.content, files=files)
             )
-            self._log.debug("Sending message: %s", content)
-            responses = chat.send_message_streaming(content)
-            for response in responses:
-                if response.text:
-                    self._log.debug("Received response: %s", response.text)
-                    yield StreamedEvent(type="text", value=response.text)
-                else:
-                    self._log.debug("Received response: %s", response)
-                # await asyncio.sleep(0.1)
-            out_message = ChatMessage.from_content(chat.get_history()[-1], file_names)
-            chat_session.history.append(out_message)
-            if not chat_session.summary:
-                chat_session.summary = chat_session.history[0].content
-            self.storage.save(chat_session)
+            if cached_answer is not None:
+                self._log.debug("Replaying cached answer")
+                source = "cache"
+                texts = self.response_cache.replay(cached_answer)
+            elif first_turn and self.request_coalescer:
+                source = "shared"
+                texts = self.request_coalescer.stream(
+                    self._prompt_key(agent, ai_model_name, message.content),
+                    lambda: self._generate(
+                        message, files, agent, ai_model_name, chat_session, "", []
+                    ),
+                )
+            else:
+                source = "model"
+                texts = self._generate(
+                    message, files, agent, ai_model_name, chat_session, summary, window
+                )
+            answer: list[str] = []
+            metrics.add("chat_streams_active", 1)
+            try:
+                async for text in texts:
+                    if not answer:
+                        metrics.observe(
+                            "chat_ttft_seconds",
+                            time.monotonic() - start,
+                            source=source,
+                            **tags,
+                        )
+                    answer.append(text)
+                    yield StreamedEvent(type="text", value=text)
+            except (asyncio.CancelledError, GeneratorExit):
+                self._log.info(
+                    "Answer interrupted in chat session %s",
+                    chat_session.chat_session_id,
+                )
+                metrics.inc("chat_streams_cancelled_total", model=ai_model_name)
+                self._save_answer(
+                    chat_session, "".join(answer), interrupted=True, tags=tags
+                )
+                raise
+            finally:
+                metrics.add("chat_streams_active", -1)
+            self._observe_generation(start, answer, source, tags)
+            self._save_answer(chat_session, "".join(answer), tags=tags)
+            if cacheable and cached_answer is None and answer:
+                await self.response_cache.put(
+                    agent, ai_model_name, message.content, "".join(answer)
+                )
         except Exception as e:
             self._log.exception("Error in get_answer_async: %s", e)
             yield StreamedEvent(type=f"error:{type(e).__name__}", value=str(e))
 
-    async def get_context(self, text: str, agent: Agent = None) -> str:
-        """Get the context of the chat session."""
-        if agent:
-            context = agent.system_prompt + "\n\n"
-            keywords = agent.keywords
-        elif self.role:
-            context = self.role + "\n\n"
-            keywords = None
+    def metric_tags(self, agent: Agent, ai_model_name: str) -> dict[str, str]:
+        """Tags of chat metrics (used for all of them, so they are bounded)."""
+        # Agents are named by users, only the configured ones get own series
+        if not agent:
+            agent_tag = None
+        elif agent.name in self.metrics_agents:
+            agent_tag = agent.name
+        else:
+            agent_tag = "other"
+        return {"model": ai_model_name, "agent": agent_tag}
+
+    @staticmethod
+    def _observe_generation(
+        start: float, answer: list[str], source: str, tags: dict[str, str]
+    ) -> None:
+        """Record duration and chunk count of the answer."""
+        elapsed = time.monotonic() - start
+        metrics.observe("chat_generation_seconds", elapsed, source=source, **tags)
+        metrics.observe("chat_chunks", len(answer), source=source, **tags)
+
+    def _is_first_turn_prompt(
+        self, agent: Agent, chat_session: ChatSession, files: list[ChatMessageFile]
+    ) -> bool:
+        """Whether the answer depends only on the agent, model and prompt.
+
+        Such requests can be answered from cache or share one generation.
+        """
+        return bool(agent and not chat_session.history and not files)
+
+    @staticmethod
+    def _prompt_key(agent: Agent, ai_model_name: str, prompt: str) -> tuple:
+        return (
+            *ResponseCache.agent_key(agent),
+            ai_model_name,
+            ResponseCache.normalize(prompt),
+        )
+
+    async def _generate(
+        self,
+        message: ChatMessage,
+        files: list[ChatMessageFile],
+        agent: Agent,
+        ai_model_name: str,
+        chat_session: ChatSession,
+        summary: str,
+        window: list[ChatMessage],
+    ) -> AsyncIterator[str]:
+        """Send the message with its context to the model and stream the answer."""
+        tags = self.metric_tags(agent, ai_model_name)
+
+        async def stage_files() -> list:
+            with metrics.timer("chat_stage_seconds", stage="file_staging", **tags):
+                return await self.file_stager.stage(chat_session.chat_session_id, files)
+
+        instruction = self._get_instruction(agent)
+        # Retrieval and file staging don't depend on each other
+        knowledge, file_parts = await asyncio.gather(
+            self._get_knowledge(message.content, agent, ai_model_name), stage_files()
+        )
+        if summary:
+            knowledge += "\n\n# Summary of the earlier conversation\n" + summary
+        content = ContentDict(role="user", parts=[message.content, *file_parts])
+        # Empty answers saved by earlier versions are skipped
+        history = [m.to_content() for m in window if m.content or m.files]
+
+        def generate(model: str) -> AsyncIterator[str]:
+            return self._stream_model(
+                model, agent, instruction, knowledge, history, content
+            )
+
+        async with contextlib.AsyncExitStack() as stack:
+            if self.model_router:
+                # The router admits the call before it starts timing the model
+                fallback = bool(agent and agent.model_fallback)
+                texts = self.model_router.stream(
+                    ai_model_name, generate, fallback, admit=self._admit
+                )
+            else:
+                await stack.enter_async_context(self._admit(ai_model_name))
+                texts = generate(ai_model_name)
+            async for text in texts:
+                yield text
+
+    async def _stream_model(
+        self,
+        ai_model_name: str,
+        agent: Agent,
+        instruction: str,
+        knowledge: str,
+        history: list[ContentDict],
+        content: ContentDict,
+    ) -> AsyncIterator[str]:
+        """Stream the answer of the given model (the caller admits the call).
+
+        Args:
+            instruction: Instruction of the agent, the same in every turn.
+            knowledge: Context of this turn (knowledge base, summary).
+        """
+        cached_content = (
+            await self.context_cache.get(agent.name, ai_model_name, instruction)
+            if self.context_cache and agent
+            else None
+        )
+        if cached_content:
+            # Only the instruction is cached, the context of the turn is
+            # sent with the message
+            system_instruction = None
+            if knowledge:
+                content = ContentDict(role="user", parts=[knowledge, *content["parts"]])
         else:
-            context = ""
-            keywords = None
-        neartest = await self.knowledge_base_storage.find_nearest(f"{text}", keywords)
+            system_instruction = instruction + knowledge
+        ai_agent = AIAgent(
+            ai_model_name=ai_model_name,
+            system_instruction=system_instruction,
+            cached_content=cached_content,
+        )
+        chat = ai_agent.start_chat(history=history)
+        self._log.debug("Sending message to %s: %s", ai_model_name, content)
+        start = time.monotonic()
+        usage = None
+        async for response in chat.send_message_streaming_async(content):
+            # The last chunk has the token count of the whole answer
+            usage = getattr(response, "usage_metadata", None) or usage
+            if response.text:
+                self._log.debug("Received response: %s", response.text)
+                yield response.text
+            else:
+                self._log.debug("Received response: %s", response)
+        self._observe_output_tokens(agent, ai_model_name, start, usage)
+
+    def _observe_output_tokens(
+        self, agent: Agent, ai_model_name: str, start: float, usage
+    ) -> None:
+        """Record output rate of the model from the token count it reported."""
+        elapsed = time.monotonic() - start
+        tokens = usage.candidates_token_count if usage else 0
+        if tokens and elapsed > 0:
+            metrics.observe(
+                "chat_output_tokens_per_second",
+                tokens / elapsed,
+                **self.metric_tags(agent, ai_model_name),
+            )
+
+    def _admit(self, ai_model_name: str) -> contextlib.AbstractAsyncContextManager:
+        """Slot of the model for one call (no limit without a controller)."""
+        if not self.admission_controller:
+            return contextlib.nullcontext()
+        return self.admission_controller.admit(ai_model_name, self.user_email)
+
+    def _save_answer(
+        self,
+        chat_session: ChatSession,
+        answer: str,
+        interrupted: bool = False,
+        tags: dict[str, str] = None,
+    ) -> None:
+        """Append the answer to the chat session and persist it
+        (in the background if there is a write queue)."""
+        # The model rejects empty messages (e.g. interrupted before the first
+        # chunk) in the history
+        if answer:
+            chat_session.history.append(
+                ChatMessage(author="ai", content=answer, interrupted=interrupted)
+            )
+        first_answer = not chat_session.summary
+        if first_answer:
+            chat_session.summary = self.title_generator.truncate(
+                chat_session.history[0].content
+            )
+        # The queue writes later (timed as chat_session_write_seconds)
+        stage = "enqueue" if self.session_write_queue else "persistence"
+        with metrics.timer("chat_stage_seconds", stage=stage, **(tags or {})):
+            if self.session_write_queue:
+                self.session_write_queue.save(self.storage, chat_session)
+            else:
+                self.storage.save(chat_session)
+        run_in_background(asyncio.to_thread(self.search_index.update, chat_session))
+        if self.history_manager.needs_summary(chat_session):
+            run_in_background(self._summarize_history(chat_session))
+        if (
+            first_answer
+            and answer
+            and not interrupted
+            and self.title_generator.title_agent
+        ):
+            run_in_background(self._generate_title(chat_session.model_copy(), answer))
+
+    async def _summarize_history(self, chat_session: ChatSession) -> None:
+        """Fold old messages into the rolling summary and persist it."""
+        summarized_count = chat_session.summarized_count
+        try:
+            async with self._admit(self.history_manager.summary_agent.ai_model_name):
+                await self.history_manager.summarize(chat_session)
+        finally:
+            # Chunks summarized before a failure are kept
+            if chat_session.summarized_count != summarized_count:
+                if self.session_write_queue:
+                    self.session_write_queue.update_summary(self.storage, chat_session)
+                else:
+                    self.storage.update_summary(chat_session)
+
+    async def _generate_title(self, chat_session: ChatSession, answer: str) -> None:
+        """Replace the truncated first message with a generated title."""
+        async with self._admit(self.title_generator.title_agent.ai_model_name):
+            title = await self.title_generator.generate(
+                chat_session.history[0].content, answer
+            )
+        if not title:
+            return
+        chat_session.summary = title
+        if self.session_write_queue:
+            self.session_write_queue.update_title(self.storage, chat_session)
+        else:
+            self.storage.update_title(chat_session)
+
+    async def get_context(
+        self, text: str, agent: Agent = None, ai_model_name: str = None
+    ) -> str:
+        """Get the context of the chat session.
+
+        The model name is only used to tag metrics.
+        """
+        instruction = self._get_instruction(agent)
+        return instruction + await self._get_knowledge(text, agent, ai_model_name)
+
+    def _get_instruction(self, agent: Agent = None) -> str:
+        """Instruction of the agent (or the role) starting the context."""
+        if agent:
+            return agent.system_prompt + "\n\n"
+        if self.role:
+            return self.role + "\n\n"
+        return ""
+
+    async def _get_knowledge(
+        self, text: str, agent: Agent = None, ai_model_name: str = None
+    ) -> str:
+        """Knowledge base items relevant to the text."""
+        tags = self.metric_tags(agent, ai_model_name)
+        keywords = agent.keywords if agent else None
+        context = ""
+        with metrics.timer("chat_stage_seconds", stage="embedding", **tags):
+            embedding = await self.knowledge_base_storage.get_query_embedding(text)
+        with metrics.timer("chat_stage_seconds", stage="vector_search", **tags):
+            neartest = await self.knowledge_base_storage.find_nearest_to_embedding(
+                embedding, keywords
+            )
         for n in neartest:
             context += "\n\n# " + n.title + "\n" + n.content + "\n\n"
         return context
 
     async def get_all(self, user: str) -> list[ChatSessionHeader]:
         """Get all chat sessions for the user."""
-        ret = [
+        headers, _ = await self.get_page(user)
+        return headers
+
+    async def get_page(
+        self, user: str, page_size: int = None, cursor: str = None
+    ) -> tuple[list[ChatSessionHeader], Optional[str]]:
+        """Get a page of the user's chat sessions, the newest first.
+
+        Returns:
+            Headers and the cursor of the next page (None on the last page).
+        """
+        headers, next_cursor = await asyncio.to_thread(
+            self.storage.get_headers, user, page_size, cursor
+        )
+        if self.session_write_queue and not cursor:
+            # Sessions which are not written yet are the newest ones
+            by_id = {h.chat_session_id: h for h in headers}
+            by_id.update(
+                (s.chat_session_id, s)
+                for s in self.session_write_queue.get_all()
+                if s.user == user
+            )
+            headers = sorted(by_id.values(), key=lambda h: h.created, reverse=True)
+        return [
             ChatSessionHeader(
-                chat_session_id=s.chat_session_id,
-                user=s.user,
-                created=s.created,
-                summary=s.summary,
+                chat_session_id=h.chat_session_id,
+                user=h.user,
+                created=h.created,
+                # Sessions created before titles were bounded
+                summary=self.title_generator.truncate(h.summary),
+                message_count=h.message_count,
+                updated=h.updated,
             )
-            for s in self.storage.get_all([("created", firestore.Query.DESCENDING)])
-            if s.user == user
-        ]
-        return ret
+            for h in headers
+        ], next_cursor
+
+    async def search(
+        self, user: str, query: str, limit: int = 20
+    ) -> list[ChatSearchResult]:
+        """Search the user's chat sessions by the text of their messages."""
+        return await asyncio.to_thread(self.search_index.search, user, query, limit)
 
     def get(self, chat_session_id: str, user: str) -> ChatSession:
         """Get chat history by id."""
         if chat_session_id == "_NEW_":
             chat_session = ChatSession(user=user)
         else:
-            chat_session = self.storage.get(chat_session_id)
+            chat_session = self._find(chat_session_id)
             if chat_session and chat_session.user != user:
                 raise ChatSessionUserError()
         return chat_session
 
+    def export(
+        self, user: str, chat_session_ids: list[str] = None
+    ) -> Iterator[ChatSession]:
+        """Iterate over chat sessions of the user with their history.
+
+        Sessions are read one at a time, as the iterator is consumed
+        (archived ones are read from the archive, they aren't restored).
+        Sessions which don't exist or belong to another user are skipped.
+        """
+        if not chat_session_ids:
+            headers, _ = self.storage.get_headers(user)
+            chat_session_ids = [h.chat_session_id for h in headers]
+        for chat_session_id in chat_session_ids:
+            chat_session = self._find(chat_session_id, restore=False)
+            if not chat_session or chat_session.user != user:
+                self._log.warning("Chat session not exported: %s", chat_session_id)
+                continue
+            yield chat_session
+
+    def _find(self, chat_session_id: str, restore: bool = True) -> ChatSession:
+        """Get chat session, also one which is waiting to be written.
+
+        Args:
+            restore: Restore an archived session (otherwise it is only read).
+        """
+        if self.session_write_queue:
+            chat_session = self.session_write_queue.get(chat_session_id)
+            if chat_session:
+                return chat_session
+        return self.storage.get(chat_session_id, restore)
+
     async def update_chat(
         self, chat_session_id: str, chat_session: ChatSession, user: str
     ) -> None:
-        old_session = self.storage.get(chat_session_id)
+        old_session = self.get(chat_session_id, user)
         if old_session.user != user:
             raise ChatSessionUserError()
-        return self.storage.save(chat_session)
+        if self.session_write_queue:
+            # The queued version mustn't overwrite the rewritten session
+            await self.session_write_queue.discard(chat_session_id)
+        self.storage.put(chat_session)
+        run_in_background(
+            asyncio.to_thread(
+                self.search_index.update,
+                chat_session.model_copy(update={"user": user}),
+                reindex=True,
+            )
+        )
 
     async def delete_chat(self, chat_session_id: str, user: str) -> None:
         """Delete chat history by id."""
-        chat_session = self.storage.get(chat_session_id)
+        chat_session = self._find(chat_session_id)
         if not chat_session:
             self._log.warning("Chat session not found: %s", chat_session_id)
             return
         if chat_session.user != user:
             raise ChatSessionUserError()
-        chat_session = self.storage.get(chat_session_id)
-        chat_files_storage = self.factory.create_blob_storage(
-            f"users/{self.user_email}/chats/{chat_session.chat_session_id}/files"
+        if self.session_write_queue:
+            await self.session_write_queue.discard(chat_session_id)
+        await asyncio.to_thread(self._delete_files, chat_session_id, chat_session)
+        self.search_index.delete(user, chat_session_id)
+        return self.storage.delete(chat_session_id, user)
+
+    async def delete_chats(
+        self,
+        user: str,
+        chat_session_ids: list[str] = None,
+        older_than: datetime = None,
+    ) -> AsyncIterator[ChatDeleteProgress]:
+        """Delete the user's chat sessions with given ids and/or created
+        before the date.
+
+        Sessions are deleted in batches of `DELETE_BATCH_SIZE`, files of
+        sessions of a batch concurrently. The progress is yielded before
+        the first and after each batch.
+        """
+        headers, _ = await asyncio.to_thread(self.storage.get_headers, user)
+        if self.session_write_queue:
+            headers += [s for s in self.session_write_queue.get_all() if s.user == user]
+        if chat_session_ids is not None:
+            chat_session_ids = set(chat_session_ids)
+        if older_than:
+            older_than = self._aware(older_than)
+        selected = list(
+            {
+                h.chat_session_id: None
+                for h in headers
+                if (chat_session_ids is None or h.chat_session_id in chat_session_ids)
+                and (older_than is None or self._aware(h.created) < older_than)
+            }
         )
+        yield ChatDeleteProgress(deleted=0, total=len(selected))
+        for start in range(0, len(selected), self.DELETE_BATCH_SIZE):
+            batch = selected[start : start + self.DELETE_BATCH_SIZE]
+            if self.session_write_queue:
+                await asyncio.gather(
+                    *[self.session_write_queue.discard(i) for i in batch]
+                )
+            await asyncio.gather(
+                *[asyncio.to_thread(self._delete_chat_data, i, user) for i in batch]
+            )
+            await asyncio.to_thread(self.storage.delete_many, batch, user)
+            yield ChatDeleteProgress(deleted=start + len(batch), total=len(selected))
+
+    @staticmethod
+    def _aware(value: datetime) -> datetime:
+        """Naive datetimes are in local time (as `ChatSession.created`)."""
+        return value if value.tzinfo else value.astimezone()
+
+    def _delete_chat_data(self, chat_session_id: str, user: str) -> None:
+        self._delete_files(chat_session_id)
+        self.search_index.delete(user, chat_session_id)
+
+    def _delete_files(
+        self, chat_session_id: str, chat_session: ChatSession = None
+    ) -> None:
+        """Delete blobs of the chat session, by prefix if the storage can
+        list them, otherwise files attached to its messages one by one."""
+        prefix = f"users/{self.user_email}/chats/{chat_session_id}/"
+        if self.blob_copier.delete_prefix(prefix):
+            return
+        chat_session = chat_session or self._find(chat_session_id, restore=False)
+        if not chat_session:
+            return
+        self.storage.archive.delete(self.user_email, chat_session_id)
+        chat_files_storage = self.factory.create_blob_storage(prefix + "files")
         for message in chat_session.history:
             for file in message.files:
                 try:
                     chat_files_storage.delete(file.name)
                 except exceptions.NotFound:
                     pass
-        return self.storage.delete(chat_session_id)
@@ -0,0 +1,388 @@
+import logging
+from datetime import datetime
+from typing import Callable, Iterator, Optional
+
+from ampf.base import BaseFactory
+from pydantic import TypeAdapter
+
+from app.metrics import metrics
+
+from .chat_archive import ChatArchive
+from .chat_codec import message_fields, to_messages
+from .chat_model import ChatSession, ChatSessionHeader
+from .message import ChatMessage
+from .session_queries import SessionBatch, SessionQueries, create_session_queries
+
+
+class ChatMessageRecord(ChatMessage):
+    """Chat message stored in the session's messages subcollection."""
+
+    message_id: str
+
+    @classmethod
+    def key(cls, index: int) -> str:
+        """Zero-padded key, so records sort in message order."""
+        return f"{index:06d}"
+
+    @classmethod
+    def from_messages(
+        cls, messages: list[ChatMessage], start: int = 0
+    ) -> list["ChatMessageRecord"]:
+        """Records of messages from the start index (validated in one batch)."""
+        return _records_adapter.validate_python(
+            [
+                {**message_fields(m), "message_id": cls.key(i)}
+                for i, m in enumerate(messages[start:], start)
+            ]
+        )
+
+
+_records_adapter = TypeAdapter(list[ChatMessageRecord])
+
+
+class ChatSessionStorage:
+    """Storage for chat sessions.
+
+    In append-only mode the session document holds only the header
+    (`history` is empty) and messages are kept in the `messages`
+    subcollection, one document per message. Saving a session writes
+    only messages added since the last save plus the header.
+    Sessions saved in the legacy format (whole history in one document)
+    are read as they are and migrated on the next save.
+
+    Headers of sessions are also kept in the per-user header index
+    (`users/{user}/chat_headers`), which serves the chat list when
+    `header_index` is on (after `rebuild_header_index`).
+
+    Sessions not updated for some time can be archived: their history is
+    moved to a compressed blob and only the session document (a stub with
+    `archived` set) stays in Firestore. They are restored when they are
+    read.
+    """
+
+    HEADER_FIELDS = list(ChatSessionHeader.model_fields)
+
+    _log = logging.getLogger(__name__)
+
+    def __init__(
+        self,
+        factory: BaseFactory,
+        append_only: bool = True,
+        header_index: bool = False,
+        queries: SessionQueries = None,
+    ):
+        self.factory = factory
+        self.append_only = append_only
+        self.header_index = header_index
+        self.sessions = factory.create_storage(
+            "ChatSessions", ChatSession, key_name="chat_session_id"
+        )
+        self.archive = ChatArchive(factory)
+        self.queries = queries or create_session_queries(self.sessions)
+
+    def _create_messages_storage(self, chat_session_id: str):
+        return self.factory.create_storage(
+            f"ChatSessions/{chat_session_id}/messages",
+            ChatMessageRecord,
+            key_name="message_id",
+        )
+
+    def get(self, chat_session_id: str, restore: bool = True) -> ChatSession:
+        """Get chat session with its history.
+
+        Args:
+            restore: Write the history of an archived session back
+                (otherwise it is only read from the archive).
+        """
+        chat_session = self.sessions.get(chat_session_id)
+        if chat_session and chat_session.archived:
+            return self._restore(chat_session, restore)
+        return self._with_history(chat_session)
+
+    def _with_history(self, chat_session: Optional[ChatSession]) -> ChatSession:
+        if chat_session and not chat_session.history and chat_session.message_count:
+            chat_session.history = self._load_messages(chat_session.chat_session_id)
+        return chat_session
+
+    def _restore(self, stub: ChatSession, write: bool) -> ChatSession:
+        archived = self.archive.load(stub.user, stub.chat_session_id)
+        # Fields of the stub may have been updated after archiving
+        chat_session = stub.model_copy(
+            update={"history": archived.history, "archived": None}
+        )
+        if write:
+            self.put(chat_session)
+            self.archive.delete(stub.user, stub.chat_session_id)
+            metrics.inc("chat_sessions_restored_total")
+            self._log.debug("Restored chat session %s", stub.chat_session_id)
+        return chat_session
+
+    def _load_messages(self, chat_session_id: str) -> list[ChatMessage]:
+        records = sorted(
+            self._create_messages_storage(chat_session_id).get_all(),
+            key=lambda r: r.message_id,
+        )
+        return to_messages(records)
+
+    def get_all(self, sort: list = None) -> Iterator[ChatSession]:
+        """Get all chat session documents.
+
+        In append-only mode the history of returned sessions is not loaded.
+        """
+        return self.sessions.get_all(sort)
+
+    def _create_headers_storage(self, user: str):
+        return self.factory.create_storage(
+            f"users/{user}/chat_headers", ChatSessionHeader, key_name="chat_session_id"
+        )
+
+    def get_headers(
+        self, user: str, limit: int = None, cursor: str = None
+    ) -> tuple[list[ChatSessionHeader], Optional[str]]:
+        """Get headers of the user's chat sessions, the newest first.
+
+        With `header_index` they are read from the user's header index,
+        otherwise the sessions are filtered by user and only header fields
+        are read.
+
+        Args:
+            user: The owner of the sessions.
+            limit: The page size (all sessions if None).
+            cursor: The id of the last session of the previous page.
+        Returns:
+            Headers and the cursor of the next page (None on the last page).
+        """
+        headers = self.queries.find(
+            self._create_headers_storage(user) if self.header_index else self.sessions,
+            ChatSessionHeader,
+            fields=self.HEADER_FIELDS,
+            user=None if self.header_index else user,
+            newest_first=True,
+            # One more to know whether there is a next page
+            limit=limit + 1 if limit else None,
+            cursor=cursor,
+        )
+        if limit and len(headers) > limit:
+            return headers[:limit], headers[limit - 1].chat_session_id
+        return headers, None
+
+    @classmethod
+    def _to_header(cls, chat_session: ChatSessionHeader) -> ChatSessionHeader:
+        return ChatSessionHeader(
+            **{f: getattr(chat_session, f) for f in cls.HEADER_FIELDS}
+        )
+
+    def save(self, chat_session: ChatSession) -> None:
+        """Save chat session.
+
+        `chat_session.message_count` is the number of already persisted
+        messages, only messages after it are written.
+        """
+        if not self.append_only:
+            chat_session.message_count = len(chat_session.history)
+            self._write_document(chat_session, chat_session)
+            return
+        self._put_messages(chat_session, chat_session.message_count or 0)
+        self._put_header(chat_session)
+
+    def put(self, chat_session: ChatSession) -> None:
+        """Rewrite the whole chat session (e.g. after editing its history)."""
+        if not self.append_only:
+            self.save(chat_session)
+            return
+        old_session = self.sessions.get(chat_session.chat_session_id)
+        old_count = old_session.message_count if old_session else 0
+        self._put_messages(chat_session, 0)
+        messages = self._create_messages_storage(chat_session.chat_session_id)
+        for index in range(len(chat_session.history), old_count or 0):
+            messages.delete(ChatMessageRecord.key(index))
+        self._put_header(chat_session)
+
+    def _put_messages(self, chat_session: ChatSession, start: int) -> None:
+        messages = self._create_messages_storage(chat_session.chat_session_id)
+        for record in ChatMessageRecord.from_messages(chat_session.history, start):
+            messages.put(record.message_id, record)
+        self._log.debug(
+            "Saved %d messages of chat session %s",
+            len(chat_session.history) - start,
+            chat_session.chat_session_id,
+        )
+
+    def _put_header(self, chat_session: ChatSession) -> None:
+        chat_session.message_count = len(chat_session.history)
+        self._write_document(
+            chat_session, chat_session.model_copy(update={"history": []})
+        )
+
+    def _write_document(self, chat_session: ChatSession, document: ChatSession) -> None:
+        """Write the session document and its entry in the user's header
+        index (atomically in Firestore)."""
+        with self.queries.batch() as batch:
+            self._batch_document(batch, chat_session, document)
+
+    def _batch_document(
+        self, batch: SessionBatch, chat_session: ChatSession, document: ChatSession
+    ) -> None:
+        chat_session.updated = document.updated = datetime.now()
+        batch.put(self.sessions, chat_session.chat_session_id, document)
+        if chat_session.user:
+            batch.put(
+                self._create_headers_storage(chat_session.user),
+                chat_session.chat_session_id,
+                self._to_header(chat_session),
+            )
+
+    def rebuild_header_index(self, user: str = None) -> int:
+        """Rebuild header indexes of the user (or all users) from the
+        session documents.
+
+        Returns:
+            The number of indexed sessions.
+        """
+        headers = self.queries.find(
+            self.sessions, ChatSessionHeader, fields=self.HEADER_FIELDS, user=user
+        )
+        rebuilt_users = set()
+        count = 0
+        for header in headers:
+            if not header.user:
+                continue
+            index = self._create_headers_storage(header.user)
+            if header.user not in rebuilt_users:
+                index.drop()
+                rebuilt_users.add(header.user)
+            index.save(header)
+            count += 1
+        if user and user not in rebuilt_users:
+            self._create_headers_storage(user).drop()
+        self._log.info(
+            "Rebuilt header index of %d sessions of %d users",
+            count,
+            len(rebuilt_users),
+        )
+        return count
+
+    def update_summary(self, chat_session: ChatSession) -> None:
+        """Save only the history summary of the chat session.
+
+        The stored document is read again, so messages saved in the meantime
+        are not overwritten by an outdated session.
+        """
+        stored = self.sessions.get(chat_session.chat_session_id)
+        if (
+            not stored
+            or (stored.summarized_count or 0) >= chat_session.summarized_count
+        ):
+            return
+        stored.history_summary = chat_session.history_summary
+        stored.summarized_count = chat_session.summarized_count
+        self.sessions.save(stored)
+
+    def update_title(self, chat_session: ChatSession) -> None:
+        """Save only the title (`summary`) of the chat session."""
+        stored = self.sessions.get(chat_session.chat_session_id)
+        if not stored:
+            return
+        stored.summary = chat_session.summary
+        self._write_document(stored, stored)
+
+    def archive_session(self, chat_session_id: str) -> bool:
+        """Move the history of the session to the archive.
+
+        The session is archived only if it wasn't saved while its history
+        was being archived, and only the archived messages are deleted.
+
+        Returns:
+            False if there is no such (not archived) session or it was
+            saved in the meantime.
+        """
+        chat_session = self.sessions.get(chat_session_id)
+        if not chat_session or chat_session.archived:
+            return False
+        chat_session = self._with_history(chat_session)
+        size = self.archive.save(chat_session)
+        stored = self.sessions.get(chat_session_id)
+        if not stored or (stored.message_count, stored.updated) != (
+            chat_session.message_count,
+            chat_session.updated,
+        ):
+            self._log.info("Chat session %s changed, not archived", chat_session_id)
+            return False
+        stub = chat_session.model_copy(update={"history": [], "archived": True})
+        with self.queries.batch() as batch:
+            # The stub is written first, so the session is never without history
+            self._batch_document(batch, stub, stub)
+            if self.append_only:
+                messages = self._create_messages_storage(chat_session_id)
+                for index in range(chat_session.message_count or 0):
+                    batch.delete(messages, ChatMessageRecord.key(index))
+        metrics.inc("chat_sessions_archived_total")
+        metrics.inc("chat_archive_bytes_total", size)
+        return True
+
+    def archive_older_than(
+        self,
+        before: datetime,
+        user: str = None,
+        skip: Callable[[str], bool] = None,
+    ) -> int:
+        """Archive sessions (of all users or the given one) not updated
+        since the date.
+
+        Args:
+            skip: Whether to leave the session with the given id (e.g. one
+                with writes pending in the session write queue).
+        Returns:
+            The number of archived sessions.
+        """
+        before = before if before.tzinfo else before.astimezone()
+        count = 0
+        for chat_session_id in self._archive_candidates(before, user):
+            if skip and skip(chat_session_id):
+                continue
+            try:
+                if self.archive_session(chat_session_id):
+                    count += 1
+            except Exception as e:
+                self._log.error("Chat session %s not archived: %s", chat_session_id, e)
+        self._log.info("Archived %d chat sessions", count)
+        return count
+
+    def _archive_candidates(self, before: datetime, user: str = None) -> list[str]:
+        # Only fields needed to select the sessions are read
+        sessions = self.queries.find(
+            self.sessions,
+            ChatSession,
+            fields=["chat_session_id", "created", "updated", "archived"],
+            user=user,
+        )
+        return [
+            s.chat_session_id
+            for s in sessions
+            if not s.archived and self._aware(s.updated or s.created) < before
+        ]
+
+    @staticmethod
+    def _aware(value: datetime) -> datetime:
+        """Naive datetimes are in local time (as `ChatSession.created`)."""
+        return value if value.tzinfo else value.astimezone()
+
+    def delete_many(self, chat_session_ids: list[str], user: str = None) -> None:
+        """Delete the user's chat sessions together with their messages
+        and headers (in Firestore with batched writes)."""
+        index = self._create_headers_storage(user) if user else None
+        with self.queries.batch() as batch:
+            for chat_session_id in chat_session_ids:
+                batch.drop(self._create_messages_storage(chat_session_id))
+                if index:
+                    batch.delete(index, chat_session_id)
+                # The session document goes last, so a failed delete can be repeated
+                batch.delete(self.sessions, chat_session_id)
+        self._log.debug("Deleted %d chat sessions of %s", len(chat_session_ids), user)
+
+    def delete(self, chat_session_id: str, user: str = None) -> None:
+        """Delete chat session together with its messages and header."""
+        if not user:
+            stored = self.sessions.get(chat_session_id)
+            user = stored.user if stored else None
+        self.delete_many([chat_session_id], user)
@@ -0,0 +1,131 @@
+"""Reusing Gemini cached content for system instructions."""
+
+import asyncio
+import datetime
+import hashlib
+import logging
+from abc import ABC, abstractmethod
+from typing import Any, Optional
+
+from google.generativeai import caching
+
+from app.background_tasks import run_in_background
+from app.cache import TTLCache
+
+
+class BaseCachedContentBackend(ABC):
+    """Creates and deletes cached contents."""
+
+    @abstractmethod
+    def create(self, ai_model_name: str, system_instruction: str, ttl: int) -> Any:
+        """Create cached content and return its handle."""
+
+    @abstractmethod
+    def delete(self, handle: Any) -> None:
+        """Delete cached content."""
+
+
+class GeminiCachedContentBackend(BaseCachedContentBackend):
+    """Cached contents of the Gemini API."""
+
+    def create(
+        self, ai_model_name: str, system_instruction: str, ttl: int
+    ) -> caching.CachedContent:
+        return caching.CachedContent.create(
+            model=ai_model_name,
+            system_instruction=system_instruction,
+            ttl=datetime.timedelta(seconds=ttl),
+        )
+
+    def delete(self, handle: caching.CachedContent) -> None:
+        handle.delete()
+
+
+class InMemoryCachedContentBackend(BaseCachedContentBackend):
+    """Local stand-in for tests, handles are just names."""
+
+    def __init__(self):
+        self.contents: dict[str, tuple[str, str]] = {}
+
+    def create(self, ai_model_name: str, system_instruction: str, ttl: int) -> str:
+        name = f"cachedContents/{len(self.contents) + 1}"
+        self.contents[name] = (ai_model_name, system_instruction)
+        return name
+
+    def delete(self, handle: str) -> None:
+        self.contents.pop(handle, None)
+
+
+class ContextCache:
+    """Cache of system instructions per (agent, model, context hash).
+
+    Only the part of the context which is the same in every turn (the
+    agent's instruction) is worth caching, otherwise new cached content
+    would be created for each turn.
+
+    Contexts shorter than `min_tokens` are not cached (the API refuses them).
+    Handles are reused until `ttl_seconds` minus a safety margin, so a
+    handle is never used after the remote cached content expires. Handles
+    evicted because of `max_entries` are deleted remotely.
+    """
+
+    CHARS_PER_TOKEN = 4
+    TTL_MARGIN_SECONDS = 60
+
+    _log = logging.getLogger(__name__)
+
+    def __init__(
+        self,
+        backend: BaseCachedContentBackend,
+        ttl_seconds: int = 3600,
+        max_entries: int = 100,
+        min_tokens: int = 32768,
+    ):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self.min_tokens = min_tokens
+        self._cache = TTLCache(
+            max_entries,
+            max(ttl_seconds - self.TTL_MARGIN_SECONDS, 0),
+            on_evict=self._on_evict,
+        )
+        self._creating: dict[tuple, asyncio.Task] = {}
+
+    async def get(
+        self, agent_name: str, ai_model_name: str, context: str
+    ) -> Optional[Any]:
+        """Return cached content handle for the context, create it if needed."""
+        if not context or len(context) // self.CHARS_PER_TOKEN < self.min_tokens:
+            return None
+        key = (
+            agent_name,
+            ai_model_name,
+            hashlib.sha256(context.encode("utf-8")).hexdigest(),
+        )
+        handle = self._cache.get(key)
+        if handle is not None:
+            return handle
+        # Concurrent requests wait for the same creation
+        task = self._creating.get(key)
+        if not task:
+            task = asyncio.create_task(
+                asyncio.to_thread(
+                    self.backend.create, ai_model_name, context, self.ttl_seconds
+                )
+            )
+            self._creating[key] = task
+            task.add_done_callback(lambda _: self._creating.pop(key, None))
+        try:
+            handle = await asyncio.shield(task)
+        except Exception as e:
+            self._log.warning("Cached content not created: %s", e)
+            return None
+        self._cache.put(key, handle)
+        return handle
+
+    def _on_evict(self, key: tuple, handle: Any) -> None:
+        self._log.debug("Deleting cached content of %s", key[:2])
+        run_in_background(asyncio.to_thread(self.backend.delete, handle))
+
+    def stats(self) -> dict[str, int]:
+        return self._cache.stats()
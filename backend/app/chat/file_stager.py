@@ -0,0 +1,113 @@
+"""Staging of user session files in the chat session directory."""
+
+import asyncio
+import contextlib
+import logging
+from abc import ABC, abstractmethod
+
+from google.api_core import exceptions
+from google.cloud import storage
+from google.generativeai.types import BlobDict
+
+from ampf.base import BaseFactory
+
+from .message import ChatMessageFile
+
+
+class BaseBlobCopier(ABC):
+    """Downloads, uploads and deletes blobs of the file storage (full blob
+    names)."""
+
+    @abstractmethod
+    def download(self, blob_name: str) -> bytes:
+        """Download blob content."""
+
+    @abstractmethod
+    def upload(self, blob_name: str, data: bytes, content_type: str) -> None:
+        """Upload blob content."""
+
+    def delete_prefix(self, prefix: str) -> bool:
+        """Delete all blobs with names starting with the prefix.
+
+        Returns:
+            False if blobs can't be listed, they have to be deleted by name.
+        """
+        return False
+
+
+class GcsBlobCopier(BaseBlobCopier):
+    """Blobs of a Cloud Storage bucket (blobs are deleted in batches)."""
+
+    BATCH_SIZE = 100
+    """Max. calls of one batch request."""
+
+    def __init__(self, bucket_name: str, client: storage.Client = None):
+        self.bucket_name = bucket_name
+        self.bucket = (client or storage.Client()).bucket(bucket_name)
+
+    def download(self, blob_name: str) -> bytes:
+        return self.bucket.blob(blob_name).download_as_bytes()
+
+    def upload(self, blob_name: str, data: bytes, content_type: str) -> None:
+        self.bucket.blob(blob_name).upload_from_string(data, content_type=content_type)
+
+    def delete_prefix(self, prefix: str) -> bool:
+        blobs = list(self.bucket.list_blobs(prefix=prefix))
+        for start in range(0, len(blobs), self.BATCH_SIZE):
+            # Blobs deleted in the meantime don't stop the others
+            with contextlib.suppress(exceptions.NotFound), self.bucket.client.batch():
+                for blob in blobs[start : start + self.BATCH_SIZE]:
+                    blob.delete()
+        return True
+
+
+class StorageBlobCopier(BaseBlobCopier):
+    """Blobs of factory's blob storage.
+
+    It works with any factory (e.g. in-memory one in tests).
+    """
+
+    def __init__(self, factory: BaseFactory):
+        self.storage = factory.create_blob_storage("")
+
+    def download(self, blob_name: str) -> bytes:
+        return self.storage.download_blob(blob_name)
+
+    def upload(self, blob_name: str, data: bytes, content_type: str) -> None:
+        self.storage.upload_blob(blob_name, data, content_type=content_type)
+
+
+class ChatFileStager:
+    """Copies user session files to the chat session directory
+    and prepares inline message parts with their content.
+
+    Each file is downloaded once, the same bytes are uploaded to the chat
+    directory and sent to the model (the Gemini API can't read the bucket).
+    """
+
+    _log = logging.getLogger(__name__)
+
+    def __init__(self, blob_copier: BaseBlobCopier, user_email: str):
+        self.blob_copier = blob_copier
+        self.user_email = user_email
+
+    async def stage(
+        self, chat_session_id: str, files: list[ChatMessageFile]
+    ) -> list[BlobDict]:
+        """Copy all files concurrently and return message parts for them."""
+        return list(
+            await asyncio.gather(
+                *[
+                    asyncio.to_thread(self._stage_file, chat_session_id, file)
+                    for file in files
+                ]
+            )
+        )
+
+    def _stage_file(self, chat_session_id: str, file: ChatMessageFile) -> BlobDict:
+        source_name = f"users/{self.user_email}/session_files/{file.name}"
+        target_name = f"users/{self.user_email}/chats/{chat_session_id}/files/{file.name}"  # fmt: skip
+        self._log.debug("Copying file %s to %s", source_name, target_name)
+        data = self.blob_copier.download(source_name)
+        self.blob_copier.upload(target_name, data, file.mime_type)
+        return BlobDict(mime_type=file.mime_type, data=data)
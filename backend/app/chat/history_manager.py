@@ -0,0 +1,124 @@
+import asyncio
+import logging
+
+from ai_agents import AIAgent
+
+from .chat_model import ChatSession
+from .message import ChatMessage
+
+
+class ChatHistoryManager:
+    """Keeps the history sent to the model within a token budget.
+
+    Only the newest messages fitting into the budget are sent. Older ones
+    are folded into a rolling summary stored in the chat session
+    (`history_summary` covers the first `summarized_count` messages).
+    """
+
+    CHARS_PER_TOKEN = 4
+    """Rough estimation, good enough for budgeting."""
+    FILE_TOKENS = 258
+    """Tokens counted for each attached file."""
+
+    SUMMARY_PROMPT = """Update the summary of the conversation below.
+Keep facts, decisions, names and open questions. Write it in the language
+of the conversation, as plain text, at most a few paragraphs.
+
+# Current summary
+
+{summary}
+
+# New messages
+
+{messages}
+"""
+
+    _log = logging.getLogger(__name__)
+
+    def __init__(self, token_budget: int, summary_agent: AIAgent):
+        self.token_budget = token_budget
+        self.summary_agent = summary_agent
+
+    @classmethod
+    def estimate_tokens(cls, message: ChatMessage) -> int:
+        """Estimate number of tokens of the message."""
+        return len(message.content) // cls.CHARS_PER_TOKEN + cls.FILE_TOKENS * len(
+            message.files or []
+        )
+
+    def get_window_start(self, chat_session: ChatSession) -> int:
+        """Index of the oldest message sent to the model."""
+        history = chat_session.history
+        tokens = 0
+        start = len(history)
+        while start > 0:
+            tokens += self.estimate_tokens(history[start - 1])
+            if tokens > self.token_budget:
+                break
+            start -= 1
+        # History sent to the model has to start with the user message
+        while start < len(history) and history[start].author != "user":
+            start += 1
+        return start
+
+    def get_window(self, chat_session: ChatSession) -> tuple[str, list[ChatMessage]]:
+        """Return the summary of omitted messages and messages to send.
+
+        Messages which aren't summarized yet (the summary is made in the
+        background, it may lag behind or fail) are sent even if they don't
+        fit into the budget, so no context is lost.
+        """
+        history = chat_session.history
+        start = min(
+            self.get_window_start(chat_session), chat_session.summarized_count or 0
+        )
+        while start > 0 and history[start].author != "user":
+            start -= 1
+        summary = chat_session.history_summary if start > 0 else ""
+        return summary, history[start:]
+
+    def needs_summary(self, chat_session: ChatSession) -> bool:
+        """Whether some messages are neither sent nor summarized."""
+        return self.get_window_start(chat_session) > (
+            chat_session.summarized_count or 0
+        )
+
+    async def summarize(self, chat_session: ChatSession) -> None:
+        """Fold messages which are out of the window into the summary.
+
+        Messages are folded in chunks of at most `token_budget` tokens
+        (e.g. the first summary of a long session), so the prompt fits
+        into the summary model. The session is updated after each chunk.
+        """
+        end = self.get_window_start(chat_session)
+        while (chat_session.summarized_count or 0) < end:
+            start = chat_session.summarized_count or 0
+            chunk_end = self._get_chunk_end(chat_session.history, start, end)
+            max_chars = self.token_budget * self.CHARS_PER_TOKEN
+            messages = "\n\n".join(
+                f"{m.author}: {m.content[:max_chars]}"
+                for m in chat_session.history[start:chunk_end]
+            )
+            prompt = self.SUMMARY_PROMPT.format(
+                summary=chat_session.history_summary or "-", messages=messages
+            )
+            self._log.debug(
+                "Summarizing messages %d-%d of %s",
+                start,
+                chunk_end,
+                chat_session.chat_session_id,
+            )
+            summary = await asyncio.to_thread(self.summary_agent.run, prompt)
+            if not summary:
+                return
+            chat_session.history_summary = summary
+            chat_session.summarized_count = chunk_end
+
+    def _get_chunk_end(self, history: list[ChatMessage], start: int, end: int) -> int:
+        """End of messages from start fitting into the budget (at least one)."""
+        tokens = 0
+        for index in range(start, end):
+            tokens += self.estimate_tokens(history[index])
+            if tokens > self.token_budget and index > start:
+                return index
+        return end
@@ -11,7 +11,7 @@ class ChatMessageFile(BaseModel):
 
     name: str
     mime_type: str
-    # url: Optional[str] = None
+    url: Optional[str] = None
 
 
 class ChatMessage(BaseModel):
@@ -20,17 +20,23 @@ class ChatMessage(BaseModel):
     author: Literal["user", "ai"]
     content: str
     files: Optional[list[ChatMessageFile]] = Field([])
+    interrupted: Optional[bool] = Field(False)
+    """The answer was not finished (the client disconnected)."""
 
     def to_content(self) -> ContentDict:
         """Convert ChatMessage to ContentDict."""
         parts = [self.content]
         for file in self.files:
-            parts.append(
-                FileDataDict(
-                    uri=file.url,
-                    mime_type=file.mime_type,
+            # Files are sent inline only with the message they are attached
+            # to. The Gemini API can't read Cloud Storage URIs (stored by
+            # an earlier version), only File API ones.
+            if file.url and not file.url.startswith("gs://"):
+                parts.append(
+                    FileDataDict(
+                        file_uri=file.url,
+                        mime_type=file.mime_type,
+                    )
                 )
-            )
         return ContentDict(
             role=self.author if self.author == "user" else "model",
             parts=parts,
@@ -0,0 +1,161 @@
+"""Latency-aware routing of generation requests across models."""
+
+import asyncio
+import contextlib
+import logging
+import time
+from collections import deque
+from typing import AsyncIterator, Callable
+
+from google.api_core import exceptions
+
+from app.metrics import metrics
+
+THROTTLED_ERRORS = (exceptions.ResourceExhausted, exceptions.TooManyRequests)
+
+
+class ModelStats:
+    """Rolling time-to-first-token and error statistics of one model."""
+
+    def __init__(self, window: int = 50):
+        self.ttfts: deque[float] = deque(maxlen=window)
+        self.errors: deque[bool] = deque(maxlen=window)
+        self.throttled_until = 0.0
+
+    def ttft_percentile(self, percentile: float) -> float:
+        if not self.ttfts:
+            return 0.0
+        ordered = sorted(self.ttfts)
+        return ordered[min(int(len(ordered) * percentile), len(ordered) - 1)]
+
+    def error_rate(self) -> float:
+        return sum(self.errors) / len(self.errors) if self.errors else 0.0
+
+
+class ModelRouter:
+    """Tracks model health and falls over to equivalent models.
+
+    A model is unhealthy when it was throttled (429) within
+    `throttle_cooldown_seconds`, its p90 time-to-first-token is above
+    `ttft_slo_seconds` or its error rate is above `max_error_rate`.
+    With fallback enabled, a healthy equivalent model is used instead
+    of an unhealthy one. A request is also retried on the next model when
+    it is throttled or the first token doesn't come within
+    `first_token_timeout_seconds`, as long as nothing was streamed yet.
+    """
+
+    MIN_SAMPLES = 5
+
+    _log = logging.getLogger(__name__)
+
+    def __init__(
+        self,
+        fallbacks: dict[str, list[str]] = None,
+        ttft_slo_seconds: float = 5.0,
+        max_error_rate: float = 0.5,
+        throttle_cooldown_seconds: float = 60,
+        first_token_timeout_seconds: float = None,
+        window: int = 50,
+    ):
+        self.fallbacks = fallbacks or {}
+        self.ttft_slo_seconds = ttft_slo_seconds
+        self.max_error_rate = max_error_rate
+        self.throttle_cooldown_seconds = throttle_cooldown_seconds
+        self.first_token_timeout_seconds = first_token_timeout_seconds
+        self.window = window
+        self.stats: dict[str, ModelStats] = {}
+
+    def _stats(self, ai_model_name: str) -> ModelStats:
+        if ai_model_name not in self.stats:
+            self.stats[ai_model_name] = ModelStats(self.window)
+        return self.stats[ai_model_name]
+
+    def is_healthy(self, ai_model_name: str) -> bool:
+        stats = self._stats(ai_model_name)
+        if stats.throttled_until > time.monotonic():
+            return False
+        if len(stats.errors) < self.MIN_SAMPLES:
+            return True
+        return (
+            stats.ttft_percentile(0.9) <= self.ttft_slo_seconds
+            and stats.error_rate() <= self.max_error_rate
+        )
+
+    def candidates(self, ai_model_name: str, fallback: bool = True) -> list[str]:
+        """Models to try, healthy ones first (in the configured order)."""
+        if not fallback:
+            return [ai_model_name]
+        models = [ai_model_name, *self.fallbacks.get(ai_model_name, [])]
+        return sorted(models, key=lambda m: not self.is_healthy(m))
+
+    def record_ttft(self, ai_model_name: str, seconds: float) -> None:
+        self._stats(ai_model_name).ttfts.append(seconds)
+
+    def record_result(
+        self, ai_model_name: str, error: bool = False, throttled: bool = False
+    ) -> None:
+        stats = self._stats(ai_model_name)
+        stats.errors.append(error)
+        if throttled:
+            stats.throttled_until = time.monotonic() + self.throttle_cooldown_seconds
+
+    async def stream(
+        self,
+        ai_model_name: str,
+        generate: Callable[[str], AsyncIterator[str]],
+        fallback: bool = True,
+        admit: Callable[[str], contextlib.AbstractAsyncContextManager] = None,
+    ) -> AsyncIterator[str]:
+        """Stream chunks of `generate(model)` from the first model which works.
+
+        Args:
+            admit: Slot of the model held while it streams. It is acquired
+                before the first token is awaited, so time waiting in the
+                queue isn't counted as time-to-first-token.
+        """
+        candidates = self.candidates(ai_model_name, fallback)
+        for i, model in enumerate(candidates):
+            is_last = i == len(candidates) - 1
+            async with contextlib.AsyncExitStack() as stack:
+                if admit:
+                    await stack.enter_async_context(admit(model))
+                chunks = generate(model)
+                start = time.monotonic()
+                try:
+                    timeout = None if is_last else self.first_token_timeout_seconds
+                    first = await asyncio.wait_for(anext(chunks, None), timeout)
+                    self.record_ttft(model, time.monotonic() - start)
+                except THROTTLED_ERRORS:
+                    self.record_result(model, error=True, throttled=True)
+                    if is_last:
+                        raise
+                    self._fall_over(model, candidates[i + 1], "throttled")
+                    continue
+                except TimeoutError:
+                    self.record_result(model, error=True)
+                    await chunks.aclose()
+                    if is_last:
+                        raise
+                    self._fall_over(model, candidates[i + 1], "timeout")
+                    continue
+                except Exception:
+                    self.record_result(model, error=True)
+                    raise
+                try:
+                    if first is not None:
+                        yield first
+                    async for chunk in chunks:
+                        yield chunk
+                except Exception as e:
+                    self.record_result(
+                        model, error=True, throttled=isinstance(e, THROTTLED_ERRORS)
+                    )
+                    raise
+                self.record_result(model)
+                return
+
+    def _fall_over(self, ai_model_name: str, next_model: str, reason: str) -> None:
+        self._log.warning(
+            "Model %s %s, falling over to %s", ai_model_name, reason, next_model
+        )
+        metrics.inc("chat_model_fallbacks_total", model=ai_model_name, reason=reason)
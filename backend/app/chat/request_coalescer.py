@@ -0,0 +1,92 @@
+"""Single-flight coalescing of identical generation requests."""
+
+import asyncio
+import logging
+from typing import AsyncIterator, Callable, Hashable
+
+from app.metrics import metrics
+
+
+class _InFlight:
+    """Upstream stream shared by subscribers."""
+
+    def __init__(self):
+        self.chunks: list[str] = []
+        self.done = False
+        self.error: Exception = None
+        self.changed = asyncio.Condition()
+        self.subscribers = 0
+        self.task: asyncio.Task = None
+
+
+class RequestCoalescer:
+    """Identical requests arriving while one is in flight share its stream.
+
+    Every subscriber gets all chunks from the beginning, also when it joins
+    in the middle of generation. The upstream is cancelled when the last
+    subscriber leaves.
+    """
+
+    _log = logging.getLogger(__name__)
+
+    def __init__(self):
+        self._in_flight: dict[Hashable, _InFlight] = {}
+
+    async def stream(
+        self, key: Hashable, upstream_factory: Callable[[], AsyncIterator[str]]
+    ) -> AsyncIterator[str]:
+        """Stream chunks of the request identified by `key`.
+
+        `upstream_factory` is called only if there is no such request in flight.
+        """
+        flight = self._in_flight.get(key)
+        if flight is None:
+            flight = _InFlight()
+            self._in_flight[key] = flight
+            flight.task = asyncio.create_task(
+                self._produce(key, flight, upstream_factory())
+            )
+        else:
+            self._log.debug("Joining request in flight")
+            metrics.inc("chat_requests_coalesced_total")
+        flight.subscribers += 1
+        try:
+            i = 0
+            while True:
+                async with flight.changed:
+                    await flight.changed.wait_for(
+                        lambda: len(flight.chunks) > i or flight.done
+                    )
+                while i < len(flight.chunks):
+                    yield flight.chunks[i]
+                    i += 1
+                if flight.done and i >= len(flight.chunks):
+                    if flight.error:
+                        raise flight.error
+                    return
+        finally:
+            flight.subscribers -= 1
+            if flight.subscribers == 0 and not flight.done:
+                self._log.debug("No subscribers left, cancelling the request")
+                flight.task.cancel()
+
+    async def _produce(
+        self, key: Hashable, flight: _InFlight, upstream: AsyncIterator[str]
+    ) -> None:
+        try:
+            async for chunk in upstream:
+                flight.chunks.append(chunk)
+                async with flight.changed:
+                    flight.changed.notify_all()
+        except Exception as e:
+            flight.error = e
+        finally:
+            flight.done = True
+            if self._in_flight.get(key) is flight:
+                del self._in_flight[key]
+            await upstream.aclose()
+            async with flight.changed:
+                flight.changed.notify_all()
+
+    def in_flight_count(self) -> int:
+        return len(self._in_flight)
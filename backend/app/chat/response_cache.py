@@ -0,0 +1,119 @@
+"""Cache of answers to repeated first-turn prompts."""
+
+import asyncio
+import hashlib
+import math
+import re
+from typing import AsyncIterator, NamedTuple, Optional
+
+from app.agent.agent_model import Agent
+from app.cache import TTLCache
+from haintech.ai.base.base_ai_text_embedding_model import BaseAITextEmbeddingModel
+
+
+class CachedResponse(NamedTuple):
+    answer: str
+    embedding: Optional[list[float]]
+
+
+class ResponseCache:
+    """Cache of answers keyed by agent, model and normalized prompt.
+
+    The agent part of the key contains a hash of its system prompt and
+    keywords, so agents with the same name but other definitions
+    (e.g. of other users) don't share answers.
+    With `similarity_threshold` and `embedding_model` set, a prompt
+    with cosine similarity above the threshold to a cached one
+    (same agent and model) is a hit too. The prompt is embedded only
+    if the cache holds prompts of the agent and model to compare it to.
+    """
+
+    REPLAY_CHUNK_SIZE = 200
+
+    def __init__(
+        self,
+        ttl_seconds: int = 3600,
+        max_entries: int = 1000,
+        similarity_threshold: float = None,
+        embedding_model: BaseAITextEmbeddingModel = None,
+    ):
+        self._cache: TTLCache[tuple, CachedResponse] = TTLCache(
+            max_entries, ttl_seconds
+        )
+        self.similarity_threshold = similarity_threshold
+        self.embedding_model = embedding_model
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalize(prompt: str) -> str:
+        """Lowercase, collapse whitespaces and strip trailing punctuation."""
+        return re.sub(r"\s+", " ", prompt).strip().rstrip("?!.").strip().lower()
+
+    @staticmethod
+    def agent_key(agent: Agent) -> tuple[str, str]:
+        definition = (agent.system_prompt or "") + "\0" + "\0".join(agent.keywords or [])  # fmt: skip
+        return agent.name, hashlib.sha256(definition.encode("utf-8")).hexdigest()
+
+    def _use_similarity(self) -> bool:
+        return bool(self.similarity_threshold and self.embedding_model)
+
+    async def get(self, agent: Agent, ai_model_name: str, prompt: str) -> Optional[str]:
+        """Return cached answer for the prompt."""
+        prefix = (*self.agent_key(agent), ai_model_name)
+        entry = self._cache.get((*prefix, self.normalize(prompt)))
+        if not entry and self._use_similarity():
+            entry = await self._find_similar(prefix, prompt)
+        if entry:
+            self.hits += 1
+            return entry.answer
+        self.misses += 1
+        return None
+
+    async def _find_similar(
+        self, prefix: tuple, prompt: str
+    ) -> Optional[CachedResponse]:
+        candidates = [e for k, e in self._cache.items() if k[:3] == prefix and e.embedding]  # fmt: skip
+        if not candidates:
+            # The prompt is embedded only if there is anything to compare it to
+            return None
+        embedding = await self.embedding_model.get_embedding(self.normalize(prompt))
+        best, best_similarity = None, self.similarity_threshold
+        for entry in candidates:
+            similarity = self._cosine_similarity(embedding, entry.embedding)
+            if similarity >= best_similarity:
+                best, best_similarity = entry, similarity
+        return best
+
+    async def put(
+        self, agent: Agent, ai_model_name: str, prompt: str, answer: str
+    ) -> None:
+        """Cache answer for the prompt."""
+        normalized = self.normalize(prompt)
+        embedding = (
+            await self.embedding_model.get_embedding(normalized)
+            if self._use_similarity()
+            else None
+        )
+        self._cache.put(
+            (*self.agent_key(agent), ai_model_name, normalized),
+            CachedResponse(answer, embedding),
+        )
+
+    @staticmethod
+    def _cosine_similarity(a: list[float], b: list[float]) -> float:
+        dot = sum(x * y for x, y in zip(a, b))
+        norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+        return dot / norm if norm else 0.0
+
+    @classmethod
+    async def replay(cls, answer: str) -> AsyncIterator[str]:
+        """Stream cached answer in chunks like the model does."""
+        for i in range(0, len(answer), cls.REPLAY_CHUNK_SIZE):
+            yield answer[i : i + cls.REPLAY_CHUNK_SIZE]
+            await asyncio.sleep(0)
+
+    def stats(self) -> dict[str, int]:
+        """Return hit/miss counters of answers (exact or similar prompts)
+        and the current size."""
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._cache)}
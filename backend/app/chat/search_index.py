@@ -0,0 +1,304 @@
+"""Full-text search of the user's chat sessions."""
+
+import logging
+import math
+import re
+import threading
+import unicodedata
+from collections import Counter
+from datetime import datetime
+from typing import Optional
+
+from ampf.base import BaseFactory, KeyNotExistsException
+from pydantic import BaseModel, field_validator
+
+from app.cache import TTLCache
+from app.metrics import metrics
+
+from .chat_model import ChatSession
+from .chat_session_storage import ChatSessionStorage
+
+_WORD = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> list[str]:
+    """Lowercase terms of the text without diacritics (single characters
+    are skipped)."""
+    text = unicodedata.normalize("NFKD", (text or "").lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return [t for t in _WORD.findall(text) if len(t) > 1]
+
+
+def _fold(text: str) -> tuple[str, list[int]]:
+    """The text normalized as by `tokenize` with positions of its characters
+    in the original text."""
+    chars, positions = [], []
+    for i, c in enumerate(text):
+        for f in unicodedata.normalize("NFKD", c.lower()):
+            if not unicodedata.combining(f):
+                chars.append(f)
+                positions.append(i)
+    return "".join(chars), positions
+
+
+class ChatSearchDocument(BaseModel):
+    """Indexed terms of one chat session.
+
+    It is updated incrementally, only messages after `message_count` are
+    added when the session is saved again.
+    """
+
+    chat_session_id: str
+    user: str
+    summary: str = ""
+    created: Optional[datetime] = None
+    message_count: int = 0
+    length: int = 0
+    terms: list[str] = []
+    """Terms with their counts encoded as "term count" (terms can't be map
+    keys, Firestore rejects keys like `__init__`)."""
+    texts: list[str] = []
+    """Beginnings of messages used for snippets."""
+
+    @field_validator("terms", mode="before")
+    @classmethod
+    def _convert_terms_map(cls, value):
+        """Convert terms stored by the old version as a map."""
+        if isinstance(value, dict):
+            return [f"{term} {count}" for term, count in value.items()]
+        return value
+
+    def term_counts(self) -> dict[str, int]:
+        ret = {}
+        for item in self.terms:
+            term, count = item.rsplit(" ", 1)
+            ret[term] = int(count)
+        return ret
+
+    def set_term_counts(self, terms: Counter[str], max_terms: int) -> None:
+        """Store the most frequent `max_terms` terms."""
+        self.terms = [f"{term} {count}" for term, count in terms.most_common(max_terms)]
+
+
+class ChatSearchResult(BaseModel):
+    chat_session_id: str
+    summary: str = ""
+    created: Optional[datetime] = None
+    score: float
+    snippet: str = ""
+
+
+class UserSearchIndex:
+    """In-memory inverted index of the user's chat sessions ranked by BM25.
+
+    It is updated and searched from worker threads, so access is locked.
+    """
+
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self, documents: list[ChatSearchDocument] = ()):
+        self.documents: dict[str, ChatSearchDocument] = {}
+        self.postings: dict[str, dict[str, int]] = {}
+        self.total_length = 0
+        self._lock = threading.Lock()
+        for document in documents:
+            self.put(document)
+
+    def put(self, document: ChatSearchDocument) -> None:
+        with self._lock:
+            self._remove(document.chat_session_id)
+            self.documents[document.chat_session_id] = document
+            self.total_length += document.length
+            for term, count in document.term_counts().items():
+                self.postings.setdefault(term, {})[document.chat_session_id] = count
+
+    def remove(self, chat_session_id: str) -> None:
+        with self._lock:
+            self._remove(chat_session_id)
+
+    def _remove(self, chat_session_id: str) -> None:
+        document = self.documents.pop(chat_session_id, None)
+        if not document:
+            return
+        self.total_length -= document.length
+        for term in document.term_counts():
+            postings = self.postings.get(term)
+            if postings:
+                postings.pop(chat_session_id, None)
+                if not postings:
+                    del self.postings[term]
+
+    def search(
+        self, query: str, limit: int = 20
+    ) -> list[tuple[ChatSearchDocument, float]]:
+        """The best matching session documents with their scores."""
+        with self._lock:
+            return [
+                (self.documents[chat_session_id], score)
+                for chat_session_id, score in self._score(query).most_common(limit)
+            ]
+
+    def _score(self, query: str) -> Counter[str]:
+        count = len(self.documents)
+        scores: Counter[str] = Counter()
+        if not count:
+            return scores
+        average_length = self.total_length / count or 1
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for chat_session_id, frequency in postings.items():
+                length = self.documents[chat_session_id].length
+                norm = self.K1 * (1 - self.B + self.B * length / average_length)
+                scores[chat_session_id] += (
+                    idf * frequency * (self.K1 + 1) / (frequency + norm)
+                )
+        return scores
+
+
+class ChatSearchIndex:
+    """Search of chat sessions by the text of their messages.
+
+    Terms of each session are stored in a per-user collection and updated
+    when the session is saved. Searches use the in-memory inverted index of
+    the user, loaded from the collection on the first search and kept in
+    the cache shared by requests of the worker. Sessions saved by other
+    workers are found after the cached index expires. The collection is
+    never queried by `terms` or `texts`, so their indexes are disabled
+    (see the GCP setup in README.md).
+
+    Updates of the user's documents are serialized within the worker,
+    so concurrently saved turns don't overwrite each other's terms.
+    """
+
+    TEXT_LENGTH = 500
+    """Characters of each message kept for snippets."""
+    MAX_TEXTS = 200
+    SNIPPET_LENGTH = 160
+    MAX_TERMS = 10000
+    """Distinct terms kept for each session (the rarest ones are dropped to
+    keep the document within Firestore limits)."""
+
+    _log = logging.getLogger(__name__)
+    _user_locks: dict[str, threading.Lock] = {}
+
+    def __init__(self, factory: BaseFactory, cache: TTLCache = None):
+        self.factory = factory
+        self.cache = cache
+
+    def _create_storage(self, user: str):
+        return self.factory.create_storage(
+            f"users/{user}/chat_search", ChatSearchDocument, key_name="chat_session_id"
+        )
+
+    def update(self, chat_session: ChatSession, reindex: bool = False) -> None:
+        """Add messages of the session which are not indexed yet.
+
+        Args:
+            reindex: Index all messages again (e.g. after they were edited).
+        """
+        with self._user_locks.setdefault(chat_session.user, threading.Lock()):
+            self._update(chat_session, reindex)
+
+    def _update(self, chat_session: ChatSession, reindex: bool) -> None:
+        storage = self._create_storage(chat_session.user)
+        document = None if reindex else storage.get(chat_session.chat_session_id)
+        if document and document.message_count > len(chat_session.history):
+            # A newer state of the session is already indexed
+            return
+        if not document:
+            document = ChatSearchDocument(
+                chat_session_id=chat_session.chat_session_id, user=chat_session.user
+            )
+        terms = Counter(document.term_counts())
+        for message in chat_session.history[document.message_count :]:
+            tokens = tokenize(message.content)
+            terms.update(tokens)
+            document.length += len(tokens)
+            if message.content and len(document.texts) < self.MAX_TEXTS:
+                document.texts.append(message.content[: self.TEXT_LENGTH])
+        document.set_term_counts(terms, self.MAX_TERMS)
+        document.message_count = len(chat_session.history)
+        document.summary = chat_session.summary or ""
+        document.created = chat_session.created
+        storage.save(document)
+        index = self.cache.get(chat_session.user) if self.cache else None
+        if index:
+            index.put(document)
+
+    def delete(self, user: str, chat_session_id: str) -> None:
+        try:
+            self._create_storage(user).delete(chat_session_id)
+        except KeyNotExistsException:
+            pass
+        index = self.cache.get(user) if self.cache else None
+        if index:
+            index.remove(chat_session_id)
+
+    def rebuild(self, sessions: ChatSessionStorage, user: str = None) -> int:
+        """Index all messages of the user's (or all users') sessions again.
+
+        Returns:
+            The number of indexed sessions.
+        """
+        if user:
+            headers, _ = sessions.get_headers(user)
+        else:
+            headers = (s for s in sessions.get_all() if s.user)
+        count = 0
+        for chat_session_id in [h.chat_session_id for h in headers]:
+            chat_session = sessions.get(chat_session_id, restore=False)
+            if chat_session:
+                self.update(chat_session, reindex=True)
+                count += 1
+        self._log.info("Rebuilt search index of %d sessions", count)
+        return count
+
+    def search(self, user: str, query: str, limit: int = 20) -> list[ChatSearchResult]:
+        """The user's sessions best matching the query with snippets."""
+        with metrics.timer("chat_search_seconds"):
+            index = self._get_index(user)
+            return [
+                self._to_result(document, query, score)
+                for document, score in index.search(query, limit)
+            ]
+
+    def _get_index(self, user: str) -> UserSearchIndex:
+        index = self.cache.get(user) if self.cache else None
+        if not index:
+            index = UserSearchIndex(list(self._create_storage(user).get_all()))
+            self._log.debug("Search index of %s loaded", user)
+            if self.cache:
+                self.cache.put(user, index)
+        return index
+
+    def _to_result(
+        self, document: ChatSearchDocument, query: str, score: float
+    ) -> ChatSearchResult:
+        return ChatSearchResult(
+            chat_session_id=document.chat_session_id,
+            summary=document.summary,
+            created=document.created,
+            score=round(score, 4),
+            snippet=self.snippet(document.texts, query),
+        )
+
+    def snippet(self, texts: list[str], query: str) -> str:
+        """Fragment of the first text containing a term of the query (matched
+        the same way as terms are indexed, ignoring case and diacritics)."""
+        terms = [re.escape(t) for t in tokenize(query)]
+        pattern = re.compile("|".join(terms)) if terms else None
+        for text in texts:
+            folded, positions = _fold(text) if pattern else ("", [])
+            match = pattern.search(folded) if pattern else None
+            if match:
+                start = max(0, positions[match.start()] - self.SNIPPET_LENGTH // 3)
+                fragment = text[start : start + self.SNIPPET_LENGTH]
+                prefix = "…" if start > 0 else ""
+                suffix = "…" if start + self.SNIPPET_LENGTH < len(text) else ""
+                return prefix + " ".join(fragment.split()) + suffix
+        text = texts[0] if texts else ""
+        return " ".join(text[: self.SNIPPET_LENGTH].split())
@@ -0,0 +1,159 @@
+import contextlib
+import itertools
+from typing import Iterator, TypeVar
+
+from ampf.base import BaseStorage, KeyNotExistsException
+from ampf.gcp import GcpStorage
+from google.cloud import firestore
+from google.cloud.firestore_v1.base_query import FieldFilter
+from pydantic import BaseModel
+
+T = TypeVar("T", bound=BaseModel)
+
+
+class SessionBatch:
+    """Writes collected by `SessionQueries.batch`, committed in order."""
+
+    def __init__(self):
+        self.writes: list[tuple] = []
+
+    def put(self, storage: BaseStorage, key: str, value: BaseModel) -> None:
+        self.writes.append(("put", storage, key, value))
+
+    def delete(self, storage: BaseStorage, key: str) -> None:
+        """Delete the document (it needn't exist)."""
+        self.writes.append(("delete", storage, key, None))
+
+    def drop(self, storage: BaseStorage) -> None:
+        """Delete all documents of the storage."""
+        self.writes.append(("drop", storage, None, None))
+
+
+class SessionQueries:
+    """Queries and batched writes over storages of chat session documents
+    (sessions, their messages and headers, keyed by `chat_session_id`).
+
+    This implementation uses only the storage API: documents are read
+    whole and filtered and paged in memory, writes of a batch are applied
+    one by one. `FirestoreSessionQueries` runs the same queries and
+    batches in Firestore.
+    """
+
+    @contextlib.contextmanager
+    def batch(self) -> Iterator[SessionBatch]:
+        """Collect writes and commit them when the block ends (nothing is
+        written if it raises)."""
+        batch = SessionBatch()
+        yield batch
+        self._commit(batch.writes)
+
+    def _commit(self, writes: list[tuple]) -> None:
+        for op, storage, key, value in writes:
+            if op == "put":
+                storage.put(key, value)
+            elif op == "delete":
+                with contextlib.suppress(KeyNotExistsException):
+                    storage.delete(key)
+            else:
+                storage.drop()
+
+    def find(
+        self,
+        storage: BaseStorage,
+        model: type[T],
+        fields: list[str] = None,
+        user: str = None,
+        newest_first: bool = False,
+        limit: int = None,
+        cursor: str = None,
+    ) -> list[T]:
+        """Find documents of the storage.
+
+        Args:
+            model: The type of returned documents.
+            fields: Fields to read (all if None).
+            user: Only documents of this user.
+            newest_first: Order by `created`, descending.
+            limit: The max. number of documents.
+            cursor: Start after the document with this id.
+        """
+        sort = [("created", firestore.Query.DESCENDING)] if newest_first else None
+        docs = (d for d in storage.get_all(sort) if not user or d.user == user)
+        if cursor:
+            docs = itertools.dropwhile(lambda d: d.chat_session_id != cursor, docs)
+            next(docs, None)
+        fields = fields or list(model.model_fields)
+        return [
+            model.model_validate({f: getattr(d, f) for f in fields if hasattr(d, f)})
+            for d in itertools.islice(docs, limit)
+        ]
+
+
+class FirestoreSessionQueries(SessionQueries):
+    """Queries and batches run in Firestore, only selected fields are read.
+
+    Filtering by user and ordering by `created` at once needs
+    the composite index on `user` and `created`.
+    """
+
+    BATCH_SIZE = 500
+    """Max. writes of one Firestore batch."""
+
+    def _commit(self, writes: list[tuple]) -> None:
+        """Writes are committed in Firestore batches, atomically up to
+        `BATCH_SIZE` writes."""
+        refs = []
+        for op, storage, key, value in writes:
+            coll_ref = storage._coll_ref
+            if op == "put":
+                data = value.model_dump(by_alias=True, exclude_none=True)
+                refs.append((coll_ref.document(key), data))
+            elif op == "delete":
+                refs.append((coll_ref.document(key), None))
+            else:
+                refs.extend((ref, None) for ref in coll_ref.list_documents())
+        if not refs:
+            return
+        client = writes[0][1]._coll_ref._client
+        for start in range(0, len(refs), self.BATCH_SIZE):
+            batch = client.batch()
+            for ref, data in refs[start : start + self.BATCH_SIZE]:
+                if data is None:
+                    batch.delete(ref)
+                else:
+                    batch.set(ref, data)
+            batch.commit()
+
+    def find(
+        self,
+        storage: GcpStorage,
+        model: type[T],
+        fields: list[str] = None,
+        user: str = None,
+        newest_first: bool = False,
+        limit: int = None,
+        cursor: str = None,
+    ) -> list[T]:
+        coll_ref = storage._coll_ref
+        query = coll_ref
+        if user:
+            query = query.where(filter=FieldFilter("user", "==", user))
+        if newest_first:
+            query = query.order_by("created", direction=firestore.Query.DESCENDING)
+        if fields:
+            query = query.select(fields)
+        if cursor:
+            snapshot = coll_ref.document(cursor).get(field_paths=["created"])
+            if not snapshot.exists:
+                return []
+            query = query.start_after(snapshot)
+        if limit:
+            query = query.limit(limit)
+        return [model.model_validate(d.to_dict()) for d in query.stream()]
+
+
+def create_session_queries(storage: BaseStorage) -> SessionQueries:
+    """Queries suited to the storage (run in Firestore for `GcpStorage`)."""
+    if isinstance(storage, GcpStorage):
+        return FirestoreSessionQueries()
+    return SessionQueries()
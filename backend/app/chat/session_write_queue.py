@@ -0,0 +1,158 @@
+"""Write-behind persistence of chat sessions."""
+
+import asyncio
+import logging
+import time
+from typing import Callable, Optional
+
+from app.metrics import metrics
+
+from .chat_model import ChatSession
+from .chat_session_storage import ChatSessionStorage
+
+
+class SessionWriteQueue:
+    """Persists chat sessions in the background.
+
+    A saved session is kept in memory until it is written, so it can be
+    read back immediately. Writes of the same session are coalesced
+    (only the latest version is written) and done one at a time.
+    Failed writes are retried with exponential backoff.
+
+    Queued sessions are visible only to this worker. Another worker
+    loading the session before it is written would write the next turn
+    over the queued messages, so the queue is safe only with one instance.
+    """
+
+    _log = logging.getLogger(__name__)
+
+    def __init__(self, max_retries: int = 3, retry_delay_seconds: float = 0.5):
+        self.max_retries = max_retries
+        self.retry_delay_seconds = retry_delay_seconds
+        self._pending: dict[str, tuple[ChatSessionStorage, ChatSession]] = {}
+        self._updates: dict[str, dict[str, tuple[Callable, ChatSession]]] = {}
+        self._writing: dict[str, ChatSession] = {}
+        self._tasks: dict[str, asyncio.Task] = {}
+
+    def save(self, storage: ChatSessionStorage, chat_session: ChatSession) -> None:
+        """Queue the session to be saved."""
+        chat_session_id = chat_session.chat_session_id
+        if chat_session_id in self._pending:
+            metrics.inc("chat_session_writes_coalesced_total")
+        self._pending[chat_session_id] = (storage, chat_session.model_copy(deep=True))
+        self._start(chat_session_id)
+
+    def update_summary(
+        self, storage: ChatSessionStorage, chat_session: ChatSession
+    ) -> None:
+        """Queue the update of the history summary of the session."""
+        chat_session_id = chat_session.chat_session_id
+        if chat_session_id in self._pending:
+            pending = self._pending[chat_session_id][1]
+            if (pending.summarized_count or 0) < chat_session.summarized_count:
+                pending.history_summary = chat_session.history_summary
+                pending.summarized_count = chat_session.summarized_count
+        queued = self._updates.get(chat_session_id, {}).get("summary")
+        if not queued or queued[1].summarized_count < chat_session.summarized_count:
+            self._queue_update("summary", storage.update_summary, chat_session)
+
+    def update_title(
+        self, storage: ChatSessionStorage, chat_session: ChatSession
+    ) -> None:
+        """Queue the update of the title (`summary`) of the session."""
+        pending = self._pending.get(chat_session.chat_session_id)
+        if pending:
+            pending[1].summary = chat_session.summary
+        self._queue_update("title", storage.update_title, chat_session)
+
+    def _queue_update(
+        self,
+        name: str,
+        write: Callable[[ChatSession], None],
+        chat_session: ChatSession,
+    ) -> None:
+        chat_session_id = chat_session.chat_session_id
+        self._updates.setdefault(chat_session_id, {})[name] = (
+            write,
+            chat_session.model_copy(update={"history": []}),
+        )
+        self._start(chat_session_id)
+
+    def get(self, chat_session_id: str) -> Optional[ChatSession]:
+        """Return the session which is not written yet (a copy) or None."""
+        pending = self._pending.get(chat_session_id)
+        chat_session = pending[1] if pending else self._writing.get(chat_session_id)
+        return chat_session.model_copy(deep=True) if chat_session else None
+
+    def get_all(self) -> list[ChatSession]:
+        """Return sessions which are not written yet (without history)."""
+        sessions = {**self._writing, **{k: v[1] for k, v in self._pending.items()}}
+        return [s.model_copy(update={"history": []}) for s in sessions.values()]
+
+    def is_pending(self, chat_session_id: str) -> bool:
+        """Whether writes of the session are queued or running."""
+        return chat_session_id in self._tasks
+
+    async def discard(self, chat_session_id: str) -> None:
+        """Drop queued writes of the session and wait for a running one
+        (e.g. before the session is deleted or rewritten)."""
+        self._pending.pop(chat_session_id, None)
+        self._updates.pop(chat_session_id, None)
+        task = self._tasks.get(chat_session_id)
+        if task:
+            await asyncio.wait([task])
+
+    async def flush(self, timeout: float = None) -> None:
+        """Wait until queued sessions are written (e.g. on shutdown)."""
+        if self._tasks:
+            self._log.debug("Flushing %d chat sessions", len(self._tasks))
+            await asyncio.wait(set(self._tasks.values()), timeout=timeout)
+        if self._tasks:
+            self._log.error("%d chat sessions were not written", len(self._tasks))
+
+    def _start(self, chat_session_id: str) -> None:
+        if chat_session_id not in self._tasks:
+            task = asyncio.create_task(self._drain(chat_session_id))
+            self._tasks[chat_session_id] = task
+            task.add_done_callback(lambda _: self._tasks.pop(chat_session_id, None))
+
+    async def _drain(self, chat_session_id: str) -> None:
+        while chat_session_id in self._pending or chat_session_id in self._updates:
+            if chat_session_id in self._pending:
+                storage, chat_session = self._pending.pop(chat_session_id)
+                self._writing[chat_session_id] = chat_session
+                try:
+                    await self._write(storage.save, chat_session)
+                finally:
+                    self._writing.pop(chat_session_id, None)
+            else:
+                updates = self._updates[chat_session_id]
+                write, chat_session = updates.pop(next(iter(updates)))
+                if not updates:
+                    del self._updates[chat_session_id]
+                await self._write(write, chat_session)
+
+    async def _write(
+        self, write: Callable[[ChatSession], None], chat_session: ChatSession
+    ) -> None:
+        for attempt in range(self.max_retries + 1):
+            start = time.monotonic()
+            try:
+                await asyncio.to_thread(write, chat_session)
+                metrics.observe("chat_session_write_seconds", time.monotonic() - start)
+                return
+            except Exception as e:
+                if attempt == self.max_retries:
+                    self._log.error(
+                        "Chat session %s not written: %s",
+                        chat_session.chat_session_id,
+                        e,
+                    )
+                    metrics.inc("chat_session_writes_failed_total")
+                    return
+                self._log.warning(
+                    "Writing chat session %s failed (%s), retrying",
+                    chat_session.chat_session_id,
+                    e,
+                )
+                await asyncio.sleep(self.retry_delay_seconds * 2**attempt)
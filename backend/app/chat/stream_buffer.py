@@ -0,0 +1,171 @@
+"""Buffers of streamed answers, so clients can reconnect to them."""
+
+import asyncio
+import logging
+from collections import deque
+from typing import AsyncIterator, Optional
+from uuid import uuid4
+
+from .chat_service import StreamedEvent
+
+
+class StreamOffsetError(ValueError):
+    def __init__(self, offset: int, first_offset: int):
+        super().__init__(
+            f"Offset {offset} requested, but only events from {first_offset} are buffered."
+        )
+
+
+class StreamBuffer:
+    """Bounded ring buffer of events of one answer stream.
+
+    Events are numbered from 0 (offset). Only the last `max_events`
+    are kept. When the last reader leaves before the stream is done,
+    the producer is cancelled after `resume_grace_seconds` unless
+    a client reconnects (without grace period it is cancelled at once).
+    """
+
+    _log = logging.getLogger(__name__)
+
+    def __init__(
+        self,
+        chat_session_id: str,
+        user: str,
+        max_events: int = 1000,
+        resume_grace_seconds: float = 30,
+    ):
+        self.stream_id = str(uuid4())
+        self.chat_session_id = chat_session_id
+        self.user = user
+        self.resume_grace_seconds = resume_grace_seconds
+        self.done = False
+        self.task: asyncio.Task = None
+        self._events: deque[StreamedEvent] = deque(maxlen=max_events)
+        self._count = 0
+        self._changed = asyncio.Condition()
+        self._readers = 0
+        self._abandon_handle: asyncio.TimerHandle = None
+
+    @property
+    def first_offset(self) -> int:
+        """Offset of the oldest buffered event."""
+        return self._count - len(self._events)
+
+    @property
+    def next_offset(self) -> int:
+        """Offset of the next event."""
+        return self._count
+
+    async def append(self, event: StreamedEvent) -> None:
+        self._events.append(event)
+        self._count += 1
+        async with self._changed:
+            self._changed.notify_all()
+
+    async def finish(self) -> None:
+        self.done = True
+        if self._abandon_handle:
+            self._abandon_handle.cancel()
+        async with self._changed:
+            self._changed.notify_all()
+
+    async def read(self, offset: int = 0) -> AsyncIterator[StreamedEvent]:
+        """Stream events from the offset until the stream is done."""
+        if offset < self.first_offset:
+            raise StreamOffsetError(offset, self.first_offset)
+        self._readers += 1
+        if self._abandon_handle:
+            self._abandon_handle.cancel()
+            self._abandon_handle = None
+        try:
+            while True:
+                async with self._changed:
+                    await self._changed.wait_for(
+                        lambda: self._count > offset or self.done
+                    )
+                if offset < self.first_offset:
+                    raise StreamOffsetError(offset, self.first_offset)
+                while offset < self._count:
+                    yield self._events[offset - self.first_offset]
+                    offset += 1
+                if self.done and offset >= self._count:
+                    return
+        finally:
+            self._readers -= 1
+            if self._readers == 0 and not self.done:
+                if self.resume_grace_seconds:
+                    self._abandon_handle = asyncio.get_running_loop().call_later(
+                        self.resume_grace_seconds, self._cancel_if_abandoned
+                    )
+                else:
+                    self._cancel_if_abandoned()
+
+    def _cancel_if_abandoned(self) -> None:
+        if self._readers == 0 and not self.done and self.task:
+            self._log.debug("Stream %s abandoned, cancelling", self.stream_id)
+            self.task.cancel()
+
+
+class StreamRegistry:
+    """Answer streams of the worker.
+
+    Streams are produced independently of the HTTP request, so a client
+    can reconnect (to the same worker) and read the rest of the answer.
+    Only resumable streams wait `resume_grace_seconds` for the client,
+    others are cancelled as soon as their reader leaves. Finished streams
+    are kept for `retention_seconds`.
+    """
+
+    _log = logging.getLogger(__name__)
+
+    def __init__(
+        self,
+        max_events: int = 1000,
+        resume_grace_seconds: float = 5,
+        retention_seconds: float = 300,
+    ):
+        self.max_events = max_events
+        self.resume_grace_seconds = resume_grace_seconds
+        self.retention_seconds = retention_seconds
+        self._buffers: dict[str, StreamBuffer] = {}
+
+    def start(
+        self,
+        chat_session_id: str,
+        user: str,
+        events: AsyncIterator[StreamedEvent],
+        resumable: bool = False,
+    ) -> StreamBuffer:
+        """Start producing events into a new buffer.
+
+        Args:
+            resumable: The client reconnects when it is disconnected, so
+                the stream isn't cancelled within the grace period.
+        """
+        buffer = StreamBuffer(
+            chat_session_id,
+            user,
+            self.max_events,
+            self.resume_grace_seconds if resumable else 0,
+        )
+        self._buffers[buffer.stream_id] = buffer
+        buffer.task = asyncio.create_task(self._produce(buffer, events))
+        return buffer
+
+    async def _produce(
+        self, buffer: StreamBuffer, events: AsyncIterator[StreamedEvent]
+    ) -> None:
+        try:
+            async for event in events:
+                await buffer.append(event)
+        finally:
+            await buffer.finish()
+            asyncio.get_running_loop().call_later(
+                self.retention_seconds, self._buffers.pop, buffer.stream_id, None
+            )
+
+    def get(self, stream_id: str) -> Optional[StreamBuffer]:
+        return self._buffers.get(stream_id)
+
+    def active_count(self) -> int:
+        return sum(1 for b in self._buffers.values() if not b.done)
@@ -0,0 +1,54 @@
+import asyncio
+import logging
+
+from ai_agents import AIAgent
+
+
+class ChatTitleGenerator:
+    """Short titles of chat sessions (`ChatSession.summary`).
+
+    A title is the first line of the first message truncated to
+    `max_length` until the title agent (a cheap model) generates a better
+    one from the first exchange. Without the agent, only the truncated
+    title is used.
+    """
+
+    TITLE_PROMPT = """Write a short title (at most six words) of the conversation
+below in its language. Return only the title, without quotes.
+
+# User
+
+{prompt}
+
+# Assistant
+
+{answer}
+"""
+    EXCERPT_LENGTH = 2000
+    """Characters of each message sent to the title agent."""
+
+    _log = logging.getLogger(__name__)
+
+    def __init__(self, title_agent: AIAgent = None, max_length: int = 80):
+        self.title_agent = title_agent
+        self.max_length = max_length
+
+    def truncate(self, text: str) -> str:
+        """First non-empty line cut at a word boundary to `max_length`."""
+        line = next((ln.strip() for ln in (text or "").splitlines() if ln.strip()), "")
+        if len(line) <= self.max_length:
+            return line
+        cut = line[: self.max_length - 1]
+        if " " in cut:
+            cut = cut.rsplit(" ", 1)[0]
+        return cut.rstrip(" ,.;:") + "…"
+
+    async def generate(self, prompt: str, answer: str) -> str:
+        """Generate the title of the conversation (empty if it can't)."""
+        if not self.title_agent:
+            return ""
+        title_prompt = self.TITLE_PROMPT.format(
+            prompt=prompt[: self.EXCERPT_LENGTH], answer=answer[: self.EXCERPT_LENGTH]
+        )
+        title = await asyncio.to_thread(self.title_agent.run, title_prompt)
+        return self.truncate(title.strip().strip("\"'*#"))
@@ -1,4 +1,4 @@
-from typing import List, Optional
+from typing import Dict, List, Optional
 from pydantic import BaseModel
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -14,6 +14,61 @@ class DefaultUserConfig(BaseModel):
 class KnowledgeBaseConfig(BaseModel):
     embedding_model: str = "text-multilingual-embedding-002"
     embedding_search_limit: int = 5
+    embedding_batch_wait_ms: float = 5
+    embedding_max_batch_size: int = 100
+    query_embedding_cache_max_entries: int = 5000
+    query_embedding_cache_ttl_seconds: int = 24 * 3600
+
+
+class ModelRoutingConfig(BaseModel):
+    fallbacks: Dict[str, List[str]] = {
+        "gemini-2.0-flash": ["gemini-1.5-flash"],
+        "gemini-1.5-flash": ["gemini-2.0-flash"],
+        "gemini-1.5-pro": ["gemini-2.0-flash"],
+    }
+    ttft_slo_seconds: float = 5.0
+    max_error_rate: float = 0.5
+    throttle_cooldown_seconds: float = 60
+    first_token_timeout_seconds: Optional[float] = 15.0
+
+
+class AdmissionConfig(BaseModel):
+    model_concurrency: Dict[str, int] = {}
+    default_model_concurrency: int = 20
+    queue_timeout_seconds: float = 30
+
+
+class ChatConfig(BaseModel):
+    append_only_history: bool = True
+    header_index: bool = False
+    history_token_budget: int = 32000
+    summary_model: str = "gemini-2.0-flash"
+    title_model: Optional[str] = "gemini-2.0-flash-lite"
+    title_max_length: int = 80
+    context_cache: bool = False
+    context_cache_ttl_seconds: int = 3600
+    context_cache_max_entries: int = 100
+    context_cache_min_tokens: int = 32768
+    response_cache_ttl_seconds: int = 3600
+    response_cache_max_entries: int = 1000
+    response_cache_similarity: Optional[float] = None
+    coalesce_requests: bool = True
+    stream_buffer_max_events: int = 1000
+    stream_resume_grace_seconds: int = 5
+    stream_retention_seconds: int = 300
+    stream_coalesce_ms: float = 5
+    model_routing: ModelRoutingConfig = ModelRoutingConfig()
+    admission: AdmissionConfig = AdmissionConfig()
+    # The write queue is per worker, enable it only with a single instance
+    # (sessions saved by another instance don't see queued messages)
+    deferred_persistence: bool = False
+    session_write_retries: int = 3
+    session_write_retry_delay_seconds: float = 0.5
+    search_index_ttl_seconds: int = 300
+    search_index_max_users: int = 100
+    archive_after_days: int = 7
+    # Agents tagged by name in metrics (others are tagged "other")
+    metrics_agents: List[str] = []
 
 
 class GenerativeModelConfig(BaseModel):
@@ -65,6 +120,7 @@ class ServerConfig(BaseSettings):
     file_storage_bucket: str = ""
 
     knowledge_base: KnowledgeBaseConfig = KnowledgeBaseConfig()
+    chat: ChatConfig = ChatConfig()
     generative_model_config: GenerativeModelConfig = GenerativeModelConfig()
     smtp: SmtpConfig = SmtpConfig()
     reset_password_mail: ResetPasswordMailConfig = ResetPasswordMailConfig()
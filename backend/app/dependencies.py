@@ -1,6 +1,7 @@
 """This module contains dependencies for FastAPI endpoints."""
 
 import logging
+from functools import lru_cache
 from typing import Annotated
 from dotenv import load_dotenv
 from fastapi import Depends, FastAPI
@@ -11,18 +12,70 @@ from haintech.ai import AiFactory
 from ampf.auth import TokenPayload, AuthService, InsufficientPermissionsError
 from ampf.base import BaseFactory, BaseEmailSender, SmtpEmailSender, EmailTemplate
 from ampf.gcp import GcpFactory
+from app.background_tasks import wait_for_background_tasks
 from app.file.file_service import FileService
 from app.user.user_service import UserService
 
 from app.config import ServerConfig
 from app.agent import AgentService
+from app.cache import TTLCache
 from app.chat import ChatService
+from app.chat.admission import AdmissionController
+from app.chat.context_cache import ContextCache, GeminiCachedContentBackend
+from app.chat.model_router import ModelRouter
+from app.chat.request_coalescer import RequestCoalescer
+from app.chat.response_cache import ResponseCache
+from app.chat.session_write_queue import SessionWriteQueue
+from app.chat.stream_buffer import StreamRegistry
+from app.chat.file_stager import BaseBlobCopier, GcsBlobCopier, StorageBlobCopier
 from haintech.ai.base.base_ai_text_embedding_model import BaseAITextEmbeddingModel
+from haintech.ai.base.micro_batching_text_embedding_model import (
+    MicroBatchingTextEmbeddingModel,
+)
 
 
 load_dotenv()
 _log = logging.getLogger(__name__)
 _server_config = ServerConfig()
+_context_cache = ContextCache(
+    GeminiCachedContentBackend(),
+    ttl_seconds=_server_config.chat.context_cache_ttl_seconds,
+    max_entries=_server_config.chat.context_cache_max_entries,
+    min_tokens=_server_config.chat.context_cache_min_tokens,
+)
+_request_coalescer = RequestCoalescer()
+_model_router = ModelRouter(
+    fallbacks={
+        model: [f for f in fallbacks if f in _server_config.models]
+        for model, fallbacks in _server_config.chat.model_routing.fallbacks.items()
+    },
+    ttft_slo_seconds=_server_config.chat.model_routing.ttft_slo_seconds,
+    max_error_rate=_server_config.chat.model_routing.max_error_rate,
+    throttle_cooldown_seconds=_server_config.chat.model_routing.throttle_cooldown_seconds,
+    first_token_timeout_seconds=_server_config.chat.model_routing.first_token_timeout_seconds,
+)
+_admission_controller = AdmissionController(
+    model_limits=_server_config.chat.admission.model_concurrency,
+    default_limit=_server_config.chat.admission.default_model_concurrency,
+    queue_timeout_seconds=_server_config.chat.admission.queue_timeout_seconds,
+)
+_session_write_queue = SessionWriteQueue(
+    max_retries=_server_config.chat.session_write_retries,
+    retry_delay_seconds=_server_config.chat.session_write_retry_delay_seconds,
+)
+_query_embedding_cache = TTLCache(
+    max_entries=_server_config.knowledge_base.query_embedding_cache_max_entries,
+    ttl_seconds=_server_config.knowledge_base.query_embedding_cache_ttl_seconds,
+)
+_search_index_cache = TTLCache(
+    max_entries=_server_config.chat.search_index_max_users,
+    ttl_seconds=_server_config.chat.search_index_ttl_seconds,
+)
+_stream_registry = StreamRegistry(
+    max_events=_server_config.chat.stream_buffer_max_events,
+    resume_grace_seconds=_server_config.chat.stream_resume_grace_seconds,
+    retention_seconds=_server_config.chat.stream_retention_seconds,
+)
 
 
 @asynccontextmanager
@@ -33,6 +86,9 @@ async def lifespan(app: FastAPI):
     UserService(GcpFactory()).initialize_storage_with_user(_server_config.default_user)
     yield
     _log.debug("Shutting down")
+    await wait_for_background_tasks(timeout=30)
+    # Background tasks may queue writes, so they are waited for first
+    await _session_write_queue.flush(timeout=30)
 
 
 async def get_server_config() -> ServerConfig:
@@ -138,10 +194,27 @@ async def get_ai_factory() -> AiFactory:
 AiFactoryDep = Annotated[AiFactory, Depends(get_ai_factory)]
 
 
+_embedding_model: BaseAITextEmbeddingModel = None
+
+
 async def get_ai_text_embedding_model(
     ai_factory: AiFactoryDep, config: ServerConfigDep
-):
-    return ai_factory.get_text_embedding_model(config.knowledge_base.embedding_model)
+) -> BaseAITextEmbeddingModel:
+    """Embedding model shared by requests, so their concurrent calls are
+    sent in batches."""
+    global _embedding_model
+    if not _embedding_model:
+        model = ai_factory.get_text_embedding_model(
+            config.knowledge_base.embedding_model
+        )
+        if config.knowledge_base.embedding_batch_wait_ms:
+            model = MicroBatchingTextEmbeddingModel(
+                model,
+                max_wait_seconds=config.knowledge_base.embedding_batch_wait_ms / 1000,
+                max_batch_size=config.knowledge_base.embedding_max_batch_size,
+            )
+        _embedding_model = model
+    return _embedding_model
 
 
 EmbeddingModelDep = Annotated[
@@ -149,6 +222,93 @@ EmbeddingModelDep = Annotated[
 ]
 
 
+async def get_query_embedding_cache() -> TTLCache:
+    return _query_embedding_cache
+
+
+QueryEmbeddingCacheDep = Annotated[TTLCache, Depends(get_query_embedding_cache)]
+
+
+@lru_cache
+def _get_gcs_blob_copier(bucket_name: str) -> GcsBlobCopier:
+    return GcsBlobCopier(bucket_name)
+
+
+async def get_blob_copier(
+    factory: FactoryDep, config: ServerConfigDep
+) -> BaseBlobCopier:
+    if config.file_storage_bucket:
+        return _get_gcs_blob_copier(config.file_storage_bucket)
+    return StorageBlobCopier(factory)
+
+
+BlobCopierDep = Annotated[BaseBlobCopier, Depends(get_blob_copier)]
+
+
+async def get_context_cache(config: ServerConfigDep) -> ContextCache:
+    return _context_cache if config.chat.context_cache else None
+
+
+ContextCacheDep = Annotated[ContextCache, Depends(get_context_cache)]
+
+
+_response_cache: ResponseCache = None
+
+
+async def get_response_cache(
+    config: ServerConfigDep, embedding_model: EmbeddingModelDep
+) -> ResponseCache:
+    global _response_cache
+    if not _response_cache:
+        _response_cache = ResponseCache(
+            ttl_seconds=config.chat.response_cache_ttl_seconds,
+            max_entries=config.chat.response_cache_max_entries,
+            similarity_threshold=config.chat.response_cache_similarity,
+            embedding_model=embedding_model,
+        )
+    return _response_cache
+
+
+ResponseCacheDep = Annotated[ResponseCache, Depends(get_response_cache)]
+
+
+async def get_request_coalescer(config: ServerConfigDep) -> RequestCoalescer:
+    return _request_coalescer if config.chat.coalesce_requests else None
+
+
+RequestCoalescerDep = Annotated[RequestCoalescer, Depends(get_request_coalescer)]
+
+
+async def get_model_router() -> ModelRouter:
+    return _model_router
+
+
+ModelRouterDep = Annotated[ModelRouter, Depends(get_model_router)]
+
+
+async def get_admission_controller() -> AdmissionController:
+    return _admission_controller
+
+
+AdmissionControllerDep = Annotated[
+    AdmissionController, Depends(get_admission_controller)
+]
+
+
+async def get_session_write_queue(config: ServerConfigDep) -> SessionWriteQueue:
+    return _session_write_queue if config.chat.deferred_persistence else None
+
+
+SessionWriteQueueDep = Annotated[SessionWriteQueue, Depends(get_session_write_queue)]
+
+
+async def get_search_index_cache() -> TTLCache:
+    return _search_index_cache
+
+
+SearchIndexCacheDep = Annotated[TTLCache, Depends(get_search_index_cache)]
+
+
 async def get_chat_service(
     factory: FactoryDep,
     ai_factory: AiFactoryDep,
@@ -156,6 +316,15 @@ async def get_chat_service(
     server_config: ServerConfigDep,
     file_service: FileServiceDep,
     user_email: UserEmailDep,
+    blob_copier: BlobCopierDep,
+    context_cache: ContextCacheDep,
+    response_cache: ResponseCacheDep,
+    request_coalescer: RequestCoalescerDep,
+    model_router: ModelRouterDep,
+    admission_controller: AdmissionControllerDep,
+    session_write_queue: SessionWriteQueueDep,
+    search_index_cache: SearchIndexCacheDep,
+    query_embedding_cache: QueryEmbeddingCacheDep,
 ) -> ChatService:
     return ChatService(
         factory,
@@ -164,7 +333,23 @@ async def get_chat_service(
         file_service.storage,
         server_config,
         user_email,
+        blob_copier=blob_copier,
+        context_cache=context_cache,
+        response_cache=response_cache,
+        request_coalescer=request_coalescer,
+        model_router=model_router,
+        admission_controller=admission_controller,
+        session_write_queue=session_write_queue,
+        search_index_cache=search_index_cache,
+        query_embedding_cache=query_embedding_cache,
     )
 
 
 ChatServiceDep = Annotated[ChatService, Depends(get_chat_service)]
+
+
+async def get_stream_registry() -> StreamRegistry:
+    return _stream_registry
+
+
+StreamRegistryDep = Annotated[StreamRegistry, Depends(get_stream_registry)]
@@ -2,6 +2,7 @@ import logging
 from typing import List, Optional
 
 from haintech.ai.base.base_ai_text_embedding_model import BaseAITextEmbeddingModel
+from app.cache import TTLCache
 
 from .knowledge_base_storage import KnowledgeBaseStorage
 from .knowledge_base_model import KnowledgeBaseItem, KnowledgeBaseItemHeader
@@ -15,10 +16,13 @@ class KnowledgeBaseService:
     """
 
     def __init__(
-        self, embedding_model: BaseAITextEmbeddingModel, config: KnowledgeBaseConfig
+        self,
+        embedding_model: BaseAITextEmbeddingModel,
+        config: KnowledgeBaseConfig,
+        embedding_cache: TTLCache = None,
     ):
         self.storage = KnowledgeBaseStorage(
-            embedding_model, config.embedding_search_limit
+            embedding_model, config.embedding_search_limit, embedding_cache
         )
         self._log = logging.getLogger(__name__)
 
@@ -29,6 +33,16 @@ class KnowledgeBaseService:
         await self.storage.save(item)
         return item
 
+    async def create_items(
+        self, items: List[KnowledgeBaseItem]
+    ) -> List[KnowledgeBaseItem]:
+        """
+        Creates knowledge base items at once (their contents are embedded
+        together).
+        """
+        await self.storage.save_many(items)
+        return items
+
     def get_item(self, item_id: str) -> Optional[KnowledgeBaseItem]:
         """
         Retrieves a knowledge base item by its ID.
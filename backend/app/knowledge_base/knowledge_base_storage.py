@@ -1,6 +1,11 @@
+import asyncio
+import hashlib
+from array import array
 from typing import List
 from ampf.gcp import GcpStorage
 from haintech.ai.base.base_ai_text_embedding_model import BaseAITextEmbeddingModel
+from app.cache import TTLCache
+from app.metrics import metrics
 from .knowledge_base_model import KnowledgeBaseItem
 from google.cloud.firestore_v1.vector import Vector
 from google.cloud.firestore_v1.vector_query import VectorQuery
@@ -8,16 +13,25 @@ from google.cloud.firestore_v1.base_vector_query import DistanceMeasure
 
 
 class KnowledgeBaseStorage(GcpStorage):
-    """Storage for knowledge base items."""
+    """Storage for knowledge base items.
+
+    Embeddings of search texts are kept in `embedding_cache` (shared by
+    requests of the worker), so repeated queries don't call the model.
+    """
+
+    BATCH_SIZE = 500
+    """Max. writes of one Firestore batch."""
 
     def __init__(
         self,
         embedding_model: BaseAITextEmbeddingModel,
         embedding_search_limit: int = 5,
+        embedding_cache: TTLCache[tuple, array] = None,
     ):
         super().__init__("KnowledgeBase", KnowledgeBaseItem, key_name="item_id")
         self.embedding_search_limit = embedding_search_limit
         self.embedding_model = embedding_model
+        self.embedding_cache = embedding_cache
 
     async def on_before_save(self, item: dict) -> dict:
         """Calculate embedding vector before saving data to Firestore."""
@@ -26,6 +40,15 @@ class KnowledgeBaseStorage(GcpStorage):
         )
         return item
 
+    async def on_before_save_many(self, items: List[dict]) -> List[dict]:
+        """Calculate embedding vectors of items by one `get_embeddings` call."""
+        embeddings = await self.embedding_model.get_embeddings(
+            [item["content"] for item in items]
+        )
+        for item, embedding in zip(items, embeddings):
+            item["embedding"] = Vector(embedding)
+        return items
+
     async def find_nearest(
         self, text: str, keywords: List[str] = None, limit: int = None
     ) -> List[KnowledgeBaseItem]:
@@ -34,13 +57,48 @@ class KnowledgeBaseStorage(GcpStorage):
         Args:
             text: The text to search for.
             keywords: A list of keywords (any of) to filter the search results."""
+        embedding = await self.get_query_embedding(text)
+        return await self.find_nearest_to_embedding(embedding, keywords, limit)
+
+    async def get_query_embedding(self, text: str) -> List[float]:
+        """Returns the embedding of the search text."""
+        if self.embedding_cache is None:
+            return await self.embedding_model.get_embedding(text=text)
+        key = self._embedding_key(text)
+        cached = self.embedding_cache.get(key)
+        if cached is not None:
+            metrics.inc("query_embedding_cache_hits_total")
+            return cached.tolist()
+        metrics.inc("query_embedding_cache_misses_total")
         embedding = await self.embedding_model.get_embedding(text=text)
+        # Doubles in an array take a fraction of the memory of a float list
+        self.embedding_cache.put(key, array("d", embedding))
+        return embedding
+
+    def _embedding_key(self, text: str) -> tuple:
+        """Embeddings depend on the model and its dimensionality."""
+        return (
+            getattr(
+                self.embedding_model,
+                "ai_model_name",
+                type(self.embedding_model).__name__,
+            ),
+            getattr(self.embedding_model, "dimensionality", None),
+            hashlib.sha256(text.encode()).hexdigest(),
+        )
+
+    async def find_nearest_to_embedding(
+        self, embedding: List[float], keywords: List[str] = None, limit: int = None
+    ) -> List[KnowledgeBaseItem]:
+        """Finds the nearest knowledge base items to the given embedding."""
         vq: VectorQuery = self._coll_ref.find_nearest(
             vector_field="embedding",
             query_vector=Vector(embedding),
             distance_measure=DistanceMeasure.COSINE,
             limit=limit or self.embedding_search_limit,
-        ).get()
+        )
+        # Synchronous query mustn't block the event loop
+        vq = await asyncio.to_thread(vq.get)
         if keywords:
             ret = []
             for ds in vq:
@@ -61,3 +119,18 @@ class KnowledgeBaseStorage(GcpStorage):
         data_dict = data.model_dump(by_alias=True, exclude_none=True)
         data_dict = await self.on_before_save(data_dict)  # Preprocess data
         self._coll_ref.document(key).set(data_dict)
+
+    async def save_many(self, values: List[KnowledgeBaseItem]) -> None:
+        """Save items embedded together, in Firestore batches."""
+        data = await self.on_before_save_many(
+            [v.model_dump(by_alias=True, exclude_none=True) for v in values]
+        )
+        for start in range(0, len(data), self.BATCH_SIZE):
+            batch = self._coll_ref._client.batch()
+            for value, data_dict in zip(
+                values[start : start + self.BATCH_SIZE],
+                data[start : start + self.BATCH_SIZE],
+            ):
+                batch.set(self._coll_ref.document(self.get_key(value)), data_dict)
+            # Synchronous commit mustn't block the event loop
+            await asyncio.to_thread(batch.commit)
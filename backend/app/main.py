@@ -6,7 +6,7 @@ from ampf.fastapi.static_file_response import StaticFileResponse
 from app.config import ServerConfig
 from app.logging_conf import setup_logging
 
-from app.routers import auth, chats, config, files, upgrade
+from app.routers import auth, chats, config, files, metrics, upgrade
 
 from app.dependencies import ServerConfigDep, lifespan
 from .routers import users, agents, knowledge_base
@@ -31,6 +31,7 @@ app.include_router(prefix="/api/chats", router=chats.router)
 app.include_router(prefix="/api/agents", router=agents.router)
 app.include_router(prefix="/api/knowledge-base", router=knowledge_base.router)
 app.include_router(prefix="/api/upgrade", router=upgrade.router)
+app.include_router(prefix="/api/metrics", router=metrics.router)
 
 
 @app.get("/api/ping")
@@ -0,0 +1,108 @@
+"""Process-wide metrics of the worker."""
+
+import contextlib
+import time
+from collections import defaultdict, deque
+from typing import Any, Iterator
+
+Tags = tuple[tuple[str, str], ...]
+
+
+class Summary:
+    """Distribution of observed values.
+
+    Percentiles are computed from the last `window` observations.
+    """
+
+    def __init__(self, window: int = 1000):
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.recent: deque[float] = deque(maxlen=window)
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        self.recent.append(value)
+
+    def percentile(self, percentile: float) -> float:
+        if not self.recent:
+            return 0.0
+        ordered = sorted(self.recent)
+        return ordered[min(int(len(ordered) * percentile), len(ordered) - 1)]
+
+    def to_dict(self) -> dict[str, float]:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else 0.0,
+            "max": self.max,
+            "p50": self.percentile(0.5),
+            "p90": self.percentile(0.9),
+            "p99": self.percentile(0.99),
+        }
+
+
+class Metrics:
+    """Counters, gauges and summaries tagged with key-value pairs."""
+
+    def __init__(self):
+        self.counters: dict[str, dict[Tags, float]] = defaultdict(
+            lambda: defaultdict(float)
+        )
+        self.gauges: dict[str, dict[Tags, float]] = defaultdict(
+            lambda: defaultdict(float)
+        )
+        self.summaries: dict[str, dict[Tags, Summary]] = defaultdict(
+            lambda: defaultdict(Summary)
+        )
+
+    @staticmethod
+    def _tags(tags: dict[str, Any]) -> Tags:
+        return tuple(sorted((k, str(v)) for k, v in tags.items() if v is not None))
+
+    def inc(self, name: str, value: float = 1, **tags) -> None:
+        """Increment counter."""
+        self.counters[name][self._tags(tags)] += value
+
+    def add(self, name: str, value: float, **tags) -> None:
+        """Add value (may be negative) to gauge."""
+        self.gauges[name][self._tags(tags)] += value
+
+    def observe(self, name: str, value: float, **tags) -> None:
+        """Add value to summary."""
+        self.summaries[name][self._tags(tags)].observe(value)
+
+    @contextlib.contextmanager
+    def timer(self, name: str, **tags) -> Iterator[None]:
+        """Observe duration of the block in seconds (also when it fails)."""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, time.monotonic() - start, **tags)
+
+    def snapshot(self) -> dict[str, list[dict[str, Any]]]:
+        """Return all values as JSON serializable dictionary."""
+        ret = {}
+        for values in (self.counters, self.gauges):
+            for name, series in values.items():
+                ret[name] = [
+                    {"tags": dict(tags), "value": value}
+                    for tags, value in series.items()
+                ]
+        for name, series in self.summaries.items():
+            ret[name] = [
+                {"tags": dict(tags), **summary.to_dict()}
+                for tags, summary in series.items()
+            ]
+        return ret
+
+    def reset(self) -> None:
+        self.counters.clear()
+        self.gauges.clear()
+        self.summaries.clear()
+
+
+metrics = Metrics()
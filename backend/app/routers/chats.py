@@ -1,8 +1,18 @@
-from fastapi import APIRouter
+from typing import Annotated
+from fastapi import APIRouter, Query, Response
+from fastapi.responses import StreamingResponse
 
-from app.chat.chat_model import ChatSession, ChatSessionHeader
+from app.chat.chat_codec import chat_session_response, headers_response
+from app.chat.chat_model import (
+    ChatDeleteProgress,
+    ChatDeleteRequest,
+    ChatSession,
+    ChatSessionHeader,
+)
+from app.chat.search_index import ChatSearchResult
 from app.dependencies import ChatServiceDep, UserEmailDep
 from app.routers import chats_message
+from app.streaming import JsonArrayStreamingResponse, gzip_chunks, ndjson_lines
 
 
 router = APIRouter(tags=["chat sessions"])
@@ -10,19 +20,84 @@ router.include_router(prefix="/{chat_id}/messages", router=chats_message.router)
 ID_PATH = "/{chat_id}"
 
 
-@router.get("")
+@router.get("", response_model=list[ChatSessionHeader])
 async def get_all(
-    service: ChatServiceDep, user_email: UserEmailDep
-) -> list[ChatSessionHeader]:
-    return await service.get_all(user_email)
+    service: ChatServiceDep,
+    user_email: UserEmailDep,
+    page_size: Annotated[int, Query(ge=1, le=1000)] = None,
+    cursor: str = None,
+) -> Response:
+    """Get the user's chat sessions, the newest first.
+
+    With `page_size`, the `X-Next-Cursor` header holds the `cursor`
+    of the next page (it is missing on the last page).
+    """
+    headers, next_cursor = await service.get_page(user_email, page_size, cursor)
+    response = headers_response(headers)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return response
+
+
+@router.get(
+    "/export",
+    responses={200: {"content": {"application/x-ndjson": {}, "application/gzip": {}}}},
+)
+async def export(
+    service: ChatServiceDep,
+    user_email: UserEmailDep,
+    ids: Annotated[list[str], Query()] = None,
+    compress: bool = False,
+) -> StreamingResponse:
+    """Export chat sessions (all of the user if no ids are given) as NDJSON,
+    one session with its history per line, optionally gzip compressed."""
+    # Sessions are read lazily, in the threadpool, as the response is sent
+    lines = ndjson_lines(service.export(user_email, ids))
+    if compress:
+        return StreamingResponse(
+            gzip_chunks(lines),
+            media_type="application/gzip",
+            headers={"Content-Disposition": 'attachment; filename="chats.ndjson.gz"'},
+        )
+    return StreamingResponse(
+        lines,
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="chats.ndjson"'},
+    )
+
+
+@router.get("/search")
+async def search(
+    service: ChatServiceDep,
+    user_email: UserEmailDep,
+    q: Annotated[str, Query(min_length=1)],
+    limit: Annotated[int, Query(ge=1, le=100)] = 20,
+) -> list[ChatSearchResult]:
+    """Search the user's chat sessions by the text of their messages,
+    the best matching first."""
+    return await service.search(user_email, q, limit)
+
+
+@router.post("/bulk-delete", response_model=list[ChatDeleteProgress])
+async def bulk_delete(
+    service: ChatServiceDep,
+    user_email: UserEmailDep,
+    delete_request: ChatDeleteRequest,
+) -> JsonArrayStreamingResponse:
+    """Delete the user's chat sessions by ids and/or older than the date.
+
+    The progress (sessions deleted so far and their total number) is
+    streamed after each batch as a JSON array, one item per line.
+    """
+    return JsonArrayStreamingResponse(
+        service.delete_chats(user_email, delete_request.ids, delete_request.older_than)
+    )
 
 
-@router.get(ID_PATH)
-async def get(
-    service: ChatServiceDep, user_email: UserEmailDep, chat_id: str
-) -> ChatSession:
+@router.get(ID_PATH, response_model=ChatSession)
+async def get(service: ChatServiceDep, user_email: UserEmailDep, chat_id: str):
     chat_session = service.get(chat_id, user_email)
-    return chat_session
+    return chat_session_response(chat_session) if chat_session else chat_session
 
 
 @router.put(ID_PATH)
@@ -1,18 +1,26 @@
+import asyncio
 import logging
-from fastapi import APIRouter
+import time
+from typing import AsyncIterator
+from fastapi import APIRouter, HTTPException, Request
 
 from ampf.base import KeyNotExistsException
-from ampf.fastapi import JsonStreamingResponse
 
+from app.agent.agent_model import Agent
 from app.chat.chat_model import ChatSession
+from app.chat.chat_service import StreamedEvent
+from app.chat.stream_buffer import StreamBuffer, StreamOffsetError
 from app.dependencies import (
     ServerConfigDep,
     AgentServiceDep,
     ChatServiceDep,
     UserEmailDep,
     FileServiceDep,
+    StreamRegistryDep,
 )
 from app.chat.message.message_model import ChatMessage, ChatMessageFile
+from app.metrics import metrics
+from app.streaming import JsonArrayStreamingResponse, cancel_on_disconnect
 
 
 router = APIRouter(
@@ -24,37 +32,107 @@ _log = logging.getLogger(__name__)
 
 @router.post("", responses={200: {"content": {"text/event-stream": {}}}})
 async def post_message_async(
+    request: Request,
     message: ChatMessage,
     config: ServerConfigDep,
     user_email: UserEmailDep,
     agent_service: AgentServiceDep,
     chat_service: ChatServiceDep,
     file_service: FileServiceDep,
+    stream_registry: StreamRegistryDep,
     chat_id: str,
     model: str = None,
     agent: str = None,
+    resumable: bool = False,
 ):
-    """Post message to chat and return async response"""
-    try:
-        chat_session = chat_service.get(chat_id, user_email)
-    except KeyNotExistsException:
-        chat_session = None
-    if not chat_session:
-        chat_session = ChatSession(chat_session_id=chat_id, user=user_email)
-    files: list[ChatMessageFile] = [
-        ChatMessageFile(**sf.model_dump()) for sf in file_service.get_all_files()
-    ]
-    if agent:
-        agent_obj = agent_service.get(user_email, agent)
-    else:
-        agent_obj = agent_service.create_default(
+    """Post message to chat and return async response
+
+    The first event (`stream_id`) identifies the answer stream. When the
+    client disconnects, the generation is cancelled unless the stream is
+    `resumable`, then it can be resumed with `GET streams/{stream_id}`
+    within the grace period.
+    """
+
+    def get_chat_session() -> tuple[ChatSession, float]:
+        start = time.monotonic()
+        try:
+            chat_session = chat_service.get(chat_id, user_email)
+        except KeyNotExistsException:
+            chat_session = None
+        chat_session = chat_session or ChatSession(
+            chat_session_id=chat_id, user=user_email
+        )
+        return chat_session, time.monotonic() - start
+
+    def get_files() -> list[ChatMessageFile]:
+        return [
+            ChatMessageFile(**sf.model_dump()) for sf in file_service.get_all_files()
+        ]
+
+    def get_agent() -> Agent:
+        if agent:
+            return agent_service.get(user_email, agent)
+        return agent_service.create_default(
             user_email, ai_model_name=model if model else config.default_model
         )
-    return JsonStreamingResponse(
+
+    # Independent storage reads are done concurrently
+    (chat_session, load_seconds), files, agent_obj = await asyncio.gather(
+        asyncio.to_thread(get_chat_session),
+        asyncio.to_thread(get_files),
+        asyncio.to_thread(get_agent),
+    )
+    metrics.observe(
+        "chat_stage_seconds",
+        load_seconds,
+        stage="session_load",
+        **chat_service.metric_tags(agent_obj, agent_obj.ai_model_name),
+    )
+    buffer = stream_registry.start(
+        chat_id,
+        user_email,
         chat_service.get_answer_async(
             agent=agent_obj,
             chat_session=chat_session,
             message=message,
             files=files,
         ),
+        resumable=resumable,
+    )
+    return JsonArrayStreamingResponse(
+        cancel_on_disconnect(request, _read_with_stream_id(buffer)),
+        coalesce_seconds=config.chat.stream_coalesce_ms / 1000,
+    )
+
+
+async def _read_with_stream_id(buffer: StreamBuffer) -> AsyncIterator[StreamedEvent]:
+    yield StreamedEvent(type="stream_id", value=buffer.stream_id)
+    async for event in buffer.read():
+        yield event
+
+
+@router.get(
+    "/streams/{stream_id}", responses={200: {"content": {"text/event-stream": {}}}}
+)
+async def resume_stream(
+    request: Request,
+    config: ServerConfigDep,
+    user_email: UserEmailDep,
+    stream_registry: StreamRegistryDep,
+    chat_id: str,
+    stream_id: str,
+    offset: int = 0,
+):
+    """Return events of the answer stream from the offset (number of events
+    received so far, not counting `stream_id`) without generating it again."""
+    buffer = stream_registry.get(stream_id)
+    if not buffer or buffer.user != user_email or buffer.chat_session_id != chat_id:
+        raise HTTPException(status_code=404, detail="Stream not found")
+    if offset < buffer.first_offset:
+        raise HTTPException(
+            status_code=410, detail=str(StreamOffsetError(offset, buffer.first_offset))
+        )
+    return JsonArrayStreamingResponse(
+        cancel_on_disconnect(request, buffer.read(offset)),
+        coalesce_seconds=config.chat.stream_coalesce_ms / 1000,
     )
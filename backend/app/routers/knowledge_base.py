@@ -3,7 +3,12 @@ from typing import Annotated, List
 
 from pydantic import BaseModel
 
-from app.dependencies import Authorize, EmbeddingModelDep, ServerConfigDep
+from app.dependencies import (
+    Authorize,
+    EmbeddingModelDep,
+    QueryEmbeddingCacheDep,
+    ServerConfigDep,
+)
 
 from ..knowledge_base.knowledge_base_model import (
     KnowledgeBaseItem,
@@ -25,9 +30,13 @@ router = APIRouter(
 
 
 def get_knowledge_base_service(
-    embedding_model: EmbeddingModelDep, server_config: ServerConfigDep
+    embedding_model: EmbeddingModelDep,
+    server_config: ServerConfigDep,
+    embedding_cache: QueryEmbeddingCacheDep,
 ):
-    return KnowledgeBaseService(embedding_model, server_config.knowledge_base)
+    return KnowledgeBaseService(
+        embedding_model, server_config.knowledge_base, embedding_cache
+    )
 
 
 KnowledgeBaseServiceDep = Annotated[
@@ -43,6 +52,16 @@ async def create_item(service: KnowledgeBaseServiceDep, item: KnowledgeBaseItem)
     return await service.create_item(item)
 
 
+@router.post("/bulk", response_model=List[KnowledgeBaseItem])
+async def create_items(
+    service: KnowledgeBaseServiceDep, items: List[KnowledgeBaseItem]
+):
+    """
+    Create many knowledge base items (e.g. when a knowledge base is loaded).
+    """
+    return await service.create_items(items)
+
+
 @router.get("")
 def get_items(service: KnowledgeBaseServiceDep) -> List[KnowledgeBaseItemHeader]:
     """
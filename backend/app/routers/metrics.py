@@ -0,0 +1,17 @@
+"""Metrics of the worker."""
+
+from typing import Any
+from fastapi import APIRouter, Depends
+
+from app.dependencies import Authorize
+from app.metrics import metrics
+
+
+router = APIRouter(tags=["Metrics"])
+
+
+@router.get("", dependencies=[Depends(Authorize("admin"))])
+async def get_metrics() -> dict[str, list[dict[str, Any]]]:
+    """Return counters, gauges and summaries (e.g. `chat_stage_seconds`,
+    `chat_ttft_seconds`) collected by this worker since its start."""
+    return metrics.snapshot()
@@ -4,9 +4,19 @@ It shoult be called at night to upgrade the system.
 All steps have to be repeatable without any side effects.
 """
 
+import asyncio
+from datetime import datetime, timedelta
+
 from fastapi import APIRouter, Depends
 
-from app.dependencies import Authorize
+from app.chat.chat_session_storage import ChatSessionStorage
+from app.chat.search_index import ChatSearchIndex
+from app.dependencies import (
+    Authorize,
+    FactoryDep,
+    ServerConfigDep,
+    SessionWriteQueueDep,
+)
 from app.routers.users import UserServiceDep
 
 
@@ -17,3 +27,44 @@ router = APIRouter(tags=["upgrade"])
 async def upgrade(user_service: UserServiceDep) -> None:
     # v.0.6.4
     user_service.upgrade()
+
+
+@router.post("/chat-header-index", dependencies=[Depends(Authorize("admin"))])
+async def rebuild_chat_header_index(factory: FactoryDep, user: str = None) -> int:
+    """Rebuild per-user chat header indexes (of all users or the given one)
+    from chat sessions. Returns the number of indexed sessions.
+
+    It is run once before `chat.header_index` is switched on.
+    """
+    return await asyncio.to_thread(
+        ChatSessionStorage(factory).rebuild_header_index, user
+    )
+
+
+@router.post("/chat-search-index", dependencies=[Depends(Authorize("admin"))])
+async def rebuild_chat_search_index(factory: FactoryDep, user: str = None) -> int:
+    """Index messages of chat sessions (of all users or the given one)
+    for search. Returns the number of indexed sessions.
+
+    It is run once for sessions saved before the search was added.
+    """
+    return await asyncio.to_thread(
+        ChatSearchIndex(factory).rebuild, ChatSessionStorage(factory), user
+    )
+
+
+@router.post("/archive-chats", dependencies=[Depends(Authorize("admin"))])
+async def archive_chats(
+    factory: FactoryDep,
+    config: ServerConfigDep,
+    session_write_queue: SessionWriteQueueDep,
+    days: int = None,
+    user: str = None,
+) -> int:
+    """Archive chat sessions (of all users or the given one) not updated
+    for `days` (`chat.archive_after_days` by default). Sessions with
+    pending writes are left. Returns the number of archived sessions."""
+    before = datetime.now() - timedelta(days=days or config.chat.archive_after_days)
+    storage = ChatSessionStorage(factory, append_only=config.chat.append_only_history)
+    skip = session_write_queue.is_pending if session_write_queue else None
+    return await asyncio.to_thread(storage.archive_older_than, before, user, skip)
@@ -0,0 +1,159 @@
+"""Helpers for streaming responses."""
+
+import asyncio
+import contextlib
+import logging
+import zlib
+from typing import AsyncGenerator, AsyncIterator, Iterable, Iterator, Optional, TypeVar
+
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from pydantic_core import to_json
+
+T = TypeVar("T")
+
+_log = logging.getLogger(__name__)
+
+
+async def cancel_on_disconnect(
+    request: Request, events: AsyncGenerator[T, None], poll_interval: float = 0.5
+) -> AsyncGenerator[T, None]:
+    """Pass events through and cancel their producer when the client disconnects.
+
+    The producer gets `asyncio.CancelledError` at the point it is waiting
+    (e.g. for the next chunk from the model), so it can stop its upstream
+    and persist what was produced so far.
+    """
+    disconnected = asyncio.Event()
+
+    async def watch() -> None:
+        while not await request.is_disconnected():
+            await asyncio.sleep(poll_interval)
+        disconnected.set()
+
+    watcher = asyncio.create_task(watch())
+    next_event = None
+    try:
+        while True:
+            next_event = asyncio.ensure_future(anext(events))
+            disconnect = asyncio.ensure_future(disconnected.wait())
+            await asyncio.wait(
+                {next_event, disconnect}, return_when=asyncio.FIRST_COMPLETED
+            )
+            disconnect.cancel()
+            if not next_event.done():
+                _log.debug("Client disconnected, cancelling the stream")
+                return
+            try:
+                event = next_event.result()
+            except StopAsyncIteration:
+                return
+            yield event
+    finally:
+        watcher.cancel()
+        # Also when the response itself is cancelled
+        if next_event and not next_event.done():
+            next_event.cancel()
+            with contextlib.suppress(asyncio.CancelledError, StopAsyncIteration):
+                await next_event
+        await events.aclose()
+
+
+async def _json_array_frames(
+    items: AsyncIterator[BaseModel],
+) -> AsyncGenerator[bytes, None]:
+    yield b"[\n"
+    separator = b""
+    try:
+        async for item in items:
+            yield separator + to_json(item) + b"\n"
+            separator = b","
+    except Exception as e:
+        _log.exception("Error in streamed items: %s", e)
+        error = {"error": type(e).__name__, "args": [str(a) for a in e.args]}
+        yield separator + to_json(error) + b"\n"
+    yield b"]"
+
+
+async def encode_json_array(
+    items: AsyncIterator[BaseModel], coalesce_seconds: float = 0
+) -> AsyncGenerator[bytes, None]:
+    """Encode models as a JSON array streamed one item per line.
+
+    The framing is the one of `ampf.fastapi.JsonStreamingResponse`: `[`
+    on the first line, then one item per line, prefixed by `,` from the
+    second one, and `]` closing the array. Clients parse the lines as they
+    come after stripping the `,`. Items are encoded by pydantic-core
+    without validating them again. Frames produced within
+    `coalesce_seconds` after the first one are written together (only
+    the writes are merged, not the bytes).
+    """
+    frames = _json_array_frames(items)
+    if not coalesce_seconds:
+        async for frame in frames:
+            yield frame
+        return
+    loop = asyncio.get_running_loop()
+    pending: Optional[asyncio.Future] = None
+    try:
+        while True:
+            pending = pending or asyncio.ensure_future(anext(frames, None))
+            frame = await pending
+            pending = None
+            if frame is None:
+                return
+            batch = [frame]
+            deadline = loop.time() + coalesce_seconds
+            while frame is not None:
+                pending = asyncio.ensure_future(anext(frames, None))
+                done, _ = await asyncio.wait(
+                    {pending}, timeout=max(deadline - loop.time(), 0)
+                )
+                if not done:
+                    break  # The next frame starts a new batch
+                frame = pending.result()
+                pending = None
+                if frame is not None:
+                    batch.append(frame)
+            yield b"".join(batch)
+            if frame is None:
+                return
+    finally:
+        if pending and not pending.done():
+            pending.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await pending
+        await frames.aclose()
+
+
+class JsonArrayStreamingResponse(StreamingResponse):
+    """Streaming response of models encoded by `encode_json_array`."""
+
+    def __init__(
+        self,
+        content: AsyncIterator[BaseModel],
+        coalesce_seconds: float = 0,
+        **kwargs,
+    ):
+        super().__init__(
+            encode_json_array(content, coalesce_seconds),
+            media_type="application/json",
+            **kwargs,
+        )
+
+
+def ndjson_lines(items: Iterable[BaseModel]) -> Iterator[bytes]:
+    """Encode models as newline delimited JSON, one line at a time."""
+    for item in items:
+        yield to_json(item) + b"\n"
+
+
+def gzip_chunks(chunks: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+    """Compress chunks into one gzip stream without buffering all of them."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
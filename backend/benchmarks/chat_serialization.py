@@ -0,0 +1,99 @@
+"""Load/save throughput of chat sessions with 1k messages.
+
+Compares the former conversions (re-validating messages, FastAPI's
+generic response encoding) with the ones in `app.chat.chat_codec`.
+
+    cd backend
+    python -m benchmarks.chat_serialization
+"""
+
+import json
+import timeit
+
+from pydantic import TypeAdapter
+
+from app.chat.chat_codec import chat_session_response, to_messages
+from app.chat.chat_model import ChatSession
+from app.chat.chat_session_storage import ChatMessageRecord
+from app.chat.message import ChatMessage, ChatMessageFile
+
+MESSAGES = 1000
+REPEAT = 20
+
+_chat_session_adapter = TypeAdapter(ChatSession)
+
+
+def create_chat_session(messages: int = MESSAGES) -> ChatSession:
+    return ChatSession(
+        chat_session_id="benchmark",
+        user="benchmark@test.com",
+        summary="Benchmark",
+        history=[
+            ChatMessage(
+                author="user" if i % 2 == 0 else "ai",
+                content=f"Message {i} " + "lorem ipsum dolor sit amet " * 20,
+                files=[ChatMessageFile(name=f"f{i}.txt", mime_type="text/plain")]
+                if i % 10 == 0
+                else [],
+            )
+            for i in range(messages)
+        ],
+    )
+
+
+def load_before(records: list[ChatMessageRecord]) -> list[ChatMessage]:
+    return [ChatMessage(**r.model_dump(exclude={"message_id"})) for r in records]
+
+
+def load_after(records: list[ChatMessageRecord]) -> list[ChatMessage]:
+    return to_messages(records)
+
+
+def save_before(messages: list[ChatMessage]) -> list[ChatMessageRecord]:
+    return [
+        ChatMessageRecord(message_id=ChatMessageRecord.key(i), **m.model_dump())
+        for i, m in enumerate(messages)
+    ]
+
+
+def save_after(messages: list[ChatMessage]) -> list[ChatMessageRecord]:
+    return ChatMessageRecord.from_messages(messages)
+
+
+def response_before(chat_session: ChatSession) -> bytes:
+    """What FastAPI does with a returned model: validation against the
+    response model, conversion to JSON-able python objects and json.dumps."""
+    value = _chat_session_adapter.validate_python(chat_session)
+    content = _chat_session_adapter.dump_python(value, mode="json")
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def response_after(chat_session: ChatSession) -> bytes:
+    return chat_session_response(chat_session).body
+
+
+def measure(name: str, before, after, arg) -> None:
+    t_before = min(timeit.repeat(lambda: before(arg), number=1, repeat=REPEAT))
+    t_after = min(timeit.repeat(lambda: after(arg), number=1, repeat=REPEAT))
+    print(
+        f"{name:<10} {1 / t_before:>10.1f} {1 / t_after:>10.1f} "
+        f"{t_before / t_after:>8.1f}x"
+    )
+
+
+def main() -> None:
+    chat_session = create_chat_session()
+    records = save_after(chat_session.history)
+    assert load_after(records) == load_before(records)
+    assert json.loads(response_after(chat_session)) == json.loads(
+        response_before(chat_session)
+    )
+    print(f"Sessions per second ({MESSAGES} messages)")
+    print(f"{'':<10} {'before':>10} {'after':>10} {'speedup':>9}")
+    measure("load", load_before, load_after, records)
+    measure("save", save_before, save_after, chat_session.history)
+    measure("response", response_before, response_after, chat_session)
+
+
+if __name__ == "__main__":
+    main()
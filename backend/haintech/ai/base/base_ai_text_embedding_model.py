@@ -1,3 +1,4 @@
+import asyncio
 from abc import ABC, abstractmethod
 from typing import List
 
@@ -9,3 +10,11 @@ class BaseAITextEmbeddingModel(ABC):
     async def get_embedding(self, text: str) -> List[float]:
         """Embeds text with a pre-trained model."""
         pass
+
+    async def get_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """Embeds texts with a pre-trained model.
+
+        By default texts are embedded one by one (concurrently), models
+        with a batch API send them together.
+        """
+        return list(await asyncio.gather(*[self.get_embedding(t) for t in texts]))
@@ -0,0 +1,85 @@
+import asyncio
+import logging
+from typing import List, Optional
+
+from haintech.ai.base.base_ai_text_embedding_model import BaseAITextEmbeddingModel
+
+
+class MicroBatchingTextEmbeddingModel(BaseAITextEmbeddingModel):
+    """Sends concurrent `get_embedding` calls to the model in batches.
+
+    Texts requested within `max_wait_seconds` after the first one (up to
+    `max_batch_size`) are embedded by one `get_embeddings` call of the
+    wrapped model. It has to be shared (e.g. by requests of the worker)
+    to collect texts of concurrent calls.
+    """
+
+    _log = logging.getLogger(__name__)
+
+    def __init__(
+        self,
+        model: BaseAITextEmbeddingModel,
+        max_wait_seconds: float = 0.005,
+        max_batch_size: int = 100,
+    ):
+        self.model = model
+        self.max_wait_seconds = max_wait_seconds
+        self.max_batch_size = max_batch_size
+        self._pending: list[tuple[str, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: set[asyncio.Task] = set()
+
+    @property
+    def ai_model_name(self) -> str:
+        return getattr(self.model, "ai_model_name", type(self.model).__name__)
+
+    @property
+    def dimensionality(self) -> Optional[int]:
+        return getattr(self.model, "dimensionality", None)
+
+    async def get_embedding(self, text: str) -> List[float]:
+        """Embeds text together with texts of concurrent calls."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif len(self._pending) == 1:
+            self._timer = loop.call_later(self.max_wait_seconds, self._flush)
+        return await future
+
+    async def get_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """Embeds texts in one call (they are already a batch)."""
+        return await self.model.get_embeddings(texts)
+
+    def _flush(self) -> None:
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.create_task(self._send(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, batch: list[tuple[str, asyncio.Future]]) -> None:
+        # The same text is embedded once
+        texts = list(dict.fromkeys(text for text, _ in batch))
+        self._log.debug("Embedding %d texts of %d calls", len(texts), len(batch))
+        try:
+            embeddings = dict(zip(texts, await self.model.get_embeddings(texts)))
+        except BaseException as e:
+            # Waiting calls are released also if the batch is cancelled
+            for _, future in batch:
+                if future.done():
+                    continue
+                if isinstance(e, Exception):
+                    future.set_exception(e)
+                else:
+                    future.cancel()
+            if not isinstance(e, Exception):
+                raise
+            return
+        for text, future in batch:
+            if not future.done():
+                future.set_result(embeddings[text])
@@ -1,4 +1,5 @@
-from typing import List
+import asyncio
+from typing import Iterator, List
 
 from vertexai.language_models import TextEmbeddingInput, TextEmbeddingModel
 
@@ -8,6 +9,11 @@ from haintech.ai.base.base_ai_text_embedding_model import BaseAITextEmbeddingMod
 class VertexAITextEmbeddingModel(BaseAITextEmbeddingModel):
     """Text embedding model using Vertex AI's TextEmbeddingModel."""
 
+    MAX_BATCH_SIZE = 250
+    """Max. texts in one request."""
+    MAX_BATCH_CHARACTERS = 60000
+    """Characters of texts in one request (the API limits tokens)."""
+
     def __init__(
         self, ai_model_name: str = "text-multilingual-embedding-002", dimensionality=256
     ):
@@ -17,7 +23,31 @@ class VertexAITextEmbeddingModel(BaseAITextEmbeddingModel):
 
     async def get_embedding(self, text: str) -> List[float]:
         """Embeds texts with a pre-trained, foundational model."""
-        inputs = [TextEmbeddingInput(text, "RETRIEVAL_DOCUMENT")]
+        return (await self.get_embeddings([text]))[0]
+
+    async def get_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """Embeds texts in batches (sent concurrently)."""
+        batches = await asyncio.gather(
+            *[self._get_batch_embeddings(b) for b in self._batches(texts)]
+        )
+        return [embedding for batch in batches for embedding in batch]
+
+    def _batches(self, texts: List[str]) -> Iterator[List[str]]:
+        batch, characters = [], 0
+        for text in texts:
+            if batch and (
+                len(batch) == self.MAX_BATCH_SIZE
+                or characters + len(text) > self.MAX_BATCH_CHARACTERS
+            ):
+                yield batch
+                batch, characters = [], 0
+            batch.append(text)
+            characters += len(text)
+        if batch:
+            yield batch
+
+    async def _get_batch_embeddings(self, texts: List[str]) -> List[List[float]]:
+        inputs = [TextEmbeddingInput(text, "RETRIEVAL_DOCUMENT") for text in texts]
         kwargs = (
             dict(output_dimensionality=self.dimensionality)
             if self.dimensionality
@@ -26,4 +56,4 @@ class VertexAITextEmbeddingModel(BaseAITextEmbeddingModel):
         if not self.model:
             self.model = TextEmbeddingModel.from_pretrained(self.ai_model_name)
         embeddings = await self.model.get_embeddings_async(inputs, **kwargs)
-        return embeddings[0].values
+        return [e.values for e in embeddings]
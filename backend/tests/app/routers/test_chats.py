@@ -1,11 +1,23 @@
+import gzip
 import json
 import logging
+from datetime import datetime
 from fastapi import FastAPI, Response
 from fastapi.testclient import TestClient
 import pytest
 
 from ampf.gcp import GcpFactory
-from app.dependencies import get_server_config, get_user_email
+from app.chat.chat_model import ChatSession
+from app.chat.chat_session_storage import ChatSessionStorage
+from app.chat.message import ChatMessage
+from app.chat.search_index import ChatSearchIndex
+from app.dependencies import (
+    get_ai_text_embedding_model,
+    get_factory,
+    get_search_index_cache,
+    get_server_config,
+    get_user_email,
+)
 from app.routers import chats, chats_message, files
 
 
@@ -109,3 +121,183 @@ def test_send_message_with_file(client, chat_session_id):
     assert 200 == response.status_code
     # And: The response contains right answer
     assert "File content 4" in get_answer(response)
+
+
+@pytest.fixture
+def memory_client(factory, embedding_model, test_config, user_email):
+    """Client of the chats router with sessions kept in memory."""
+    app = FastAPI()
+    app.dependency_overrides[get_factory] = lambda: factory
+    app.dependency_overrides[get_server_config] = lambda: test_config
+    app.dependency_overrides[get_user_email] = lambda: user_email
+    app.dependency_overrides[get_ai_text_embedding_model] = lambda: embedding_model
+    # Search indexes are loaded from the factory of the test
+    app.dependency_overrides[get_search_index_cache] = lambda: None
+    app.include_router(prefix="/api/chats", router=chats.router)
+    return TestClient(app)
+
+
+@pytest.fixture
+def stored_sessions(factory, test_config, user_email) -> ChatSessionStorage:
+    """Three sessions of the user (s0 is the oldest) and one of another user."""
+    storage = ChatSessionStorage(factory, header_index=test_config.chat.header_index)
+    for i, content in enumerate(["Zażółć gęślą jaźń", "Hello world", "Hi there"]):
+        storage.save(
+            ChatSession(
+                chat_session_id=f"s{i}",
+                user=user_email,
+                created=datetime(2025, 1, 1 + i),
+                history=[
+                    ChatMessage(author="user", content=content),
+                    ChatMessage(author="ai", content="OK"),
+                ],
+            )
+        )
+    storage.save(
+        ChatSession(
+            chat_session_id="other",
+            user="other@test.com",
+            history=[ChatMessage(author="user", content="Hello from other")],
+        )
+    )
+    return storage
+
+
+def test_get_chat_sessions_pages(memory_client, stored_sessions):
+    # When: The first page is requested
+    response = memory_client.get("/api/chats", params={"page_size": 2})
+    # Then: The newest sessions of the user are returned
+    assert response.status_code == 200
+    assert [h["chat_session_id"] for h in response.json()] == ["s2", "s1"]
+    # And: The cursor of the next page is in the header
+    cursor = response.headers["X-Next-Cursor"]
+    # When: The next page is requested with the cursor
+    response = memory_client.get(
+        "/api/chats", params={"page_size": 2, "cursor": cursor}
+    )
+    # Then: The rest is returned without the next cursor
+    assert [h["chat_session_id"] for h in response.json()] == ["s0"]
+    assert "X-Next-Cursor" not in response.headers
+
+
+def test_get_chat_sessions_without_page_size(memory_client, stored_sessions):
+    # When: Sessions are requested without the page size
+    response = memory_client.get("/api/chats")
+    # Then: All sessions of the user are returned in one response
+    assert [h["chat_session_id"] for h in response.json()] == ["s2", "s1", "s0"]
+    assert "X-Next-Cursor" not in response.headers
+
+
+def test_get_chat_sessions_after_unknown_cursor(memory_client, stored_sessions):
+    # When: The page after a session which doesn't exist is requested
+    response = memory_client.get(
+        "/api/chats", params={"page_size": 2, "cursor": "unknown"}
+    )
+    # Then: The page is empty
+    assert response.status_code == 200
+    assert response.json() == []
+    assert "X-Next-Cursor" not in response.headers
+
+
+def test_get_chat_sessions_page_size_is_validated(memory_client):
+    # When: Sessions are requested with a page size out of range
+    response = memory_client.get("/api/chats", params={"page_size": 0})
+    # Then: The request is rejected
+    assert response.status_code == 422
+
+
+def test_search_chat_sessions(memory_client, factory, stored_sessions):
+    ChatSearchIndex(factory).rebuild(stored_sessions)
+    # When: The user searches for a word of a message
+    response = memory_client.get("/api/chats/search", params={"q": "hello"})
+    # Then: Only the user's matching session is returned
+    assert response.status_code == 200
+    [result] = response.json()
+    assert result["chat_session_id"] == "s1"
+    assert result["snippet"] == "Hello world"
+    # When: The user searches without diacritics
+    response = memory_client.get("/api/chats/search", params={"q": "GESLA"})
+    # Then: The session is found with the snippet of the original text
+    [result] = response.json()
+    assert result["chat_session_id"] == "s0"
+    assert result["snippet"] == "Zażółć gęślą jaźń"
+
+
+def test_search_limit(memory_client, factory, stored_sessions):
+    ChatSearchIndex(factory).rebuild(stored_sessions)
+    # When: The search is limited to one result
+    response = memory_client.get("/api/chats/search", params={"q": "ok", "limit": 1})
+    # Then: Only the best result is returned
+    assert len(response.json()) == 1
+
+
+def test_search_query_is_required(memory_client):
+    # When: The search query is empty
+    response = memory_client.get("/api/chats/search", params={"q": ""})
+    # Then: The request is rejected
+    assert response.status_code == 422
+
+
+def test_bulk_delete_by_ids(memory_client, stored_sessions, user_email):
+    # When: The user deletes their session, a missing one and another user's one
+    response = memory_client.post(
+        "/api/chats/bulk-delete", json={"ids": ["s0", "missing", "other"]}
+    )
+    # Then: The progress of only the user's existing session is streamed
+    assert response.status_code == 200
+    assert response.json() == [
+        {"deleted": 0, "total": 1},
+        {"deleted": 1, "total": 1},
+    ]
+    # And: Only that session is deleted
+    assert stored_sessions.get("s0") is None
+    assert stored_sessions.get("other") is not None
+    headers, _ = stored_sessions.get_headers(user_email)
+    assert [h.chat_session_id for h in headers] == ["s2", "s1"]
+
+
+def test_bulk_delete_older_than(memory_client, stored_sessions, user_email):
+    # When: The user deletes sessions created before the date
+    response = memory_client.post(
+        "/api/chats/bulk-delete", json={"older_than": "2025-01-03T00:00:00"}
+    )
+    # Then: The user's older sessions are deleted
+    assert response.json()[-1] == {"deleted": 2, "total": 2}
+    headers, _ = stored_sessions.get_headers(user_email)
+    assert [h.chat_session_id for h in headers] == ["s2"]
+    # And: Sessions of other users are kept
+    assert stored_sessions.get("other") is not None
+
+
+def test_bulk_delete_requires_criteria(memory_client):
+    # When: Neither ids nor the date are given
+    response = memory_client.post("/api/chats/bulk-delete", json={})
+    # Then: The request is rejected
+    assert response.status_code == 422
+
+
+def test_export_ndjson(memory_client, stored_sessions):
+    # When: All sessions of the user are exported
+    response = memory_client.get("/api/chats/export")
+    # Then: They are returned as NDJSON, one session with history per line
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert "chats.ndjson" in response.headers["content-disposition"]
+    sessions = [json.loads(line) for line in response.text.splitlines()]
+    assert [s["chat_session_id"] for s in sessions] == ["s2", "s1", "s0"]
+    assert [m["content"] for m in sessions[1]["history"]] == ["Hello world", "OK"]
+
+
+def test_export_selected_gzip(memory_client, stored_sessions):
+    # When: The user's session, a missing one and another user's one
+    # are exported compressed
+    response = memory_client.get(
+        "/api/chats/export",
+        params={"ids": ["s0", "missing", "other"], "compress": True},
+    )
+    # Then: The response is gzip compressed NDJSON
+    assert response.headers["content-type"] == "application/gzip"
+    assert "chats.ndjson.gz" in response.headers["content-disposition"]
+    lines = gzip.decompress(response.content).decode().splitlines()
+    # And: Only the user's existing session is exported
+    assert [json.loads(line)["chat_session_id"] for line in lines] == ["s0"]
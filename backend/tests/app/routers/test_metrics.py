@@ -0,0 +1,47 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+import pytest
+
+from ampf.auth import Tokens
+
+from app.dependencies import get_factory, get_server_config
+from app.metrics import metrics
+from app.routers import auth
+from app.routers import metrics as metrics_router
+from app.user.user_service import UserService
+
+
+@pytest.fixture
+def client(factory, test_config):
+    app = FastAPI()
+    app.dependency_overrides[get_factory] = lambda: factory
+    app.dependency_overrides[get_server_config] = lambda: test_config
+    app.include_router(prefix="/api", router=auth.router)
+    UserService(factory).initialize_storage_with_user(test_config.default_user)
+    app.include_router(prefix="/api/metrics", router=metrics_router.router)
+    yield TestClient(app)
+    metrics.reset()
+
+
+@pytest.fixture
+def access_token(client):
+    response = client.post(
+        "/api/login",
+        data={"username": "test@test.com", "password": "test"},
+    )
+    assert response.status_code == 200
+    return Tokens(**response.json()).access_token
+
+
+def test_get_metrics(client, access_token):
+    # Given: A recorded stage duration
+    metrics.observe("chat_stage_seconds", 0.5, stage="embedding", model="m1")
+    # When: Metrics are requested
+    response = client.get(
+        "/api/metrics", headers={"Authorization": f"Bearer {access_token}"}
+    )
+    # Then: The summary is returned
+    assert response.status_code == 200
+    [summary] = response.json()["chat_stage_seconds"]
+    assert summary["tags"] == {"model": "m1", "stage": "embedding"}
+    assert summary["count"] == 1
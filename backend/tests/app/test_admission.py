@@ -0,0 +1,44 @@
+import asyncio
+
+import pytest
+
+from app.chat.admission import AdmissionController, AdmissionTimeoutError, FairLimiter
+
+
+@pytest.mark.asyncio
+async def test_slots_are_granted_round_robin():
+    limiter = FairLimiter(1)
+    await limiter.acquire("busy")
+    order = []
+
+    async def request(user: str):
+        await limiter.acquire(user)
+        order.append(user)
+        limiter.release()
+
+    # Given: One user queues three requests before another user queues one
+    tasks = [asyncio.create_task(request(u)) for u in ["busy", "busy", "busy", "other"]]
+    await asyncio.sleep(0)
+    # When: The slot is freed
+    limiter.release()
+    await asyncio.gather(*tasks)
+    # Then: The other user doesn't wait for all requests of the busy one
+    assert order == ["busy", "other", "busy", "busy"]
+    assert limiter.active == 0
+
+
+@pytest.mark.asyncio
+async def test_queue_wait_timeout():
+    controller = AdmissionController({"model": 1}, queue_timeout_seconds=0.01)
+
+    async with controller.admit("model", "user1"):
+        with pytest.raises(AdmissionTimeoutError):
+            async with controller.admit("model", "user2"):
+                pass
+        # Other models have their own limits
+        async with controller.admit("other-model", "user2"):
+            pass
+
+    limiter = controller.limiter("model")
+    assert limiter.active == 0
+    assert limiter.waiting_count() == 0
@@ -0,0 +1,26 @@
+import time
+
+from app.cache import TTLCache
+
+
+def test_lru_eviction():
+    evicted = []
+    cache = TTLCache(2, 60, on_evict=lambda k, v: evicted.append(k))
+    cache.put("a", 1)
+    cache.put("b", 2)
+    # When: "a" is used and "c" is added
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    # Then: The least recently used "b" is evicted
+    assert cache.get("b") is None
+    assert evicted == ["b"]
+    assert cache.stats() == {"hits": 1, "misses": 1, "size": 2}
+
+
+def test_ttl():
+    cache = TTLCache(2, 0.01)
+    cache.put("a", 1)
+    time.sleep(0.02)
+
+    assert cache.get("a") is None
+    assert len(cache) == 0
@@ -0,0 +1,35 @@
+import json
+
+from app.chat.chat_codec import chat_session_response, to_messages
+from app.chat.chat_model import ChatSession
+from app.chat.chat_session_storage import ChatMessageRecord
+from app.chat.message import ChatMessage, ChatMessageFile
+
+
+def test_records_round_trip():
+    messages = [
+        ChatMessage(author="user", content="Hello"),
+        ChatMessage(
+            author="ai",
+            content="Hi",
+            files=[ChatMessageFile(name="f.txt", mime_type="text/plain")],
+        ),
+    ]
+
+    records = ChatMessageRecord.from_messages(messages, start=1)
+
+    assert [r.message_id for r in records] == ["000001"]
+    [message] = to_messages(records)
+    assert type(message) is ChatMessage
+    assert message == messages[1]
+
+
+def test_chat_session_response():
+    chat_session = ChatSession(
+        chat_session_id="s1", history=[ChatMessage(author="user", content="Hello")]
+    )
+
+    response = chat_session_response(chat_session)
+
+    assert response.media_type == "application/json"
+    assert json.loads(response.body) == chat_session.model_dump(mode="json")
@@ -1,15 +1,20 @@
+import asyncio
 import datetime
 from io import BytesIO
+from types import SimpleNamespace
 from fastapi import UploadFile
 import pytest
 from app.file.file_service import FileService
 from haintech.ai import AiFactory
 from ampf.gcp import GcpFactory
 from app.agent.agent_model import Agent
-from app.chat.chat_model import ChatSession
+from app.chat.chat_model import ChatDeleteProgress, ChatSession
 from app.chat.chat_service import ChatService
+from app.chat.context_cache import ContextCache, InMemoryCachedContentBackend
+from app.chat.session_write_queue import SessionWriteQueue
 from app.chat.message.message_model import ChatMessage, ChatMessageFile
 from app.config import ServerConfig
+from app.metrics import metrics
 from tests.conftest import MockAITextEmbeddingModel
 
 ai_model_name = "gemini-1.5-flash"
@@ -150,3 +155,236 @@ async def test_get_answer_async_with_file(
     assert len(read_session.history) == 2
     # Then: File is specified
     assert "test1.txt" in read_session.history[0].files[0].name
+
+
+@pytest.mark.asyncio
+async def test_delete_chats(chat_service: ChatService, user_email: str):
+    # Given: An old and a new chat session of the user
+    old_session, new_session = (
+        ChatSession(
+            user=user_email,
+            created=created,
+            history=[ChatMessage(author="user", content="Hello")],
+        )
+        for created in (datetime.datetime(2000, 1, 1), datetime.datetime.now())
+    )
+    chat_service.storage.save(old_session)
+    chat_service.storage.save(new_session)
+    ids = [old_session.chat_session_id, new_session.chat_session_id]
+    # When: Sessions older than a date are deleted
+    progress = [
+        p
+        async for p in chat_service.delete_chats(
+            user_email, ids, older_than=datetime.datetime(2001, 1, 1)
+        )
+    ]
+    # Then: Only the old one is deleted
+    assert progress[-1] == ChatDeleteProgress(deleted=1, total=1)
+    assert not chat_service.get(old_session.chat_session_id, user_email)
+    assert chat_service.get(new_session.chat_session_id, user_email)
+
+    await chat_service.delete_chat(new_session.chat_session_id, user_email)
+
+
+@pytest.mark.asyncio
+async def test_get_answer_async_cancelled(chat_service: ChatService, user_email: str):
+    upstream_closed = False
+    first_chunk_sent = asyncio.Event()
+
+    async def generate(*args):
+        nonlocal upstream_closed
+        try:
+            yield "Partial "
+            first_chunk_sent.set()
+            await asyncio.sleep(10)
+            yield "answer"
+        finally:
+            upstream_closed = True
+
+    # Given: The model streams one chunk and waits for the next one
+    chat_service._generate = generate
+    metrics.reset()
+    session = ChatSession(user=user_email)
+    events = []
+
+    async def read_answer():
+        async for event in chat_service.get_answer_async(
+            ChatMessage(author="user", content="Hello"),
+            [],
+            ai_model_name=ai_model_name,
+            chat_session=session,
+        ):
+            events.append(event)
+
+    task = asyncio.create_task(read_answer())
+    await first_chunk_sent.wait()
+    # When: The stream is cancelled (the client disconnected)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    # Then: The model stream is stopped
+    assert [e.value for e in events] == ["Partial "]
+    assert upstream_closed
+    # And: The partial answer is saved as interrupted
+    saved = chat_service.get(session.chat_session_id, user_email)
+    assert [(m.content, m.interrupted) for m in saved.history] == [
+        ("Hello", False),
+        ("Partial ", True),
+    ]
+    # And: The cancellation is counted and the stream isn't active
+    cancelled = metrics.counters["chat_streams_cancelled_total"]
+    assert cancelled[(("model", ai_model_name),)] == 1
+    assert metrics.gauges["chat_streams_active"][()] == 0
+
+    await chat_service.delete_chat(session.chat_session_id, user_email)
+
+
+@pytest.mark.asyncio
+async def test_get_answer_async_cancelled_before_first_chunk(
+    chat_service: ChatService, user_email: str
+):
+    generation_started = asyncio.Event()
+
+    async def generate(*args):
+        generation_started.set()
+        await asyncio.sleep(10)
+        yield "answer"
+
+    # Given: The model doesn't stream anything yet
+    chat_service._generate = generate
+    session = ChatSession(user=user_email)
+
+    async def read_answer():
+        async for _ in chat_service.get_answer_async(
+            ChatMessage(author="user", content="Hello"),
+            [],
+            ai_model_name=ai_model_name,
+            chat_session=session,
+        ):
+            pass
+
+    task = asyncio.create_task(read_answer())
+    await generation_started.wait()
+    # When: The stream is cancelled
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    # Then: No empty answer is saved
+    saved = chat_service.get(session.chat_session_id, user_email)
+    assert [(m.author, m.content) for m in saved.history] == [("user", "Hello")]
+
+    await chat_service.delete_chat(session.chat_session_id, user_email)
+
+
+class Chunk:
+    def __init__(self, text: str, tokens: int = None):
+        self.text = text
+        self.usage_metadata = (
+            SimpleNamespace(candidates_token_count=tokens) if tokens else None
+        )
+
+
+class FakeAIAgent:
+    """Model stand-in recording how it was created and what was sent."""
+
+    created: list["FakeAIAgent"] = []
+
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.sent = []
+        FakeAIAgent.created.append(self)
+
+    def start_chat(self, history):
+        return self
+
+    async def send_message_streaming_async(self, content):
+        self.sent.append(content)
+        yield Chunk("Hello")
+        yield Chunk(" world", tokens=42)
+
+
+@pytest.fixture
+def fake_ai_agent(monkeypatch: pytest.MonkeyPatch):
+    FakeAIAgent.created = []
+    monkeypatch.setattr("app.chat.chat_service.AIAgent", FakeAIAgent)
+    return FakeAIAgent
+
+
+@pytest.mark.asyncio
+async def test_output_tokens_from_usage_metadata(
+    chat_service: ChatService, fake_ai_agent
+):
+    # Given: The model reports the token count in the last chunk
+    metrics.reset()
+    agent = Agent(name="My private agent", ai_model_name=ai_model_name)
+    # When: The answer is streamed
+    chunks = [
+        c
+        async for c in chat_service._stream_model(
+            ai_model_name, agent, "", "", [], {"parts": []}
+        )
+    ]
+    # Then: The output rate is computed from the reported tokens
+    assert chunks == ["Hello", " world"]
+    rates = metrics.summaries["chat_output_tokens_per_second"]
+    # And: The agent not configured for metrics isn't a tag value
+    rate = rates[(("agent", "other"), ("model", ai_model_name))]
+    assert rate.count == 1 and rate.sum > 42
+
+
+@pytest.mark.asyncio
+async def test_instruction_is_cached_without_turn_context(
+    chat_service: ChatService, fake_ai_agent
+):
+    backend = InMemoryCachedContentBackend()
+    chat_service.context_cache = ContextCache(backend, min_tokens=10)
+    agent = Agent(name="agent", ai_model_name=ai_model_name)
+    instruction = "Long system prompt. " * 10
+    # When: Two turns with different knowledge base hits are sent
+    for knowledge in ["# Hit 1", "# Hit 2"]:
+        content = {"role": "user", "parts": ["Question"]}
+        async for _ in chat_service._stream_model(
+            ai_model_name, agent, instruction, knowledge, [], content
+        ):
+            pass
+    # Then: Cached content of the instruction is created once and reused
+    assert list(backend.contents.values()) == [(ai_model_name, instruction)]
+    first, second = fake_ai_agent.created
+    assert first.kwargs["cached_content"] == second.kwargs["cached_content"]
+    assert second.kwargs["system_instruction"] is None
+    # And: The knowledge of each turn is sent with the message
+    assert first.sent[0]["parts"] == ["# Hit 1", "Question"]
+    assert second.sent[0]["parts"] == ["# Hit 2", "Question"]
+
+
+@pytest.mark.asyncio
+async def test_queued_save_is_timed_as_enqueue(
+    chat_service: ChatService, user_email: str
+):
+    # Given: Sessions are persisted by the write queue
+    chat_service.session_write_queue = SessionWriteQueue()
+    metrics.reset()
+    session = ChatSession(
+        user=user_email,
+        summary="Greeting",
+        history=[ChatMessage(author="user", content="Hello")],
+    )
+    # When: The answer is saved
+    chat_service._save_answer(session, "Hi", tags={"model": ai_model_name})
+    await chat_service.session_write_queue.flush()
+    # Then: Only the enqueue is timed as a stage of the request
+    stages = {dict(t)["stage"] for t in metrics.summaries["chat_stage_seconds"]}
+    assert stages == {"enqueue"}
+
+    await chat_service.delete_chat(session.chat_session_id, user_email)
+
+
+def test_metric_tags_of_configured_agents(chat_service: ChatService):
+    chat_service.metrics_agents = {"support"}
+
+    def agent_tag(name: str) -> str:
+        return chat_service.metric_tags(Agent(name=name), ai_model_name)["agent"]
+
+    assert agent_tag("support") == "support"
+    assert agent_tag("My private agent") == "other"
+    assert chat_service.metric_tags(None, ai_model_name)["agent"] is None
@@ -0,0 +1,216 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.chat.chat_model import ChatSession, ChatSessionHeader
+from app.chat.chat_session_storage import ChatSessionStorage
+from app.chat.message import ChatMessage
+
+
+@pytest.fixture
+def storage(factory):
+    return ChatSessionStorage(factory)
+
+
+@pytest.fixture
+def chat_session():
+    return ChatSession(
+        chat_session_id="s1",
+        user="test@test.com",
+        history=[
+            ChatMessage(author="user", content="Hello"),
+            ChatMessage(author="ai", content="Hi"),
+        ],
+    )
+
+
+def test_save_and_get(storage: ChatSessionStorage, chat_session: ChatSession):
+    # When: Chat session is saved
+    storage.save(chat_session)
+    # Then: Header document doesn't contain history
+    header = storage.sessions.get("s1")
+    assert header.history == []
+    assert header.message_count == 2
+    # And: Chat session is read with history
+    read_session = storage.get("s1")
+    assert [m.content for m in read_session.history] == ["Hello", "Hi"]
+
+
+def test_save_appends_only_new_messages(
+    storage: ChatSessionStorage, chat_session: ChatSession
+):
+    # Given: Saved chat session
+    storage.save(chat_session)
+    # And: Persisted message is changed behind the session's back
+    messages = storage._create_messages_storage("s1")
+    messages.put("000000", messages.get("000000").model_copy(update={"content": "X"}))
+    # When: Next turn is saved
+    chat_session.history.append(ChatMessage(author="user", content="How are you?"))
+    chat_session.history.append(ChatMessage(author="ai", content="Fine"))
+    storage.save(chat_session)
+    # Then: Only new messages are written
+    read_session = storage.get("s1")
+    assert [m.content for m in read_session.history] == ["X", "Hi", "How are you?", "Fine"]  # fmt: skip
+    assert read_session.message_count == 4
+
+
+def test_put_rewrites_history(storage: ChatSessionStorage, chat_session: ChatSession):
+    # Given: Saved chat session
+    storage.save(chat_session)
+    # When: History is edited and put
+    chat_session.history = [ChatMessage(author="user", content="Edited")]
+    storage.put(chat_session)
+    # Then: Old messages are replaced
+    read_session = storage.get("s1")
+    assert [m.content for m in read_session.history] == ["Edited"]
+    assert len(list(storage._create_messages_storage("s1").get_all())) == 1
+
+
+def test_get_legacy_session(storage: ChatSessionStorage, chat_session: ChatSession):
+    # Given: Chat session saved with the whole history in one document
+    storage.sessions.save(chat_session)
+    # When: Chat session is read
+    read_session = storage.get("s1")
+    # Then: History is read from the document
+    assert len(read_session.history) == 2
+    # When: Chat session is saved again
+    storage.save(read_session)
+    # Then: Session is migrated to the messages subcollection
+    assert storage.sessions.get("s1").history == []
+    assert len(storage.get("s1").history) == 2
+
+
+def test_delete(storage: ChatSessionStorage, chat_session: ChatSession):
+    # Given: Saved chat session
+    storage.save(chat_session)
+    # When: Chat session is deleted
+    storage.delete("s1")
+    # Then: Messages are deleted too
+    assert list(storage._create_messages_storage("s1").get_all()) == []
+
+
+def test_delete_many(factory, chat_session: ChatSession):
+    storage = ChatSessionStorage(factory, header_index=True)
+    # Given: Saved chat sessions
+    storage.save(chat_session)
+    storage.save(chat_session.model_copy(update={"chat_session_id": "s2"}))
+    # When: They are deleted at once
+    storage.delete_many(["s1", "s2"], "test@test.com")
+    # Then: Sessions, their messages and headers are deleted
+    assert storage.get_headers("test@test.com") == ([], None)
+    assert list(storage.get_all()) == []
+    assert list(storage._create_messages_storage("s2").get_all()) == []
+
+
+def test_delete_keeps_header_index_consistent(factory, chat_session: ChatSession):
+    storage = ChatSessionStorage(factory, header_index=True)
+    # Given: Two saved chat sessions
+    storage.save(chat_session.model_copy(update={"chat_session_id": "s2"}))
+    storage.save(chat_session)
+    # When: One of them is deleted without giving its user
+    storage.delete("s1")
+    # Then: It is gone from both the sessions and the user's header index
+    assert storage.sessions.get("s1") is None
+    assert [h.chat_session_id for h in storage.get_headers("test@test.com")[0]] == ["s2"]  # fmt: skip
+    assert list(storage._create_messages_storage("s1").get_all()) == []
+    # And: The other session is intact
+    assert len(storage.get("s2").history) == 2
+    # And: Deleting it again is a no-op
+    storage.delete("s1", "test@test.com")
+    assert storage.rebuild_header_index("test@test.com") == 1
+
+
+def test_archive_and_restore(storage: ChatSessionStorage, chat_session: ChatSession):
+    # Given: Saved chat session
+    storage.save(chat_session)
+    # When: Sessions not updated until tomorrow are archived
+    assert storage.archive_older_than(datetime.now() + timedelta(days=1)) == 1
+    # Then: Only a stub without messages stays in the storage
+    stub = storage.sessions.get("s1")
+    assert stub.archived and stub.message_count == 2
+    assert list(storage._create_messages_storage("s1").get_all()) == []
+    assert storage.get_headers("test@test.com")[0][0].message_count == 2
+    # And: The session can be read without restoring it
+    assert len(storage.get("s1", restore=False).history) == 2
+    assert storage.sessions.get("s1").archived
+    # When: The session is read
+    read_session = storage.get("s1")
+    # Then: Its history is restored
+    assert [m.content for m in read_session.history] == ["Hello", "Hi"]
+    assert not storage.sessions.get("s1").archived
+    assert len(list(storage._create_messages_storage("s1").get_all())) == 2
+    # And: Recently restored sessions aren't archived again
+    assert storage.archive_older_than(datetime.now() - timedelta(days=1)) == 0
+
+
+def test_session_saved_while_archived_is_kept(
+    storage: ChatSessionStorage, chat_session: ChatSession
+):
+    storage.save(chat_session)
+    # Given: A turn is saved while the history is being archived
+    archive_save = storage.archive.save
+
+    def save_turn_while_archived(archived: ChatSession) -> int:
+        size = archive_save(archived)
+        chat_session.history.append(ChatMessage(author="user", content="Again"))
+        chat_session.history.append(ChatMessage(author="ai", content="Hi again"))
+        storage.save(chat_session)
+        return size
+
+    storage.archive.save = save_turn_while_archived
+    # When: The session is archived
+    archived = storage.archive_older_than(datetime.now() + timedelta(days=1))
+    # Then: It isn't archived and no message is lost
+    assert archived == 0
+    assert not storage.sessions.get("s1").archived
+    assert [m.content for m in storage.get("s1").history] == ["Hello", "Hi", "Again", "Hi again"]  # fmt: skip
+
+
+def test_get_headers_pages(storage: ChatSessionStorage):
+    # Given: Three sessions of the user and one of another user
+    for i in range(3):
+        storage.save(
+            ChatSession(
+                chat_session_id=f"s{i}",
+                user="test@test.com",
+                created=datetime(2025, 1, 1 + i),
+                history=[ChatMessage(author="user", content="x" * 1000)],
+            )
+        )
+    storage.save(ChatSession(chat_session_id="other", user="other@test.com"))
+    # When: The first page is read
+    headers, cursor = storage.get_headers("test@test.com", limit=2)
+    # Then: The newest sessions of the user are returned
+    assert [h.chat_session_id for h in headers] == ["s2", "s1"]
+    assert type(headers[0]) is ChatSessionHeader
+    # And: The next page is read with the cursor
+    headers, cursor = storage.get_headers("test@test.com", limit=2, cursor=cursor)
+    assert [h.chat_session_id for h in headers] == ["s0"]
+    assert cursor is None
+
+
+def test_header_index_is_maintained(factory, chat_session: ChatSession):
+    storage = ChatSessionStorage(factory, header_index=True)
+    # When: Chat session is saved
+    storage.save(chat_session)
+    # Then: Its header is in the user's index
+    [header] = storage._create_headers_storage("test@test.com").get_all()
+    assert header.message_count == 2
+    assert header.updated is not None
+    assert [h.chat_session_id for h in storage.get_headers("test@test.com")[0]] == ["s1"]  # fmt: skip
+    # When: Chat session is deleted
+    storage.delete("s1", "test@test.com")
+    # Then: Its header is removed
+    assert storage.get_headers("test@test.com") == ([], None)
+
+
+def test_rebuild_header_index(factory, chat_session: ChatSession):
+    storage = ChatSessionStorage(factory, header_index=True)
+    # Given: Chat session saved before the index existed
+    storage.sessions.save(chat_session)
+    assert storage.get_headers("test@test.com") == ([], None)
+    # When: The index is rebuilt
+    count = storage.rebuild_header_index()
+    # Then: The session is listed
+    assert count == 1
+    assert [h.chat_session_id for h in storage.get_headers("test@test.com")[0]] == ["s1"]  # fmt: skip
@@ -0,0 +1,44 @@
+import pytest
+
+from app.background_tasks import wait_for_background_tasks
+from app.chat.context_cache import ContextCache, InMemoryCachedContentBackend
+
+
+@pytest.fixture
+def backend():
+    return InMemoryCachedContentBackend()
+
+
+@pytest.fixture
+def context_cache(backend):
+    return ContextCache(backend, ttl_seconds=3600, max_entries=1, min_tokens=10)
+
+
+@pytest.mark.asyncio
+async def test_short_context_is_not_cached(context_cache, backend):
+    assert await context_cache.get("agent", "model", "short") is None
+    assert backend.contents == {}
+
+
+@pytest.mark.asyncio
+async def test_handle_is_reused(context_cache, backend):
+    context = "Long system prompt. " * 10
+    # When: The same context is used twice
+    h1 = await context_cache.get("agent", "model", context)
+    h2 = await context_cache.get("agent", "model", context)
+    # Then: Cached content is created once
+    assert h1 == h2
+    assert backend.contents[h1] == ("model", context)
+    # When: Other model is used
+    h3 = await context_cache.get("agent", "other-model", context)
+    # Then: New cached content is created
+    assert h3 != h1
+
+
+@pytest.mark.asyncio
+async def test_evicted_handle_is_deleted(context_cache, backend):
+    h1 = await context_cache.get("agent", "model", "First context. " * 10)
+    await context_cache.get("agent", "model", "Second context. " * 10)
+    await wait_for_background_tasks()
+    assert h1 not in backend.contents
+    assert len(backend.contents) == 1
@@ -0,0 +1,92 @@
+import pytest
+
+from app.chat.file_stager import ChatFileStager, GcsBlobCopier, StorageBlobCopier
+from app.chat.message import ChatMessage, ChatMessageFile
+
+
+class FakeBlob:
+    def __init__(self, bucket: "FakeBucket", name: str):
+        self.bucket = bucket
+        self.name = name
+
+    def download_as_bytes(self) -> bytes:
+        return self.bucket.blobs[self.name]
+
+    def upload_from_string(self, data: bytes, content_type: str) -> None:
+        self.bucket.blobs[self.name] = data
+
+
+class FakeBucket:
+    """In-memory stand-in of `google.cloud.storage.Bucket`."""
+
+    def __init__(self):
+        self.blobs: dict[str, bytes] = {}
+
+    def blob(self, name: str) -> FakeBlob:
+        return FakeBlob(self, name)
+
+
+class FakeClient:
+    def __init__(self):
+        self.fake_bucket = FakeBucket()
+
+    def bucket(self, name: str) -> FakeBucket:
+        return self.fake_bucket
+
+
+@pytest.fixture
+def session_files_storage(factory, user_email):
+    return factory.create_blob_storage(f"users/{user_email}/session_files")
+
+
+@pytest.fixture
+def stager(factory, user_email):
+    return ChatFileStager(StorageBlobCopier(factory), user_email)
+
+
+@pytest.mark.asyncio
+async def test_stage(factory, session_files_storage, stager, user_email):
+    # Given: Two uploaded session files
+    session_files_storage.upload_blob("a.txt", b"A", content_type="text/plain")
+    session_files_storage.upload_blob("b.txt", b"B", content_type="text/plain")
+    files = [
+        ChatMessageFile(name="a.txt", mime_type="text/plain"),
+        ChatMessageFile(name="b.txt", mime_type="text/plain"),
+    ]
+    # When: Files are staged
+    parts = await stager.stage("chat1", files)
+    # Then: Files are copied to the chat directory
+    chat_files = factory.create_blob_storage(f"users/{user_email}/chats/chat1/files")
+    assert chat_files.download_blob("a.txt") == b"A"
+    assert chat_files.download_blob("b.txt") == b"B"
+    # And: Parts are returned in the files order (inline without URI)
+    assert [p["data"] for p in parts] == [b"A", b"B"]
+    assert files[0].url is None
+
+
+@pytest.mark.asyncio
+async def test_stage_in_bucket(user_email):
+    client = FakeClient()
+    client.fake_bucket.blobs[f"users/{user_email}/session_files/a.txt"] = b"A"
+    stager = ChatFileStager(GcsBlobCopier("bucket", client), user_email)
+    files = [ChatMessageFile(name="a.txt", mime_type="text/plain")]
+    # When: The file is staged
+    parts = await stager.stage("chat1", files)
+    # Then: It is copied to the chat directory
+    assert (
+        client.fake_bucket.blobs[f"users/{user_email}/chats/chat1/files/a.txt"] == b"A"
+    )
+    # And: It is sent inline, the model can't read the bucket
+    assert parts == [{"mime_type": "text/plain", "data": b"A"}]
+    assert files[0].url is None
+
+
+def test_to_content_skips_bucket_uris():
+    # Given: A message saved with a gs:// URI (it can't be read by the model)
+    message = ChatMessage(
+        author="user",
+        content="Hello",
+        files=[ChatMessageFile(name="a.txt", mime_type="text/plain", url="gs://b/a")],
+    )
+    # Then: The URI isn't sent in the history
+    assert message.to_content()["parts"] == ["Hello"]
@@ -0,0 +1,106 @@
+import pytest
+
+from ai_agents import AIAgent
+from app.chat.chat_model import ChatSession
+from app.chat.history_manager import ChatHistoryManager
+from app.chat.message import ChatMessage
+
+
+class SummaryAgentStub(AIAgent):
+    """Local stand-in for the summary model."""
+
+    def __init__(self):
+        super().__init__(ai_model_name="stub")
+        self.prompts = []
+
+    def run(self, prompt: str) -> str:
+        self.prompts.append(prompt)
+        return f"summary {len(self.prompts)}"
+
+
+@pytest.fixture
+def summary_agent():
+    return SummaryAgentStub()
+
+
+@pytest.fixture
+def manager(summary_agent):
+    # Every message below takes 10 tokens
+    return ChatHistoryManager(token_budget=25, summary_agent=summary_agent)
+
+
+def create_chat_session(messages_count: int) -> ChatSession:
+    return ChatSession(
+        history=[
+            ChatMessage(author="user" if i % 2 == 0 else "ai", content="x" * 40)
+            for i in range(messages_count)
+        ]
+    )
+
+
+def test_short_history_is_sent_whole(manager: ChatHistoryManager):
+    chat_session = create_chat_session(2)
+
+    summary, window = manager.get_window(chat_session)
+
+    assert summary == ""
+    assert window == chat_session.history
+    assert not manager.needs_summary(chat_session)
+
+
+def test_window_starts_with_user_message(manager: ChatHistoryManager):
+    # Given: Six messages, only two (from four) fit in the budget
+    chat_session = create_chat_session(6)
+    chat_session.history_summary = "old summary"
+    chat_session.summarized_count = 4
+    # When: Window is calculated
+    summary, window = manager.get_window(chat_session)
+    # Then: The newest turn is sent with the summary
+    assert summary == "old summary"
+    assert window == chat_session.history[4:]
+    assert window[0].author == "user"
+
+
+def test_messages_not_summarized_yet_are_sent(manager: ChatHistoryManager):
+    # Given: Only two messages out of the window are summarized
+    chat_session = create_chat_session(8)
+    chat_session.history_summary = "old summary"
+    chat_session.summarized_count = 2
+    # When: Window is calculated before the summary catches up
+    summary, window = manager.get_window(chat_session)
+    # Then: Messages after the summary are sent although over the budget
+    assert summary == "old summary"
+    assert window == chat_session.history[2:]
+
+
+def test_history_without_summary_is_sent_whole(manager: ChatHistoryManager):
+    chat_session = create_chat_session(8)
+
+    summary, window = manager.get_window(chat_session)
+
+    assert summary == ""
+    assert window == chat_session.history
+    assert manager.needs_summary(chat_session)
+
+
+@pytest.mark.asyncio
+async def test_summarize(manager: ChatHistoryManager, summary_agent):
+    # Given: Messages which are out of the window
+    chat_session = create_chat_session(6)
+    assert manager.needs_summary(chat_session)
+    # When: History is summarized
+    await manager.summarize(chat_session)
+    # Then: Omitted messages are folded into the summary in chunks fitting
+    # into the budget (two messages each)
+    assert chat_session.history_summary == "summary 2"
+    assert chat_session.summarized_count == 4
+    assert [p.count("x" * 40) for p in summary_agent.prompts] == [2, 2]
+    assert "summary 1" in summary_agent.prompts[1]
+    assert not manager.needs_summary(chat_session)
+    # When: Next turn moves the window
+    chat_session.history.append(ChatMessage(author="user", content="x" * 40))
+    chat_session.history.append(ChatMessage(author="ai", content="x" * 40))
+    await manager.summarize(chat_session)
+    # Then: The summary is updated with the previous one
+    assert "summary 2" in summary_agent.prompts[2]
+    assert chat_session.summarized_count == 6
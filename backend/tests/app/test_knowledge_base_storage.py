@@ -1,4 +1,5 @@
 import pytest
+from app.cache import TTLCache
 from app.knowledge_base.knowledge_base_model import KnowledgeBaseItem
 from app.knowledge_base.knowledge_base_storage import KnowledgeBaseStorage
 
@@ -18,6 +19,45 @@ async def test_before_save(kb):
     assert "embedding" in item
 
 
+@pytest.mark.asyncio
+async def test_items_are_embedded_together(embedding_model):
+    calls = []
+
+    async def get_embeddings(texts: list[str]):
+        calls.append(texts)
+        return [[float(len(t))] * 256 for t in texts]
+
+    embedding_model.get_embeddings = get_embeddings
+    kb = KnowledgeBaseStorage(embedding_model)
+    items = [{"title": "a", "content": "a"}, {"title": "bb", "content": "bb"}]
+    # When: Many items are prepared to be saved
+    items = await kb.on_before_save_many(items)
+    # Then: They are embedded by one call
+    assert calls == [["a", "bb"]]
+    assert [list(i["embedding"])[0] for i in items] == [1.0, 2.0]
+
+
+@pytest.mark.asyncio
+async def test_query_embedding_cache(embedding_model):
+    calls = []
+
+    async def get_embedding(text: str):
+        calls.append(text)
+        return [0.1] * 256
+
+    embedding_model.get_embedding = get_embedding
+    kb = KnowledgeBaseStorage(
+        embedding_model, embedding_cache=TTLCache(max_entries=10, ttl_seconds=60)
+    )
+    # When: The same text is embedded twice
+    first = await kb.get_query_embedding("text")
+    second = await kb.get_query_embedding("text")
+    # Then: The model is called once
+    assert first == second == [0.1] * 256
+    assert calls == ["text"]
+    assert kb.embedding_cache.stats() == {"hits": 1, "misses": 1, "size": 1}
+
+
 @pytest.mark.asyncio
 async def test_find_nearest(kb):
     ret = await kb.find_nearest("text", ["pytest"])
@@ -0,0 +1,29 @@
+import pytest
+
+from app.metrics import Metrics
+
+
+def test_summary_percentiles():
+    metrics = Metrics()
+    for i in range(1, 101):
+        metrics.observe("latency", i / 100, stage="embedding")
+
+    [ret] = metrics.snapshot()["latency"]
+
+    assert ret["tags"] == {"stage": "embedding"}
+    assert ret["count"] == 100
+    assert ret["max"] == 1.0
+    assert ret["p50"] == pytest.approx(0.51)
+    assert ret["p90"] == pytest.approx(0.91)
+
+
+def test_timer_observes_failed_block():
+    metrics = Metrics()
+
+    with pytest.raises(ValueError):
+        with metrics.timer("latency", model="m1", agent=None):
+            raise ValueError()
+
+    [ret] = metrics.snapshot()["latency"]
+    assert ret["tags"] == {"model": "m1"}
+    assert ret["count"] == 1
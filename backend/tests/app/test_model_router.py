@@ -0,0 +1,106 @@
+import asyncio
+import contextlib
+
+import pytest
+from google.api_core import exceptions
+
+from app.chat.model_router import ModelRouter
+
+
+def generator(behaviour: dict[str, str]):
+    """Model stand-in: "ok", "throttled", "slow" or "timeout"."""
+    calls = []
+
+    async def generate(model: str):
+        calls.append(model)
+        if behaviour[model] == "throttled":
+            raise exceptions.ResourceExhausted("Quota exceeded")
+        if behaviour[model] == "slow":
+            await asyncio.sleep(1)
+        if behaviour[model] == "timeout":
+            raise TimeoutError("Deadline exceeded")
+        yield f"{model}:1"
+        yield f"{model}:2"
+
+    return generate, calls
+
+
+async def collect(stream) -> list[str]:
+    return [c async for c in stream]
+
+
+@pytest.fixture
+def router():
+    return ModelRouter(
+        fallbacks={"primary": ["secondary"]}, first_token_timeout_seconds=0.05
+    )
+
+
+@pytest.mark.asyncio
+async def test_throttled_model_falls_over(router: ModelRouter):
+    generate, calls = generator({"primary": "throttled", "secondary": "ok"})
+    # When: Primary model returns 429
+    ret = await collect(router.stream("primary", generate))
+    # Then: Secondary model answers
+    assert ret == ["secondary:1", "secondary:2"]
+    # And: Primary is skipped while it cools down
+    assert not router.is_healthy("primary")
+    assert router.candidates("primary") == ["secondary", "primary"]
+
+
+@pytest.mark.asyncio
+async def test_slow_first_token_falls_over(router: ModelRouter):
+    generate, calls = generator({"primary": "slow", "secondary": "ok"})
+
+    ret = await collect(router.stream("primary", generate))
+
+    assert ret == ["secondary:1", "secondary:2"]
+    assert calls == ["primary", "secondary"]
+
+
+@pytest.mark.asyncio
+async def test_without_fallback(router: ModelRouter):
+    generate, calls = generator({"primary": "throttled", "secondary": "ok"})
+
+    with pytest.raises(exceptions.ResourceExhausted):
+        await collect(router.stream("primary", generate, fallback=False))
+    assert calls == ["primary"]
+
+
+def test_slo_breach_makes_model_unhealthy(router: ModelRouter):
+    for _ in range(ModelRouter.MIN_SAMPLES):
+        router.record_ttft("primary", 10.0)
+        router.record_result("primary")
+
+    assert not router.is_healthy("primary")
+    assert router.candidates("primary") == ["secondary", "primary"]
+
+
+@pytest.mark.asyncio
+async def test_admission_wait_is_not_time_to_first_token(router: ModelRouter):
+    generate, calls = generator({"primary": "ok", "secondary": "ok"})
+
+    @contextlib.asynccontextmanager
+    async def admit(model: str):
+        # Longer than the first token timeout
+        await asyncio.sleep(0.1)
+        yield
+
+    # When: The call waits in the admission queue
+    ret = await collect(router.stream("primary", generate, admit=admit))
+    # Then: The primary model answers without falling over
+    assert ret == ["primary:1", "primary:2"]
+    assert calls == ["primary"]
+    # And: The wait isn't recorded as its time-to-first-token
+    assert router._stats("primary").ttfts[0] < 0.05
+
+
+@pytest.mark.asyncio
+async def test_timeout_of_last_model_is_raised(router: ModelRouter):
+    generate, calls = generator({"primary": "timeout", "secondary": "timeout"})
+
+    with pytest.raises(TimeoutError, match="Deadline exceeded"):
+        await collect(router.stream("primary", generate, fallback=False))
+    with pytest.raises(TimeoutError, match="Deadline exceeded"):
+        await collect(router.stream("primary", generate))
+    assert calls == ["primary", "primary", "secondary"]
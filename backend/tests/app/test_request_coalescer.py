@@ -0,0 +1,75 @@
+import asyncio
+
+import pytest
+
+from app.chat.request_coalescer import RequestCoalescer
+
+
+class Upstream:
+    """Upstream stream releasing chunks on demand."""
+
+    def __init__(self, chunks: list[str]):
+        self.chunks = chunks
+        self.calls = 0
+        self.release = asyncio.Semaphore(0)
+        self.cancelled = False
+
+    async def stream(self):
+        self.calls += 1
+        try:
+            for chunk in self.chunks:
+                await self.release.acquire()
+                yield chunk
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+
+
+async def collect(stream) -> list[str]:
+    return [c async for c in stream]
+
+
+@pytest.mark.asyncio
+async def test_identical_requests_share_upstream():
+    coalescer = RequestCoalescer()
+    upstream = Upstream(["a", "b", "c"])
+    # Given: First request in flight with one chunk received
+    first = asyncio.create_task(collect(coalescer.stream("key", upstream.stream)))
+    upstream.release.release()
+    await asyncio.sleep(0.01)
+    # When: Identical request arrives
+    second = asyncio.create_task(collect(coalescer.stream("key", upstream.stream)))
+    await asyncio.sleep(0.01)
+    upstream.release.release()
+    upstream.release.release()
+    # Then: Both get all chunks from one upstream call
+    assert await first == ["a", "b", "c"]
+    assert await second == ["a", "b", "c"]
+    assert upstream.calls == 1
+    assert coalescer.in_flight_count() == 0
+
+
+@pytest.mark.asyncio
+async def test_upstream_is_cancelled_without_subscribers():
+    coalescer = RequestCoalescer()
+    upstream = Upstream(["a", "b"])
+    task = asyncio.create_task(collect(coalescer.stream("key", upstream.stream)))
+    await asyncio.sleep(0.01)
+
+    task.cancel()
+    await asyncio.sleep(0.01)
+
+    assert upstream.cancelled
+    assert coalescer.in_flight_count() == 0
+
+
+@pytest.mark.asyncio
+async def test_error_is_passed_to_subscribers():
+    coalescer = RequestCoalescer()
+
+    async def failing():
+        yield "a"
+        raise ValueError("quota")
+
+    with pytest.raises(ValueError):
+        await collect(coalescer.stream("key", failing))
@@ -0,0 +1,81 @@
+from typing import List
+
+import pytest
+
+from app.agent.agent_model import Agent
+from app.chat.response_cache import ResponseCache
+from haintech.ai.base.base_ai_text_embedding_model import BaseAITextEmbeddingModel
+
+
+class WordsEmbeddingModel(BaseAITextEmbeddingModel):
+    """Embeds text as counts of a few words."""
+
+    WORDS = ["capital", "france", "poland", "weather"]
+
+    def __init__(self):
+        self.texts = []
+
+    async def get_embedding(self, text: str) -> List[float]:
+        self.texts.append(text)
+        return [float(text.count(w)) for w in self.WORDS]
+
+
+@pytest.fixture
+def agent():
+    return Agent(name="faq", ai_model_name="model", system_prompt="FAQ")
+
+
+@pytest.mark.asyncio
+async def test_normalized_prompt_hit(agent: Agent):
+    cache = ResponseCache()
+    await cache.put(agent, "model", "What is the capital of France?", "Paris")
+
+    assert await cache.get(agent, "model", "  what is the capital   of France") == "Paris"  # fmt: skip
+    assert await cache.get(agent, "other-model", "What is the capital of France?") is None  # fmt: skip
+
+
+@pytest.mark.asyncio
+async def test_other_agent_definition_misses(agent: Agent):
+    cache = ResponseCache()
+    await cache.put(agent, "model", "Hello", "Hi")
+    other = agent.model_copy(update={"system_prompt": "Other"})
+
+    assert await cache.get(other, "model", "Hello") is None
+
+
+@pytest.mark.asyncio
+async def test_similarity_hit(agent: Agent):
+    cache = ResponseCache(
+        similarity_threshold=0.9, embedding_model=WordsEmbeddingModel()
+    )
+    await cache.put(agent, "model", "Capital of France?", "Paris")
+
+    assert await cache.get(agent, "model", "Tell me the capital of France") == "Paris"
+    assert await cache.get(agent, "model", "Capital of Poland?") is None
+    assert cache.stats() == {"hits": 1, "misses": 1, "size": 1}
+
+
+@pytest.mark.asyncio
+async def test_similarity_needs_cached_prompts(agent: Agent):
+    embedding_model = WordsEmbeddingModel()
+    cache = ResponseCache(similarity_threshold=0.9, embedding_model=embedding_model)
+    # When: Nothing is cached yet
+    assert await cache.get(agent, "model", "Capital of France?") is None
+    # Then: The prompt isn't embedded
+    assert embedding_model.texts == []
+    # When: Only prompts of another model are cached
+    await cache.put(agent, "other-model", "Capital of France?", "Paris")
+    assert await cache.get(agent, "model", "Capital of France?") is None
+    # Then: The prompt isn't embedded either (only the cached one was)
+    assert embedding_model.texts == ["capital of france"]
+    assert cache.stats() == {"hits": 0, "misses": 2, "size": 1}
+
+
+@pytest.mark.asyncio
+async def test_replay():
+    answer = "x" * 450
+
+    chunks = [c async for c in ResponseCache.replay(answer)]
+
+    assert [len(c) for c in chunks] == [200, 200, 50]
+    assert "".join(chunks) == answer
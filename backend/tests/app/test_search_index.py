@@ -0,0 +1,168 @@
+import threading
+import time
+
+import pytest
+
+from app.cache import TTLCache
+from app.chat.chat_model import ChatSession
+from app.chat.search_index import ChatSearchDocument, ChatSearchIndex, tokenize
+from app.chat.message import ChatMessage
+
+
+@pytest.fixture
+def search_index(factory):
+    return ChatSearchIndex(factory, TTLCache(max_entries=10, ttl_seconds=60))
+
+
+def chat_session(chat_session_id: str, *contents: str) -> ChatSession:
+    return ChatSession(
+        chat_session_id=chat_session_id,
+        user="test@test.com",
+        summary=f"Chat {chat_session_id}",
+        history=[
+            ChatMessage(author="user" if i % 2 == 0 else "ai", content=c)
+            for i, c in enumerate(contents)
+        ],
+    )
+
+
+def test_tokenize_ignores_case_and_diacritics():
+    assert tokenize("Zażółć GĘŚLĄ jaźń, a B2") == ["zazołc", "gesla", "jazn", "b2"]
+
+
+def test_search_ranks_sessions(search_index: ChatSearchIndex):
+    # Given: Sessions mentioning the searched terms a different number of times
+    search_index.update(chat_session("s1", "How to cook pasta?", "Boil water."))
+    search_index.update(chat_session("s2", "Pasta or pizza?", "Pasta, pasta!"))
+    search_index.update(chat_session("s3", "What is BM25?", "A ranking function."))
+    # When: The user searches
+    results = search_index.search("test@test.com", "PASTA")
+    # Then: Matching sessions are returned, the best one first
+    assert [r.chat_session_id for r in results] == ["s2", "s1"]
+    assert results[0].summary == "Chat s2"
+    assert results[1].snippet == "How to cook pasta?"
+    # And: Other users' sessions aren't searched
+    assert search_index.search("other@test.com", "pasta") == []
+
+
+def test_update_indexes_new_messages(search_index: ChatSearchIndex):
+    session = chat_session("s1", "Hello", "Hi")
+    search_index.update(session)
+    # Given: The index of the user is loaded
+    assert search_index.search("test@test.com", "kubernetes") == []
+    # When: The session is saved with new messages
+    session.history.append(ChatMessage(author="user", content="What is Kubernetes?"))
+    search_index.update(session)
+    # Then: The new message is found and earlier ones aren't counted twice
+    assert [r.chat_session_id for r in search_index.search("test@test.com", "hello")]
+    document = search_index._create_storage("test@test.com").get("s1")
+    assert document.term_counts() == {
+        "hello": 1,
+        "hi": 1,
+        "what": 1,
+        "is": 1,
+        "kubernetes": 1,
+    }
+    results = search_index.search("test@test.com", "kubernetes")
+    assert [r.chat_session_id for r in results] == ["s1"]
+    # When: The session is deleted
+    search_index.delete("test@test.com", "s1")
+    # Then: It isn't found
+    assert search_index.search("test@test.com", "kubernetes") == []
+
+
+def test_snippet_of_long_text(search_index: ChatSearchIndex):
+    text = "word " * 100 + "needle " + "word " * 100
+    snippet = search_index.snippet(["no match", text], "needle")
+    assert snippet.startswith("…") and snippet.endswith("…")
+    assert "needle" in snippet
+    assert len(snippet) <= search_index.SNIPPET_LENGTH + 2
+
+
+def test_snippet_ignores_diacritics(search_index: ChatSearchIndex):
+    # When: The query is written without diacritics
+    snippet = search_index.snippet(["Nic", "Zażółć gęślą jaźń"], "gesla")
+    # Then: The text is matched as by the index
+    assert snippet == "Zażółć gęślą jaźń"
+    # And: The fragment starts at the original position of the match
+    text = "ą" * 100 + " gęślą " + "x" * 100
+    assert search_index.snippet([text], "GĘŚLĄ").startswith("…" + "ą" * 52 + " gęślą")
+
+
+def test_outdated_session_is_not_indexed(search_index: ChatSearchIndex):
+    session = chat_session("s1", "Hello", "Hi", "What is Kubernetes?", "A tool.")
+    # Given: The session with all messages is indexed
+    search_index.update(session)
+    # When: An earlier state of the session is indexed later
+    search_index.update(session.model_copy(update={"history": session.history[:2]}))
+    # Then: Terms of later messages are kept
+    document = search_index._create_storage("test@test.com").get("s1")
+    assert document.message_count == 4
+    assert document.term_counts()["kubernetes"] == 1
+
+
+class SlowStorage:
+    """Storage reading documents slowly, so concurrent updates overlap."""
+
+    def __init__(self, storage):
+        self.storage = storage
+
+    def get(self, key: str):
+        document = self.storage.get(key)
+        time.sleep(0.1)
+        return document
+
+    def save(self, document) -> None:
+        self.storage.save(document)
+
+
+def test_concurrent_updates_are_serialized(search_index: ChatSearchIndex):
+    storage = search_index._create_storage("test@test.com")
+    search_index._create_storage = lambda user: SlowStorage(storage)
+    session = chat_session("s1", "Hello", "Hi", "What is Kubernetes?", "A tool.")
+    search_index.update(session.model_copy(update={"history": session.history[:1]}))
+    # When: Two turns are indexed at the same time, the later one first
+    threads = [
+        threading.Thread(target=search_index.update, args=(s,))
+        for s in (
+            session,
+            session.model_copy(update={"history": session.history[:2]}),
+        )
+    ]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.02)
+    for thread in threads:
+        thread.join()
+    # Then: No terms are lost
+    document = storage.get("s1")
+    assert document.message_count == 4
+    assert set(document.term_counts()) == {"hello", "hi", "what", "is", "kubernetes", "tool"}  # fmt: skip
+
+
+def test_terms_are_not_map_keys(search_index: ChatSearchIndex):
+    # Given: A message with a term Firestore doesn't accept as a map key
+    search_index.update(chat_session("s1", "Where is __init__ called?", "Twice."))
+    # When: The session is stored
+    document = search_index._create_storage("test@test.com").get("s1")
+    # Then: Terms are stored as a list of strings
+    assert "__init__ 1" in document.terms
+    assert document.term_counts()["__init__"] == 1
+    # And: The session is found by the term
+    results = search_index.search("test@test.com", "__init__")
+    assert [r.chat_session_id for r in results] == ["s1"]
+
+
+def test_terms_are_limited(search_index: ChatSearchIndex):
+    search_index.MAX_TERMS = 2
+    search_index.update(chat_session("s1", "pasta pasta pizza pizza pizza sauce"))
+
+    document = search_index._create_storage("test@test.com").get("s1")
+    assert document.term_counts() == {"pizza": 3, "pasta": 2}
+
+
+def test_terms_map_of_old_version():
+    document = ChatSearchDocument(
+        chat_session_id="s1", user="test@test.com", terms={"hello": 2}
+    )
+    assert document.term_counts() == {"hello": 2}
@@ -0,0 +1,245 @@
+import dataclasses
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from app.chat.chat_model import ChatSession, ChatSessionHeader
+from app.chat.session_queries import FirestoreSessionQueries, SessionQueries
+
+
+class FakeSnapshot:
+    def __init__(self, doc_id: str, data: dict = None):
+        self.id = doc_id
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self) -> dict:
+        return dict(self._data)
+
+
+class FakeDocument:
+    def __init__(self, collection: "FakeCollection", doc_id: str):
+        self.collection = collection
+        self.id = doc_id
+
+    def get(self, field_paths: list[str] = None) -> FakeSnapshot:
+        data = self.collection.docs.get(self.id)
+        if data is not None and field_paths:
+            data = {f: data[f] for f in field_paths if f in data}
+        return FakeSnapshot(self.id, data)
+
+
+@dataclasses.dataclass(frozen=True)
+class FakeQuery:
+    """The subset of the Firestore query API used by the queries."""
+
+    collection: "FakeCollection"
+    filters: tuple = ()
+    order: str = None
+    fields: tuple = None
+    after: str = None
+    count: int = None
+
+    def where(self, filter):
+        return dataclasses.replace(self, filters=self.filters + (filter,))
+
+    def order_by(self, field_path: str, direction: str):
+        assert direction == "DESCENDING"
+        return dataclasses.replace(self, order=field_path)
+
+    def select(self, field_paths: list[str]):
+        return dataclasses.replace(self, fields=tuple(field_paths))
+
+    def start_after(self, snapshot: FakeSnapshot):
+        return dataclasses.replace(self, after=snapshot.id)
+
+    def limit(self, count: int):
+        return dataclasses.replace(self, count=count)
+
+    def stream(self):
+        self.collection.queries.append(self)
+        items = [
+            (doc_id, data)
+            for doc_id, data in self.collection.docs.items()
+            if all(data.get(f.field_path) == f.value for f in self.filters)
+        ]
+        if self.order:
+            items.sort(key=lambda i: i[1][self.order], reverse=True)
+        if self.after:
+            ids = [doc_id for doc_id, _ in items]
+            items = items[ids.index(self.after) + 1 :]
+        for doc_id, data in items[: self.count]:
+            if self.fields:
+                data = {f: data[f] for f in self.fields if f in data}
+            yield FakeSnapshot(doc_id, data)
+
+
+class FakeBatch:
+    def __init__(self, client: "FakeClient"):
+        self.client = client
+        self.writes = []
+
+    def set(self, ref: FakeDocument, data: dict) -> None:
+        self.writes.append((ref, data))
+
+    def delete(self, ref: FakeDocument) -> None:
+        self.writes.append((ref, None))
+
+    def commit(self) -> None:
+        self.client.commits.append(len(self.writes))
+        for ref, data in self.writes:
+            if data is None:
+                ref.collection.docs.pop(ref.id, None)
+            else:
+                ref.collection.docs[ref.id] = data
+
+
+class FakeClient:
+    def __init__(self):
+        self.commits = []
+
+    def batch(self) -> FakeBatch:
+        return FakeBatch(self)
+
+
+class FakeCollection:
+    def __init__(self, client: FakeClient = None):
+        self.docs = {}
+        self.queries = []
+        self._client = client or FakeClient()
+
+    def list_documents(self) -> list[FakeDocument]:
+        return [FakeDocument(self, doc_id) for doc_id in self.docs]
+
+    def document(self, doc_id: str) -> FakeDocument:
+        return FakeDocument(self, doc_id)
+
+    def where(self, filter) -> FakeQuery:
+        return FakeQuery(self).where(filter)
+
+    def order_by(self, field_path: str, direction: str) -> FakeQuery:
+        return FakeQuery(self).order_by(field_path, direction)
+
+    def select(self, field_paths: list[str]) -> FakeQuery:
+        return FakeQuery(self).select(field_paths)
+
+    def stream(self):
+        return FakeQuery(self).stream()
+
+
+def fake_storage(*sessions: ChatSession, client: FakeClient = None):
+    coll_ref = FakeCollection(client)
+    for s in sessions:
+        coll_ref.docs[s.chat_session_id] = s.model_dump(exclude_none=True)
+    return SimpleNamespace(_coll_ref=coll_ref)
+
+
+@pytest.fixture
+def sessions():
+    return [
+        ChatSession(
+            chat_session_id=f"s{i}",
+            user="test@test.com" if i < 3 else "other@test.com",
+            created=datetime(2025, 1, 1 + i),
+        )
+        for i in range(4)
+    ]
+
+
+def test_find_runs_query_in_firestore(sessions):
+    storage = fake_storage(*sessions)
+    # When: The newest sessions of the user are found
+    found = FirestoreSessionQueries().find(
+        storage,
+        ChatSessionHeader,
+        fields=["chat_session_id", "user", "created"],
+        user="test@test.com",
+        newest_first=True,
+        limit=2,
+    )
+    # Then: Only the selected fields of the first page are read
+    assert [h.chat_session_id for h in found] == ["s2", "s1"]
+    [query] = storage._coll_ref.queries
+    assert query.fields == ("chat_session_id", "user", "created")
+    assert query.count == 2
+
+
+def test_find_starts_after_cursor(sessions):
+    storage = fake_storage(*sessions)
+    queries = FirestoreSessionQueries()
+    # When: The page after the cursor is found
+    found = queries.find(
+        storage, ChatSessionHeader, user="test@test.com", newest_first=True, cursor="s2"
+    )
+    # Then: It starts after the cursor
+    assert [h.chat_session_id for h in found] == ["s1", "s0"]
+    # And: A page after a deleted session is empty
+    assert queries.find(storage, ChatSessionHeader, cursor="deleted") == []
+
+
+def test_firestore_and_storage_queries_agree(factory, sessions):
+    storage = factory.create_storage(
+        "ChatSessions", ChatSession, key_name="chat_session_id"
+    )
+    for s in sessions:
+        storage.save(s)
+    for kwargs in (
+        {},
+        {"user": "test@test.com"},
+        {"newest_first": True, "limit": 3},
+        {"user": "test@test.com", "newest_first": True, "cursor": "s1"},
+    ):
+        # When: The same query is run in Firestore and over the storage
+        found = FirestoreSessionQueries().find(
+            fake_storage(*sessions), ChatSessionHeader, **kwargs
+        )
+        expected = SessionQueries().find(storage, ChatSessionHeader, **kwargs)
+        # Then: The same headers are found
+        assert sorted(h.chat_session_id for h in found) == sorted(
+            h.chat_session_id for h in expected
+        )
+        if kwargs.get("newest_first"):
+            assert found == expected
+
+
+def test_batch_is_committed_at_once(sessions):
+    client = FakeClient()
+    sessions_storage = fake_storage(client=client)
+    index = fake_storage(client=client)
+    # When: A session and its header are written in a batch
+    with FirestoreSessionQueries().batch() as batch:
+        batch.put(sessions_storage, "s0", sessions[0])
+        batch.put(index, "s0", ChatSessionHeader(**sessions[0].model_dump()))
+    # Then: Both are written in one commit
+    assert client.commits == [2]
+    assert sessions_storage._coll_ref.docs["s0"]["user"] == "test@test.com"
+    assert index._coll_ref.docs["s0"]["created"] == datetime(2025, 1, 1)
+
+
+def test_batch_is_not_committed_on_error(sessions):
+    storage = fake_storage(*sessions)
+    # When: The block of the batch fails
+    with pytest.raises(ValueError):
+        with FirestoreSessionQueries().batch() as batch:
+            batch.delete(storage, "s0")
+            raise ValueError()
+    # Then: Nothing is written
+    assert storage._coll_ref._client.commits == []
+    assert "s0" in storage._coll_ref.docs
+
+
+def test_batch_is_split_by_batch_size(sessions):
+    client = FakeClient()
+    messages = fake_storage(*sessions[:3], client=client)
+    storage = fake_storage(*sessions, client=client)
+    queries = FirestoreSessionQueries()
+    queries.BATCH_SIZE = 2
+    # When: Three messages and the session are deleted
+    with queries.batch() as batch:
+        batch.drop(messages)
+        batch.delete(storage, "s0")
+    # Then: They are deleted in batches of the max. size
+    assert client.commits == [2, 2]
+    assert messages._coll_ref.docs == {}
+    assert "s0" not in storage._coll_ref.docs
@@ -0,0 +1,109 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.chat.chat_model import ChatSession
+from app.chat.chat_session_storage import ChatSessionStorage
+from app.chat.message import ChatMessage
+from app.chat.session_write_queue import SessionWriteQueue
+
+
+class FlakyStorage(ChatSessionStorage):
+    """Storage which fails the first `failures` saves."""
+
+    def __init__(self, factory, failures: int = 0):
+        super().__init__(factory)
+        self.failures = failures
+        self.saves = 0
+
+    def save(self, chat_session: ChatSession) -> None:
+        self.saves += 1
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("Firestore unavailable")
+        super().save(chat_session)
+
+
+def chat_session(*contents: str) -> ChatSession:
+    return ChatSession(
+        chat_session_id="s1",
+        user="test@test.com",
+        history=[ChatMessage(author="user", content=c) for c in contents],
+    )
+
+
+@pytest.mark.asyncio
+async def test_writes_are_coalesced(factory):
+    storage = FlakyStorage(factory)
+    queue = SessionWriteQueue()
+    # When: The session is saved twice before the queue runs
+    queue.save(storage, chat_session("Hello"))
+    queue.save(storage, chat_session("Hello", "Hi"))
+    # Then: The latest version can be read before it is written
+    assert len(queue.get("s1").history) == 2
+    # And: It is written once
+    await queue.flush()
+    assert storage.saves == 1
+    assert len(storage.get("s1").history) == 2
+    assert queue.get("s1") is None
+
+
+@pytest.mark.asyncio
+async def test_queued_session_is_not_archived(factory):
+    storage = FlakyStorage(factory)
+    storage.save(chat_session("Hello"))
+    queue = SessionWriteQueue()
+    # Given: The next turn of the session is queued
+    queue.save(storage, chat_session("Hello", "Hi"))
+    assert queue.is_pending("s1")
+    # When: Old sessions are archived
+    archived = storage.archive_older_than(
+        datetime.now() + timedelta(days=1), skip=queue.is_pending
+    )
+    # Then: The session with the pending write is left
+    assert archived == 0
+    assert not storage.sessions.get("s1").archived
+    # And: It is written as usual
+    await queue.flush()
+    assert not queue.is_pending("s1")
+    assert len(storage.get("s1").history) == 2
+
+
+@pytest.mark.asyncio
+async def test_failed_write_is_retried(factory):
+    storage = FlakyStorage(factory, failures=2)
+    queue = SessionWriteQueue(retry_delay_seconds=0.001)
+
+    queue.save(storage, chat_session("Hello"))
+    await queue.flush()
+
+    assert storage.saves == 3
+    assert len(storage.get("s1").history) == 1
+
+
+@pytest.mark.asyncio
+async def test_summary_is_applied_to_queued_session(factory):
+    storage = FlakyStorage(factory)
+    queue = SessionWriteQueue()
+    queue.save(storage, chat_session("Hello", "Hi"))
+    # When: The summary is updated before the session is written
+    summarized = chat_session("Hello", "Hi")
+    summarized.history_summary = "Greetings"
+    summarized.summarized_count = 1
+    queue.update_summary(storage, summarized)
+    await queue.flush()
+    # Then: The written session contains the summary
+    assert storage.get("s1").history_summary == "Greetings"
+
+
+@pytest.mark.asyncio
+async def test_discard(factory):
+    storage = FlakyStorage(factory)
+    queue = SessionWriteQueue()
+    queue.save(storage, chat_session("Hello"))
+
+    await queue.discard("s1")
+    await queue.flush()
+
+    assert storage.saves == 0
+    assert queue.get("s1") is None
@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+
+from app.chat.chat_service import StreamedEvent
+from app.chat.stream_buffer import StreamOffsetError, StreamRegistry
+
+
+async def events(count: int, delay: float = 0):
+    for i in range(count):
+        await asyncio.sleep(delay)
+        yield StreamedEvent(type="text", value=str(i))
+
+
+async def collect(stream) -> list[str]:
+    return [e.value async for e in stream]
+
+
+@pytest.mark.asyncio
+async def test_resume_from_offset():
+    registry = StreamRegistry()
+    buffer = registry.start("chat1", "user", events(5), resumable=True)
+    # When: The client reads two events and disconnects
+    stream = buffer.read()
+    assert [(await anext(stream)).value for _ in range(2)] == ["0", "1"]
+    await stream.aclose()
+    # Then: The rest is read after reconnecting
+    assert await collect(registry.get(buffer.stream_id).read(2)) == ["2", "3", "4"]
+
+
+@pytest.mark.asyncio
+async def test_buffer_is_bounded():
+    registry = StreamRegistry(max_events=2)
+    buffer = registry.start("chat1", "user", events(5))
+    await buffer.task
+
+    assert buffer.first_offset == 3
+    assert await collect(buffer.read(3)) == ["3", "4"]
+    with pytest.raises(StreamOffsetError):
+        await collect(buffer.read(0))
+
+
+@pytest.mark.asyncio
+async def test_abandoned_stream_is_cancelled():
+    registry = StreamRegistry(resume_grace_seconds=0.01)
+    buffer = registry.start("chat1", "user", events(100, delay=0.01), resumable=True)
+    # When: The only reader leaves
+    stream = buffer.read()
+    await anext(stream)
+    await stream.aclose()
+    await asyncio.sleep(0.05)
+    # Then: The producer is cancelled
+    assert buffer.task.cancelled()
+    assert buffer.done
+
+
+@pytest.mark.asyncio
+async def test_stream_is_cancelled_upstream_at_once():
+    upstream_closed = asyncio.Event()
+
+    async def upstream():
+        try:
+            yield StreamedEvent(type="text", value="0")
+            await asyncio.sleep(10)
+        finally:
+            upstream_closed.set()
+
+    registry = StreamRegistry(resume_grace_seconds=30)
+    buffer = registry.start("chat1", "user", upstream())
+    # When: The reader of the stream which isn't resumable leaves
+    stream = buffer.read()
+    await anext(stream)
+    await stream.aclose()
+    # Then: The upstream is closed without waiting for the grace period
+    await asyncio.wait_for(upstream_closed.wait(), 1)
+    await asyncio.gather(buffer.task, return_exceptions=True)
+    assert buffer.task.cancelled()
@@ -0,0 +1,138 @@
+import asyncio
+import gzip
+import json
+
+import pytest
+from pydantic import BaseModel
+
+from app.streaming import (
+    cancel_on_disconnect,
+    encode_json_array,
+    gzip_chunks,
+    ndjson_lines,
+)
+
+
+class RequestStub:
+    def __init__(self):
+        self.disconnected = False
+
+    async def is_disconnected(self) -> bool:
+        return self.disconnected
+
+
+@pytest.mark.asyncio
+async def test_events_are_passed():
+    async def events():
+        yield 1
+        yield 2
+
+    ret = [e async for e in cancel_on_disconnect(RequestStub(), events())]
+
+    assert ret == [1, 2]
+
+
+@pytest.mark.asyncio
+async def test_producer_is_cancelled_on_disconnect():
+    request = RequestStub()
+    cancelled = asyncio.Event()
+
+    async def events():
+        yield 1
+        try:
+            await asyncio.sleep(10)  # Waiting for the model
+            yield 2
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    ret = []
+    async for e in cancel_on_disconnect(request, events(), poll_interval=0.01):
+        ret.append(e)
+        request.disconnected = True
+
+    assert ret == [1]
+    assert cancelled.is_set()
+
+
+@pytest.mark.asyncio
+async def test_producer_is_closed_when_consumer_stops():
+    closed = asyncio.Event()
+
+    async def events():
+        try:
+            yield 1
+            yield 2
+        except GeneratorExit:
+            closed.set()
+            raise
+
+    stream = cancel_on_disconnect(RequestStub(), events())
+    assert await anext(stream) == 1
+    await stream.aclose()
+
+    assert closed.is_set()
+
+
+class Event(BaseModel):
+    value: str
+
+
+async def delayed_events(*delays: float):
+    for i, delay in enumerate(delays):
+        await asyncio.sleep(delay)
+        yield Event(value=str(i))
+
+
+@pytest.mark.asyncio
+async def test_json_array_is_parsable_line_by_line():
+    frames = [f async for f in encode_json_array(delayed_events(0, 0, 0))]
+
+    text = b"".join(frames).decode()
+    assert json.loads(text) == [{"value": "0"}, {"value": "1"}, {"value": "2"}]
+    # Every line between "[" and "]" without its leading "," is one item
+    lines = text.splitlines()
+    assert lines[0] == "[" and lines[-1] == "]"
+    assert not lines[1].startswith(",")
+    items = [json.loads(line.removeprefix(",")) for line in lines[1:-1]]
+    assert items == json.loads(text)
+
+
+@pytest.mark.asyncio
+async def test_frames_are_coalesced():
+    # When: Two events come at once and the third one later
+    frames = [
+        f
+        async for f in encode_json_array(
+            delayed_events(0, 0, 0.05), coalesce_seconds=0.01
+        )
+    ]
+    # Then: The first two are written together
+    assert frames[0] == b'[\n{"value":"0"}\n,{"value":"1"}\n'
+    assert frames[1] == b',{"value":"2"}\n]'
+
+
+@pytest.mark.asyncio
+async def test_empty_json_array():
+    frames = [f async for f in encode_json_array(delayed_events())]
+
+    assert json.loads(b"".join(frames)) == []
+
+
+def test_gzip_ndjson_is_produced_lazily():
+    consumed = []
+
+    def items():
+        for i in range(1000):
+            consumed.append(i)
+            yield Event(value=str(i) * 100)
+
+    chunks = gzip_chunks(ndjson_lines(items()))
+    # When: The first compressed chunk is produced
+    first = next(chunks)
+    # Then: Not all items were read
+    assert len(consumed) < 1000
+    # And: The whole stream is valid gzip NDJSON
+    lines = gzip.decompress(first + b"".join(chunks)).splitlines()
+    assert [json.loads(line)["value"][:3] for line in lines[:2]] == ["000", "111"]
+    assert len(lines) == 1000
@@ -0,0 +1,49 @@
+import pytest
+
+from ai_agents import AIAgent
+from app.chat.title_generator import ChatTitleGenerator
+
+
+class TitleAgentStub(AIAgent):
+    """Local stand-in for the title model."""
+
+    def __init__(self, title: str):
+        super().__init__(ai_model_name="stub")
+        self.title = title
+        self.prompts = []
+
+    def run(self, prompt: str) -> str:
+        self.prompts.append(prompt)
+        return self.title
+
+
+def test_truncate_long_first_message():
+    generator = ChatTitleGenerator(max_length=20)
+
+    title = generator.truncate(
+        "\nPlease review this document carefully\n" + "x" * 10000
+    )
+
+    assert title == "Please review this…"
+    assert len(title) <= 20
+
+
+def test_truncate_short_message():
+    assert ChatTitleGenerator().truncate("Hello") == "Hello"
+
+
+@pytest.mark.asyncio
+async def test_generate_title():
+    agent = TitleAgentStub('"Capital of France"\n')
+    generator = ChatTitleGenerator(agent)
+
+    title = await generator.generate("x" * 10000, "Paris")
+
+    assert title == "Capital of France"
+    # Only an excerpt of a long prompt is sent
+    assert len(agent.prompts[0]) < 2 * ChatTitleGenerator.EXCERPT_LENGTH + 500
+
+
+@pytest.mark.asyncio
+async def test_without_agent_no_title_is_generated():
+    assert await ChatTitleGenerator().generate("Hello", "Hi") == ""
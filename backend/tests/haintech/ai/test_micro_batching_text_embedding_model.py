@@ -0,0 +1,87 @@
+import asyncio
+from typing import List
+
+import pytest
+
+from haintech.ai.base.base_ai_text_embedding_model import BaseAITextEmbeddingModel
+from haintech.ai.base.micro_batching_text_embedding_model import (
+    MicroBatchingTextEmbeddingModel,
+)
+
+
+class BatchRecordingModel(BaseAITextEmbeddingModel):
+    def __init__(self, error: Exception = None):
+        self.batches = []
+        self.error = error
+
+    async def get_embedding(self, text: str) -> List[float]:
+        return (await self.get_embeddings([text]))[0]
+
+    async def get_embeddings(self, texts: List[str]) -> List[List[float]]:
+        self.batches.append(texts)
+        if self.error:
+            raise self.error
+        return [[float(len(t))] for t in texts]
+
+
+@pytest.mark.asyncio
+async def test_concurrent_calls_are_batched():
+    model = BatchRecordingModel()
+    batching = MicroBatchingTextEmbeddingModel(model, max_batch_size=3)
+    # When: Texts are embedded concurrently
+    embeddings = await asyncio.gather(
+        *[batching.get_embedding(t) for t in ["a", "bb", "a", "ccc", "dddd"]]
+    )
+    # Then: Each call gets its embedding
+    assert embeddings == [[1.0], [2.0], [1.0], [3.0], [4.0]]
+    # And: The model is called with full batches of unique texts
+    assert model.batches == [["a", "bb"], ["ccc", "dddd"]]
+
+
+@pytest.mark.asyncio
+async def test_errors_are_raised_to_all_calls():
+    model = BatchRecordingModel(error=RuntimeError("quota"))
+    batching = MicroBatchingTextEmbeddingModel(model)
+
+    results = await asyncio.gather(
+        batching.get_embedding("a"),
+        batching.get_embedding("b"),
+        return_exceptions=True,
+    )
+
+    assert [str(r) for r in results] == ["quota", "quota"]
+    assert model.batches == [["a", "b"]]
+
+
+@pytest.mark.asyncio
+async def test_cancelled_batch_releases_calls():
+    class HangingModel(BatchRecordingModel):
+        async def get_embeddings(self, texts: List[str]) -> List[List[float]]:
+            self.batches.append(texts)
+            await asyncio.Event().wait()
+
+    model = HangingModel()
+    batching = MicroBatchingTextEmbeddingModel(model)
+    calls = asyncio.gather(
+        batching.get_embedding("a"),
+        batching.get_embedding("b"),
+        return_exceptions=True,
+    )
+    # Given: The batch is being embedded
+    while not model.batches:
+        await asyncio.sleep(0.001)
+    # When: The batch is cancelled (e.g. on shutdown)
+    for task in list(batching._tasks):
+        task.cancel()
+    # Then: Waiting calls are cancelled instead of hanging
+    results = await asyncio.wait_for(calls, timeout=1)
+    assert all(isinstance(r, asyncio.CancelledError) for r in results)
+
+
+@pytest.mark.asyncio
+async def test_default_get_embeddings():
+    class SingleTextModel(BaseAITextEmbeddingModel):
+        async def get_embedding(self, text: str) -> List[float]:
+            return [float(len(text))]
+
+    assert await SingleTextModel().get_embeddings(["a", "bb"]) == [[1.0], [2.0]]
@@ -33,3 +33,16 @@ class TestAIAgent(unittest.TestCase):
         for chunk in g:
             response += chunk.text
         self.assertIn("George Washington", response)
+
+
+class TestAIAgentAsync(unittest.IsolatedAsyncioTestCase):
+    async def test_chat_streaming_async(self):
+        agent = AIAgent(ai_model_name="gemini-1.5-flash")
+        chat = agent.start_chat()
+        response = ""
+        async for chunk in chat.send_message_streaming_async(
+            "Who was the first president of the United States?"
+        ):
+            response += chunk.text
+        self.assertIn("George Washington", response)
+        self.assertEqual(2, len(chat.get_history()))